@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+Latency of the flattened forest engine (forest_engine.py) against pipe.predict_proba, on
+a local copy of the training data: cold start (load of the export) and prediction time
+per batch size, for the classifier alone and for the whole pipeline.
+
+usage: python bench_forest_engine.py --train_data data_train.csv --model_config random_forest_config.yml
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import cloudpickle
+import numpy as np
+import pandas as pd
+import yaml
+from sklearn.model_selection import train_test_split
+
+from forest_engine import FlatForestPipeline, save_flat_forest
+from run import build_pipeline, load_typed_data
+
+
+def best_time(func, repeat):
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def go(args):
+
+    with open(args.model_config) as fp:
+        model_config = yaml.safe_load(fp)
+
+    df = load_typed_data(args.train_data, model_config["features"])
+    X = df.copy()
+    y = X.pop("genre")
+    X_train, X_val, y_train, _ = train_test_split(
+        X, y, test_size=0.3, stratify=y, random_state=42
+    )
+    pipe = build_pipeline(model_config).fit(X_train, y_train)
+
+    rows = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        pickle_path = os.path.join(temp_dir, "pipe.pkl")
+        with open(pickle_path, "wb") as fp:
+            cloudpickle.dump(pipe, fp)
+        flat_dir = os.path.join(temp_dir, "flat_forest")
+        save_flat_forest(pipe["classifier"], flat_dir, preprocessor=pipe[:-1])
+
+        def load_pickle():
+            with open(pickle_path, "rb") as fp:
+                return cloudpickle.load(fp)
+
+        rows.append({
+            "phase": "cold_start",
+            "sklearn_ms": 1000 * best_time(load_pickle, args.repeat),
+            "flat_ms": 1000 * best_time(lambda: FlatForestPipeline.load(flat_dir), args.repeat),
+        })
+
+        flat = FlatForestPipeline.load(flat_dir)
+        assert np.allclose(flat.predict_proba(X_val), pipe.predict_proba(X_val))
+
+        X_transformed = pipe[:-1].transform(X_val)
+        for batch_size in args.batch_sizes:
+            batch, transformed = X_val.iloc[:batch_size], X_transformed[:batch_size]
+            rows.append({
+                "phase": f"classifier_{batch_size}",
+                "sklearn_ms": 1000 * best_time(
+                    lambda: pipe["classifier"].predict_proba(transformed), args.repeat
+                ),
+                "flat_ms": 1000 * best_time(
+                    lambda: flat.forest.predict_proba(transformed), args.repeat
+                ),
+            })
+            rows.append({
+                "phase": f"pipeline_{batch_size}",
+                "sklearn_ms": 1000 * best_time(lambda: pipe.predict_proba(batch), args.repeat),
+                "flat_ms": 1000 * best_time(lambda: flat.predict_proba(batch), args.repeat),
+            })
+
+    results = pd.DataFrame(rows).set_index("phase")
+    results["speedup"] = results["sklearn_ms"] / results["flat_ms"]
+    print(results.round(3).to_string())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the flattened forest engine")
+
+    parser.add_argument(
+        "--train_data", type=str, help="Path to a local copy of the training data", required=True
+    )
+
+    parser.add_argument(
+        "--model_config",
+        type=str,
+        help="Path to a YAML file containing the configuration for the random forest",
+        required=True,
+    )
+
+    parser.add_argument(
+        "--batch_sizes", type=int, nargs="+", help="Rows per prediction call", default=[1, 100, 1000]
+    )
+
+    parser.add_argument("--repeat", type=int, help="Repetitions, the best time is kept", default=5)
+
+    args = parser.parse_args()
+
+    go(args)
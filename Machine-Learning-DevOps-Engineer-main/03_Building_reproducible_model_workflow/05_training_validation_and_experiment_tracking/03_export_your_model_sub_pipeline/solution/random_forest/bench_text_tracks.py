@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Compares the text tracks of the random forest pipeline (tfidf.method in the model config)
+on a local copy of the training data: fit time of the text track and of the whole
+pipeline, size of the pickled pipeline and validation AUC, on the same split as run.py.
+
+usage: python bench_text_tracks.py --train_data data_train.csv --model_config random_forest_config.yml
+"""
+import argparse
+import copy
+import pickle
+import time
+
+import pandas as pd
+import yaml
+from sklearn.metrics import roc_auc_score
+from sklearn.model_selection import train_test_split
+
+from run import build_pipeline, load_typed_data
+
+
+def benchmark_track(model_config, tfidf_config, X_train, X_val, y_train, y_val):
+
+    config = copy.deepcopy(model_config)
+    config["tfidf"] = tfidf_config
+    pipe = build_pipeline(config)
+
+    text_track = pipe["preprocessor"].transformers[2][1]
+    start = time.perf_counter()
+    text_track.fit(X_train[sorted(config["features"]["nlp"])])
+    text_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pipe.fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - start
+
+    score = roc_auc_score(y_val, pipe.predict_proba(X_val), average="macro", multi_class="ovo")
+    return {
+        "text_fit_seconds": text_seconds,
+        "fit_seconds": fit_seconds,
+        "model_mb": len(pickle.dumps(pipe)) / 1024 ** 2,
+        "text_track_kb": len(pickle.dumps(pipe["preprocessor"].named_transformers_["nlp1"])) / 1024,
+        "AUC": score,
+    }
+
+
+def go(args):
+
+    with open(args.model_config) as fp:
+        model_config = yaml.safe_load(fp)
+
+    df = load_typed_data(args.train_data, model_config["features"])
+    X = df.copy()
+    y = X.pop("genre")
+    X_train, X_val, y_train, y_val = train_test_split(
+        X, y, test_size=0.3, stratify=y, random_state=42
+    )
+
+    tracks = {f"tfidf_{model_config['tfidf']['max_features']}": {
+        "method": "tfidf", "max_features": model_config["tfidf"]["max_features"]
+    }}
+    for n_features in args.n_features:
+        for use_idf in (True, False):
+            tracks[f"hashing_{n_features}{'_idf' if use_idf else ''}"] = {
+                "method": "hashing", "n_features": n_features, "use_idf": use_idf
+            }
+
+    results = pd.DataFrame({
+        name: benchmark_track(model_config, tfidf_config, X_train, X_val, y_train, y_val)
+        for name, tfidf_config in tracks.items()
+    }).T
+    print(results.round(4).to_string())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the text tracks of the pipeline")
+
+    parser.add_argument(
+        "--train_data", type=str, help="Path to a local copy of the training data", required=True
+    )
+
+    parser.add_argument(
+        "--model_config",
+        type=str,
+        help="Path to a YAML file containing the configuration for the random forest",
+        required=True,
+    )
+
+    parser.add_argument(
+        "--n_features",
+        type=int,
+        nargs="+",
+        help="Sizes of the hashed feature space to compare",
+        default=[256, 1024, 4096],
+    )
+
+    args = parser.parse_args()
+
+    go(args)
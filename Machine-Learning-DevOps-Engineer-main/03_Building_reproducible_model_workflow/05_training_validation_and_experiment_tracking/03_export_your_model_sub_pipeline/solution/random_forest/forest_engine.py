@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+"""
+Flattened export of a fitted RandomForestClassifier and a vectorized NumPy inference engine.
+
+The nodes of all the trees are concatenated into contiguous arrays (feature, threshold,
+children, leaf class probabilities, root of every tree), saved as .npy files that load with
+np.load(mmap_mode="r"): a cold start maps the files instead of unpickling the object graph.
+Prediction advances every (sample, tree) pair one level at a time over those arrays, for
+max_depth levels: leaves point to themselves, so no pair needs to be tracked separately.
+
+The node arrays are those of CompactForest in the churn project (churn_artifacts.py), which
+this step cannot import: the lessons do not share an environment. Two things differ on
+purpose. The export is plain .npy files plus a json, so it loads without unpickling a class of
+this step. And the traversal runs a fixed number of levels instead of compacting the pairs
+still at an internal node: these forests have a bounded max_depth (13 in config.yaml), so
+nearly every pair goes down to it and the compaction CompactForest does for its depth-100
+trees costs more than it saves.
+"""
+import json
+import os
+import pickle
+
+import numpy as np
+import scipy.sparse as sp
+
+ARRAYS = ("feature", "threshold", "children", "value", "roots")
+
+# Rows traversed at once, bounds the (rows x trees) working arrays
+BATCH_SIZE = 4096
+
+
+def flatten_forest(forest):
+
+    trees = [estimator.tree_ for estimator in forest.estimators_]
+    sizes = np.array([tree.node_count for tree in trees])
+    roots = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+
+    # Children indices are made global, leaves point to themselves and test feature 0
+    children = []
+    for tree, root in zip(trees, roots):
+        pairs = np.stack([tree.children_left, tree.children_right], axis=1)
+        leaf = pairs[:, 0] < 0
+        pairs = pairs + root
+        pairs[leaf] = (root + np.flatnonzero(leaf))[:, None]
+        children.append(pairs)
+
+    # Class probabilities of every node, as DecisionTreeClassifier.predict_proba returns them
+    value = np.concatenate([tree.value[:, 0, :] for tree in trees])
+    value = value / value.sum(axis=1, keepdims=True)
+
+    return {
+        "feature": np.maximum(np.concatenate([tree.feature for tree in trees]), 0).astype(np.int32),
+        "threshold": np.concatenate([tree.threshold for tree in trees]),
+        "children": np.concatenate(children).astype(np.int32),
+        "value": value,
+        "roots": roots.astype(np.int32),
+    }
+
+
+def max_depth(forest):
+
+    return int(max(estimator.tree_.max_depth for estimator in forest.estimators_))
+
+
+def save_flat_forest(forest, directory, preprocessor=None):
+
+    os.makedirs(directory, exist_ok=True)
+    for name, array in flatten_forest(forest).items():
+        np.save(os.path.join(directory, f"{name}.npy"), np.ascontiguousarray(array))
+
+    # Labels may be strings, they go to the metadata instead of an object array that
+    # could not be memory-mapped
+    with open(os.path.join(directory, "forest.json"), "w") as fp:
+        json.dump({
+            "classes": forest.classes_.tolist(),
+            "n_features_in": int(forest.n_features_in_),
+            "max_depth": max_depth(forest),
+        }, fp)
+
+    if preprocessor is not None:
+        # cloudpickle ships the transformers defined in run.py by value
+        import cloudpickle
+
+        with open(os.path.join(directory, "preprocessor.pkl"), "wb") as fp:
+            cloudpickle.dump(preprocessor, fp)
+
+
+class FlatForest:
+
+    def __init__(self, feature, threshold, children, value, roots, classes, n_features_in, depth):
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.value = value
+        self.roots = roots
+        self.classes_ = np.asarray(classes)
+        self.n_features_in_ = n_features_in
+        self.depth = depth
+
+    @classmethod
+    def from_forest(cls, forest):
+
+        return cls(
+            **flatten_forest(forest), classes=forest.classes_,
+            n_features_in=forest.n_features_in_, depth=max_depth(forest),
+        )
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r" if mmap else None)
+            for name in ARRAYS
+        }
+        with open(os.path.join(directory, "forest.json")) as fp:
+            meta = json.load(fp)
+        return cls(
+            **arrays, classes=meta["classes"], n_features_in=meta["n_features_in"],
+            depth=meta["max_depth"],
+        )
+
+    def _leaves(self, X):
+
+        # (n_samples * n_trees) current nodes, X is indexed through its flat view
+        n_samples, n_trees = X.shape[0], len(self.roots)
+        flat_X = X.ravel()
+        offsets = np.repeat(np.arange(n_samples) * X.shape[1], n_trees)
+        children = self.children.ravel()
+        nodes = np.tile(np.asarray(self.roots), n_samples)
+        for _ in range(self.depth):
+            # The trees compare float32 features: X[:, f] <= threshold goes left
+            go_right = flat_X[offsets + self.feature[nodes]] > self.threshold[nodes]
+            nodes = children[2 * nodes + go_right]
+        return nodes.reshape(n_samples, n_trees)
+
+    def predict_proba(self, X):
+
+        proba = np.empty((X.shape[0], len(self.classes_)))
+        for start in range(0, X.shape[0], BATCH_SIZE):
+            batch = X[start:start + BATCH_SIZE]
+            batch = batch.toarray() if sp.issparse(batch) else batch
+            batch = np.ascontiguousarray(batch, dtype=np.float32)
+            proba[start:start + len(batch)] = self.value[self._leaves(batch)].mean(axis=1)
+        return proba
+
+    def predict(self, X):
+
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1))
+
+
+class FlatForestPipeline:
+
+    # Exported preprocessor followed by the flattened forest, scores raw dataframes like
+    # the sklearn pipeline
+    def __init__(self, preprocessor, forest):
+        self.preprocessor = preprocessor
+        self.forest = forest
+        self.classes_ = forest.classes_
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+
+        with open(os.path.join(directory, "preprocessor.pkl"), "rb") as fp:
+            preprocessor = pickle.load(fp)
+        return cls(preprocessor, FlatForest.load(directory, mmap))
+
+    def predict_proba(self, X):
+
+        return self.forest.predict_proba(self.preprocessor.transform(X))
+
+    def predict(self, X):
+
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1))
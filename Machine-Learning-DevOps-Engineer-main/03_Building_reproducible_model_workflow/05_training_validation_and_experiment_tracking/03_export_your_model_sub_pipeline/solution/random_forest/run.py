@@ -1,38 +1,71 @@
 #!/usr/bin/env python
 import argparse
+import hashlib
+import json
 import logging
 import os
+import time
 
 import yaml
-import tempfile
 import mlflow
 import pandas as pd
 import numpy as np
 from mlflow.models import infer_signature
 from sklearn.compose import ColumnTransformer
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfVectorizer
 from sklearn.metrics import roc_auc_score, confusion_matrix, ConfusionMatrixDisplay
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import OrdinalEncoder, StandardScaler, FunctionTransformer
+from sklearn.model_selection import ParameterGrid, train_test_split
+from sklearn.preprocessing import OrdinalEncoder, StandardScaler, FunctionTransformer, normalize
 import matplotlib.pyplot as plt
+import scipy.sparse as sp
 import wandb
+import joblib
+from joblib import Parallel, delayed
+
+from pipeline_utils.artifact_cache import ArtifactCache
+from forest_engine import save_flat_forest
+from pipeline_utils.uploader import BackgroundUploader, WandbStore
 from sklearn.pipeline import Pipeline, make_pipeline
 from sklearn.impute import SimpleImputer
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
 logger = logging.getLogger()
 
+# Typed copies of the training data, one Parquet file per (csv content, features section).
+# TYPED_FORMAT is part of the key and changes with the typing rules of process_df, so the
+# files typed by an older version are not reused
+TYPED_FORMAT = 2
+TYPED_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".typed_cache")
+# Fitted preprocessors and transformed train/val matrices of the sweeps
+TRANSFORMED_CACHE_DIR = os.path.join(TYPED_CACHE_DIR, "transformed")
+
 
 def go(args):
 
     run = wandb.init(job_type="train")
 
-    logger.info("Downloading and reading test artifact")
-    train_data_path = run.use_artifact(args.train_data).file()
-    df = pd.read_csv(train_data_path, low_memory=False)
+    with open(args.model_config) as fp:
+        model_config = yaml.safe_load(fp)
+
+    # Input artifacts are read from the local artifact cache, which also receives the
+    # model export once uploaded
+    cache = ArtifactCache.from_env()
+
+    # The model export and the figures are uploaded by background workers, the step only
+    # waits for them when it returns
+    with BackgroundUploader(WandbStore(run, cache), **model_config.get("uploads", {})) as uploader:
+        return train(run, args, model_config, uploader, cache)
+
 
-    df = process_df(df, args)
+def train(run, args, model_config, uploader, cache):
+
+    logger.info("Downloading and reading test artifact")
+    train_artifact = cache.use_artifact(run, args.train_data)
+    train_data_path = train_artifact.file()
+    data_key = typed_cache_key(train_data_path, model_config["features"], train_artifact.digest)
+    df = load_typed_data(train_data_path, model_config["features"], key=data_key)
 
     # Extract the target from the features
     logger.info("Extracting target from dataframe")
@@ -44,46 +77,55 @@ def go(args):
         X, y, test_size=0.3, stratify=y, random_state=42
     )
 
-    X_train = process_df(X_train, args)
-    X_val = process_df(X_val, args)
-
     logger.info("Setting up pipeline")
 
     pipe = get_training_inference_pipeline(args)
 
-    logger.info("Fitting")
-    pipe.fit(X_train, y_train)
+    if model_config.get("sweep"):
+        logger.info("Sweeping")
+        pipe, leaderboard = sweep(
+            pipe, model_config, data_key, X_train, y_train, X_val, y_val,
+            n_jobs=model_config["sweep"].get("n_jobs"),
+        )
+        logger.info(f"Sweep leaderboard:\n{leaderboard.to_string()}")
+        run.log({"sweep_leaderboard": wandb.Table(dataframe=leaderboard)})
+        run.summary["best_configuration"] = leaderboard.iloc[0].drop(["AUC", "fit_seconds"]).to_dict()
+    else:
+        logger.info("Fitting")
+        pipe.fit(X_train, y_train)
+
+    if model_config.get("preprocessing", {}).get("memory_report", False):
+        report = preprocessing_memory_report(pipe["preprocessor"], X_train)
+        logger.info(f"Preprocessing memory on the training data:\n{report.round(3).to_string()}")
+        for track, megabytes in report["mb"].items():
+            run.summary[f"preprocessing_mb/{track}"] = megabytes
 
     # Evaluate
-    pred = pipe.predict(X_val)
-    pred_proba = pipe.predict_proba(X_val)
-
     logger.info("Scoring")
-    score = roc_auc_score(y_val, pred_proba, average="macro", multi_class="ovo")
+    evaluation = evaluate(pipe, X_val, y_val)
+    pred = evaluation["pred"]
+    score = evaluation["auc"]
+    logger.info(f"Validation timings (s): {evaluation['timings']}")
 
     run.summary["AUC"] = score
+    for phase, seconds in evaluation["timings"].items():
+        run.summary[f"validation_seconds/{phase}"] = seconds
 
     # Export if required
     if args.export_artifact != "null":
 
-        export_model(run, pipe, X_val, pred, args.export_artifact)
+        export_model(
+            uploader, pipe, X_val, pred, args.export_artifact,
+            flat_forest=model_config.get("export_flat_forest", False),
+        )
 
     # Some useful plots
     fig_feat_imp = plot_feature_importance(pipe)
 
     fig_cm, sub_cm = plt.subplots(figsize=(10, 10))
 
-    y_pred = pipe.predict(X_val)
-
-    cm = confusion_matrix(
-                y_true=y_val,
-                y_pred=y_pred,
-                labels=pipe["classifier"].classes_,
-                normalize="true"
-            )
-
     disp  = ConfusionMatrixDisplay(
-                    confusion_matrix=cm,
+                    confusion_matrix=evaluation["confusion_matrix"],
                     display_labels=pipe["classifier"].classes_
                 )
 
@@ -95,83 +137,162 @@ def go(args):
 
     fig_cm.tight_layout()
 
-    run.log(
+    uploader.log_figures(
         {
-            "feature_importance": wandb.Image(fig_feat_imp),
-            "confusion_matrix": wandb.Image(fig_cm),
+            "feature_importance": fig_feat_imp,
+            "confusion_matrix": fig_cm,
         }
     )
 
 
-def process_df(df, args):
-
-    for col in df.columns:
-        try:
-            df[col] = pd.to_numeric(df[col])
-        except ValueError:
-            df[col] = df[col].astype("str")
-    #
-    #
-    # with open(args.model_config) as fp:
-    #     model_config = yaml.safe_load(fp)
-    #
-    # logger.info(f'model_config: {model_config}')
-    #
-    # logger.info(f'categorical_features: {model_config["features"]["categorical"]}')
-    # logger.info(f'numerical_features: {model_config["features"]["numerical"]}')
-    # logger.info(f'nlp_features: {model_config["features"]["nlp"]}')
-    #
-    # categorical_features = model_config["features"]["categorical"]
-    # numeric_features = model_config["features"]["numerical"]
-    # nlp_features = model_config["features"]["nlp"]
-    #
-    # for col in categorical_features:
-    #     df[col] = df[col].astype("str")
-    # for col in numeric_features:
-    #     df[col] = pd.to_numeric(df[col], errors="coerce")
-    # for col in nlp_features:
-    #     df[col] = df[col].astype("str")
+def evaluate(pipe, X_val, y_val):
+
+    # The preprocessing and the forest run once over the validation set: the labels are
+    # derived from the probabilities the same way the forest predicts them, and the AUC and
+    # the confusion matrix come from the same result
+    timings = {}
+
+    start = time.perf_counter()
+    X_transformed = pipe[:-1].transform(X_val)
+    timings["transform"] = time.perf_counter() - start
+
+    classifier = pipe[-1]
+    start = time.perf_counter()
+    pred_proba = classifier.predict_proba(X_transformed)
+    timings["predict_proba"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pred = classifier.classes_.take(np.argmax(pred_proba, axis=1))
+    auc = roc_auc_score(y_val, pred_proba, average="macro", multi_class="ovo")
+    cm = confusion_matrix(
+        y_true=y_val, y_pred=pred, labels=classifier.classes_, normalize="true"
+    )
+    timings["metrics"] = time.perf_counter() - start
+
+    return {
+        "pred": pred,
+        "pred_proba": pred_proba,
+        "auc": auc,
+        "confusion_matrix": cm,
+        "timings": timings,
+    }
+
+
+def process_df(df, features):
+
+    # The types come from the features section of the model config, so every column is
+    # cast once with a vectorized operation instead of trying pd.to_numeric on each of them
+    numeric_features = list(features["numerical"])
+    nlp_features = list(features["nlp"])
+
+    # Numerical columns the CSV parser could not read as numbers contain bad values,
+    # which become NaN and are then imputed by the pipeline
+    unparsed = [col for col in numeric_features if not pd.api.types.is_numeric_dtype(df[col])]
+    if unparsed:
+        logger.info(f"Coercing non-numeric values to NaN in {unparsed}")
+        df[unparsed] = df[unparsed].apply(pd.to_numeric, errors="coerce")
+
+    # Categorical features keep the type the parser gave them, so integer codes like key
+    # and time_signature stay numbers (numeric order in the OrdinalEncoder, int columns in
+    # the model signature). Those the parser left as objects become numbers when no value
+    # is lost in the conversion, the others are strings like the text columns below
+    unparsed = [
+        col for col in features["categorical"] if not pd.api.types.is_numeric_dtype(df[col])
+    ]
+    if unparsed:
+        coerced = df[unparsed].apply(pd.to_numeric, errors="coerce")
+        lossless = [col for col in unparsed if coerced[col].notna().sum() == df[col].notna().sum()]
+        df[lossless] = coerced[lossless]
+
+    # Text features, and any other non-numeric column (e.g. the target), are strings.
+    # Missing values stay NaN for the imputers instead of becoming the string "nan"
+    other_text = [
+        col for col in df.columns
+        if col not in numeric_features and col not in nlp_features
+        and not pd.api.types.is_numeric_dtype(df[col])
+    ]
+    string_columns = nlp_features + other_text
+    df[string_columns] = df[string_columns].astype("str").where(df[string_columns].notna())
     return df
 
 
-def export_model(run, pipe, X_val, val_pred, export_artifact):
+def typed_cache_key(path, features, content_digest=None):
 
-    # Infer the signature of the model
+    # The digest of the artifact, when known, stands for the content of the file
+    digest = hashlib.sha256(json.dumps([TYPED_FORMAT, features], sort_keys=True).encode())
+    if content_digest is not None:
+        digest.update(content_digest.encode())
+        return digest.hexdigest()[:16]
+    with open(path, "rb") as fp:
+        for block in iter(lambda: fp.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()[:16]
 
-    logger.info(f'X_val type: {X_val.dtypes}')
 
-    signature = infer_signature(X_val, val_pred)
+def load_typed_data(path, features, cache_dir=TYPED_CACHE_DIR, key=None):
+
+    # Sweeps run this step many times on the same artifact: the typed frame is stored as
+    # Parquet so only the first run parses the CSV
+    key = typed_cache_key(path, features) if key is None else key
+    cache_path = os.path.join(cache_dir, f"{key}.parquet")
+    if os.path.exists(cache_path):
+        logger.info(f"Reading typed data from {cache_path}")
+        return pd.read_parquet(cache_path)
+
+    # Reading the text columns as strings keeps the parser from guessing their type
+    df = pd.read_csv(path, low_memory=False, dtype={col: str for col in features["nlp"]})
+    df = process_df(df, features)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    partial_path = f"{cache_path}.partial"
+    df.to_parquet(partial_path, index=False)
+    os.replace(partial_path, cache_path)
+    return df
 
-    with tempfile.TemporaryDirectory() as temp_dir:
 
-        export_path = os.path.join(temp_dir, "model_export")
+def export_model(uploader, pipe, X_val, val_pred, export_artifact, flat_forest=False):
+
+    # Infer the signature of the model
 
-        #### YOUR CODE HERE
-        # Save the pipeline in the export_path directory using mlflow.sklearn.save_model
-        # function. Provide the signature computed above ("signature") as well as a few
-        # examples (input_example=X_val.iloc[:2]), and use the CLOUDPICKLE serialization
-        # format (mlflow.sklearn.SERIALIZATION_FORMAT_CLOUDPICKLE)
+    logger.info(f'X_val type: {X_val.dtypes}')
 
-        # Then upload the temp_dir directory as an artifact:
-        # 1. create a wandb.Artifact instance called "artifact"
-        # 2. add the temp directory using .add_dir
-        # 3. log the artifact to the run
+    signature = infer_signature(X_val, val_pred)
 
-        # Make sure the artifact is uploaded before the temp dir
-        # gets deleted
+    # The export is written straight into the staging area of the uploader, which owns
+    # the directory until the upload is done
+    temp_dir = uploader.staging_path("export")
+    os.makedirs(temp_dir)
+
+    export_path = os.path.join(temp_dir, "model_export")
+
+    #### YOUR CODE HERE
+    # Save the pipeline in the export_path directory using mlflow.sklearn.save_model
+    # function. Provide the signature computed above ("signature") as well as a few
+    # examples (input_example=X_val.iloc[:2]), and use the CLOUDPICKLE serialization
+    # format (mlflow.sklearn.SERIALIZATION_FORMAT_CLOUDPICKLE)
+
+    # Then enqueue the upload of the temp_dir directory as an artifact: the worker
+    # creates the wandb.Artifact, adds the directory with .add_dir, logs it to the run and
+    # waits for it, while this step goes on
+
+    mlflow.sklearn.save_model(
+        pipe,
+        export_path,
+        serialization_format=mlflow.sklearn.SERIALIZATION_FORMAT_CLOUDPICKLE,
+        signature=signature,
+        input_example=X_val.iloc[:2],
+    )
 
-        mlflow.sklearn.save_model(
-            pipe,
-            export_path,
-            serialization_format=mlflow.sklearn.SERIALIZATION_FORMAT_CLOUDPICKLE,
-            signature=signature,
-            input_example=X_val.iloc[:2],
+    if flat_forest:
+        # The forest as memory-mappable node arrays next to the MLflow model, see
+        # forest_engine.FlatForestPipeline.load
+        save_flat_forest(
+            pipe["classifier"], os.path.join(temp_dir, "flat_forest"), preprocessor=pipe[:-1]
         )
 
-        artifact = wandb.Artifact(export_artifact, type="model_export", description="Random Forest pipeline export")
-        artifact.add_dir(temp_dir)
-        run.log_artifact(artifact)
-        artifact.wait()
+    uploader.log_artifact(
+        export_artifact, "model_export", "Random Forest pipeline export", [temp_dir]
+    )
 
 
 def plot_feature_importance(pipe):
@@ -196,6 +317,177 @@ def plot_feature_importance(pipe):
     return fig_feat_imp
 
 
+# TF-IDF over hashed tokens: no vocabulary to fit or to pickle, only an optional IDF
+# weight vector of n_features floats. Documents are hashed in parallel chunks and the
+# output stays a sparse CSR matrix. It is defined here so that cloudpickle ships it
+# inside the exported model
+class HashingTfidf(BaseEstimator, TransformerMixin):
+
+    def __init__(self, n_features=1024, binary=True, use_idf=True, n_jobs=None, chunk_size=10000):
+        self.n_features = n_features
+        self.binary = binary
+        self.use_idf = use_idf
+        self.n_jobs = n_jobs
+        self.chunk_size = chunk_size
+
+    def _hash(self, documents):
+        vectorizer = HashingVectorizer(
+            n_features=self.n_features, binary=self.binary, alternate_sign=False, norm=None
+        )
+        chunks = [
+            documents[start:start + self.chunk_size]
+            for start in range(0, len(documents), self.chunk_size)
+        ]
+        if len(chunks) <= 1:
+            return vectorizer.transform(documents)
+        return sp.vstack(
+            Parallel(n_jobs=self.n_jobs)(delayed(vectorizer.transform)(chunk) for chunk in chunks),
+            format="csr",
+        )
+
+    def fit(self, X, y=None):
+        self.idf_ = None
+        if self.use_idf:
+            # Same smoothed IDF as TfidfTransformer(smooth_idf=True)
+            counts = self._hash(X)
+            document_frequency = np.bincount(counts.indices, minlength=self.n_features)
+            self.idf_ = np.log((1 + counts.shape[0]) / (1 + document_frequency)) + 1
+        return self
+
+    def transform(self, X):
+        counts = self._hash(X)
+        if self.idf_ is not None:
+            counts = counts @ sp.diags(self.idf_)
+        return normalize(counts, norm="l2", copy=False).tocsr()
+
+
+def get_text_vectorizer(tfidf_config):
+
+    # "tfidf" (default) learns a vocabulary of max_features terms, "hashing" needs none
+    method = tfidf_config.get("method", "tfidf")
+    if method == "tfidf":
+        return TfidfVectorizer(binary=True, max_features=tfidf_config["max_features"])
+    if method == "hashing":
+        return HashingTfidf(
+            n_features=tfidf_config.get("n_features", 1024),
+            use_idf=tfidf_config.get("use_idf", True),
+            n_jobs=tfidf_config.get("n_jobs"),
+        )
+    raise ValueError(f"Unknown text vectorization method {method}")
+
+
+def to_csr(X):
+
+    return sp.csr_matrix(X)
+
+
+def matrix_nbytes(X):
+
+    if sp.issparse(X):
+        X = X.tocsr()
+        return X.data.nbytes + X.indices.nbytes + X.indptr.nbytes
+    return np.asarray(X).nbytes
+
+
+def preprocessing_memory_report(preprocessor, X):
+
+    # Memory of the output of every fitted track of the ColumnTransformer on X, compared
+    # with the same matrix stored dense as float64
+    rows = {}
+    for name, transformer, columns in preprocessor.transformers_:
+        if isinstance(transformer, str):
+            # "drop" or "passthrough" remainder
+            continue
+        output = transformer.transform(X[columns])
+        rows[name] = {
+            "format": output.format if sp.issparse(output) else "dense",
+            "n_rows": output.shape[0],
+            "n_columns": output.shape[1],
+            "mb": matrix_nbytes(output) / 1024 ** 2,
+            "dense_mb": output.shape[0] * output.shape[1] * 8 / 1024 ** 2,
+        }
+    report = pd.DataFrame.from_dict(rows, orient="index")
+    output = preprocessor.transform(X)
+    report.loc["total"] = {
+        "format": output.format if sp.issparse(output) else "dense",
+        "n_rows": output.shape[0],
+        "n_columns": output.shape[1],
+        "mb": matrix_nbytes(output) / 1024 ** 2,
+        "dense_mb": output.shape[0] * output.shape[1] * 8 / 1024 ** 2,
+    }
+    return report
+
+
+def get_transformed_data(preprocessor, model_config, data_key, X_train, X_val, cache_dir=TRANSFORMED_CACHE_DIR):
+
+    # The preprocessor only depends on the data version and on the features, tfidf and
+    # preprocessing sections: it is fitted once per combination and cached with the
+    # transformed matrices, whatever the classifier configuration
+    preprocessing_config = {
+        section: model_config.get(section)
+        for section in ("features", "tfidf", "preprocessing")
+    }
+    key = hashlib.sha256(
+        json.dumps([data_key, preprocessing_config], sort_keys=True).encode()
+    ).hexdigest()[:16]
+    cache_path = os.path.join(cache_dir, f"{key}.joblib")
+    if os.path.exists(cache_path):
+        logger.info(f"Reading the fitted preprocessor and transformed data from {cache_path}")
+        return joblib.load(cache_path)
+
+    preprocessor = preprocessor.fit(X_train)
+    transformed = (preprocessor, preprocessor.transform(X_train), preprocessor.transform(X_val))
+
+    os.makedirs(cache_dir, exist_ok=True)
+    partial_path = f"{cache_path}.partial"
+    joblib.dump(transformed, partial_path)
+    os.replace(partial_path, cache_path)
+    return transformed
+
+
+def fit_configuration(classifier_config, X_train, y_train, X_val, y_val):
+
+    start = time.perf_counter()
+    classifier = RandomForestClassifier(**classifier_config).fit(X_train, y_train)
+    fit_seconds = time.perf_counter() - start
+    pred_proba = classifier.predict_proba(X_val)
+    auc = roc_auc_score(y_val, pred_proba, average="macro", multi_class="ovo")
+    return {"AUC": auc, "fit_seconds": fit_seconds}, classifier
+
+
+def sweep(pipe, model_config, data_key, X_train, y_train, X_val, y_val, n_jobs=None):
+
+    # One forest per combination of sweep.grid on top of the random_forest section, fitted
+    # in a process pool on the shared transformed matrices (joblib memory-maps the large
+    # arrays for the workers). The forest the workers fitted with the best configuration
+    # is returned in a pipeline with the fitted preprocessor, it is not refitted
+    preprocessor, Xt_train, Xt_val = get_transformed_data(
+        pipe[:-1], model_config, data_key, X_train, X_val
+    )
+    # Parallelism comes from the pool, each forest is fitted on a single core.
+    # ParameterGrid takes a dict or a list of dicts, each entry has its own overrides
+    base_config = {**model_config["random_forest"], "n_jobs": 1}
+    grid = list(ParameterGrid(model_config["sweep"]["grid"]))
+    logger.info(f"Fitting {len(grid)} configurations")
+    results = Parallel(n_jobs=-1 if n_jobs is None else n_jobs, return_as="generator")(
+        delayed(fit_configuration)({**base_config, **overrides}, Xt_train, y_train, Xt_val, y_val)
+        for overrides in grid
+    )
+
+    # The results arrive in order, only the best forest so far is kept in memory
+    rows, best_auc, classifier = [], -np.inf, None
+    for overrides, (result, fitted) in zip(grid, results):
+        rows.append({**overrides, **result})
+        if result["AUC"] > best_auc:
+            best_auc, classifier = result["AUC"], fitted
+    leaderboard = pd.DataFrame(rows).sort_values("AUC", ascending=False).reset_index(drop=True)
+
+    # The pool fitted it on one core, predictions use the n_jobs of the config
+    classifier.set_params(n_jobs=model_config["random_forest"].get("n_jobs"))
+    best_pipe = Pipeline(steps=list(preprocessor.steps) + [("classifier", classifier)])
+    return best_pipe, leaderboard
+
+
 def get_training_inference_pipeline(args):
 
     # Get the configuration for the pipeline
@@ -205,6 +497,11 @@ def get_training_inference_pipeline(args):
     # are tracked
     wandb.config.update(model_config)
 
+    return build_pipeline(model_config)
+
+
+def build_pipeline(model_config):
+
     # We need 3 separate preprocessing "tracks":
     # - one for categorical features
     # - one for numerical features
@@ -227,10 +524,11 @@ def get_training_inference_pipeline(args):
     nlp_transformer = make_pipeline(
         SimpleImputer(strategy="constant", fill_value=""),
         reshape_to_1d,
-        TfidfVectorizer(
-            binary=True, max_features=model_config["tfidf"]["max_features"]
-        ),
+        get_text_vectorizer(model_config["tfidf"]),
     )
+    # With preprocessing.sparse the stacked output is always sparse, otherwise the
+    # ColumnTransformer densifies it when less than 70% of it is zeros
+    sparse = model_config.get("preprocessing", {}).get("sparse", False)
     # Put the 3 tracks together into one pipeline using the ColumnTransformer
     # This also drops the columns that we are not explicitly transforming
     preprocessor = ColumnTransformer(
@@ -240,16 +538,18 @@ def get_training_inference_pipeline(args):
             ("nlp1", nlp_transformer, nlp_features),
         ],
         remainder="drop",  # This drops the columns that we do not transform
+        sparse_threshold=1.0 if sparse else 0.3,
     )
 
     # Append classifier to preprocessing pipeline.
     # Now we have a full prediction pipeline.
-    pipe = Pipeline(
-        steps=[
-            ("preprocessor", preprocessor),
-            ("classifier", RandomForestClassifier(**model_config["random_forest"])),
-        ]
-    )
+    steps = [("preprocessor", preprocessor)]
+    if sparse:
+        # Also CSR when every track is dense. The forest fits on a CSC copy and predicts
+        # on CSR, the matrix is never densified
+        steps.append(("to_csr", FunctionTransformer(to_csr, accept_sparse=True)))
+    steps.append(("classifier", RandomForestClassifier(**model_config["random_forest"])))
+    pipe = Pipeline(steps=steps)
     return pipe
 
 
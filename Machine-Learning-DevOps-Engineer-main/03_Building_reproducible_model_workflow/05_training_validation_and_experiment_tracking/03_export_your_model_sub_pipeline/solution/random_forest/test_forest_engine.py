@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+import scipy.sparse as sp
+from sklearn.compose import ColumnTransformer
+from sklearn.datasets import make_classification
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.preprocessing import StandardScaler
+
+from forest_engine import FlatForest, FlatForestPipeline, save_flat_forest
+
+
+@pytest.fixture(scope="module")
+def forest_data():
+
+    X, y = make_classification(
+        n_samples=3000, n_features=12, n_informative=6, n_classes=3, random_state=0
+    )
+    labels = np.array(["Dark Trap", "Rap", "techno"])[y]
+    forest = RandomForestClassifier(n_estimators=25, max_depth=10, random_state=0)
+    forest.fit(X[:2000], labels[:2000])
+    return forest, X[2000:]
+
+
+def test_flat_forest_parity(forest_data):
+
+    forest, X = forest_data
+    flat = FlatForest.from_forest(forest)
+
+    assert np.allclose(flat.predict_proba(X), forest.predict_proba(X), rtol=0, atol=1e-12)
+    assert (flat.predict(X) == forest.predict(X)).all()
+
+
+def test_flat_forest_sparse_input(forest_data):
+
+    forest, X = forest_data
+    X_sparse = sp.csr_matrix(np.where(np.abs(X) < 0.5, 0, X))
+    flat = FlatForest.from_forest(forest)
+
+    assert np.allclose(flat.predict_proba(X_sparse), forest.predict_proba(X_sparse), atol=1e-12)
+
+
+def test_flat_forest_mmap_roundtrip(forest_data, tmp_path):
+
+    forest, X = forest_data
+    preprocessor = ColumnTransformer(
+        [("num", StandardScaler(), [0, 1, 2])], remainder="passthrough"
+    ).fit(X)
+    forest_on_scaled = RandomForestClassifier(n_estimators=10, random_state=0).fit(
+        preprocessor.transform(X), forest.predict(X)
+    )
+    save_flat_forest(forest_on_scaled, str(tmp_path), preprocessor=preprocessor)
+
+    loaded = FlatForestPipeline.load(str(tmp_path))
+
+    assert isinstance(loaded.forest.threshold, np.memmap)
+    assert list(loaded.classes_) == list(forest_on_scaled.classes_)
+    assert np.allclose(
+        loaded.predict_proba(X), forest_on_scaled.predict_proba(preprocessor.transform(X)), atol=1e-12
+    )
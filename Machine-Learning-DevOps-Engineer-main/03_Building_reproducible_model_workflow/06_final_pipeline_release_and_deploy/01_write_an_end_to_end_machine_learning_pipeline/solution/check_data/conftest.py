@@ -2,8 +2,11 @@ import pytest
 import pandas as pd
 import wandb
 
+from pipeline_utils.artifact_cache import ArtifactCache
+
 
 run = wandb.init(job_type="data_tests")
+cache = ArtifactCache.from_env()
 
 
 def pytest_addoption(parser):
@@ -25,10 +28,10 @@ def data(request):
     if sample_artifact is None:
         pytest.fail("--sample_artifact missing on command line")
 
-    local_path = run.use_artifact(reference_artifact).file()
+    local_path = cache.use_artifact(run, reference_artifact).file()
     sample1 = pd.read_csv(local_path)
 
-    local_path = run.use_artifact(sample_artifact).file()
+    local_path = cache.use_artifact(run, sample_artifact).file()
     sample2 = pd.read_csv(local_path)
 
     return sample1, sample2
@@ -8,6 +8,8 @@ import mlflow.sklearn
 import matplotlib.pyplot as plt
 from sklearn.metrics import roc_auc_score, plot_confusion_matrix
 
+from pipeline_utils.artifact_cache import ArtifactCache
+
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
 logger = logging.getLogger()
@@ -17,8 +19,11 @@ def go(args):
 
     run = wandb.init(job_type="test")
 
+    # Both inputs come from the local artifact cache
+    cache = ArtifactCache.from_env()
+
     logger.info("Downloading and reading test artifact")
-    test_data_path = run.use_artifact(args.test_data).file()
+    test_data_path = cache.use_artifact(run, args.test_data).file()
     df = pd.read_csv(test_data_path, low_memory=False)
 
     # Extract the target from the features
@@ -27,7 +32,7 @@ def go(args):
     y_test = X_test.pop("genre")
 
     logger.info("Downloading and reading the exported model")
-    model_export_path = run.use_artifact(args.model_export + ":latest").download()
+    model_export_path = cache.use_artifact(run, args.model_export + ":latest").download()
 
     pipe = mlflow.sklearn.load_model(model_export_path)
 
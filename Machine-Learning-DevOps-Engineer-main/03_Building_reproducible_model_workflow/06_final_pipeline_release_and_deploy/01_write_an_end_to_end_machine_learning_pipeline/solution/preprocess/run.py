@@ -6,6 +6,8 @@ import os
 import pandas as pd
 import wandb
 
+from pipeline_utils.artifact_cache import ArtifactCache
+
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
 logger = logging.getLogger()
@@ -16,7 +18,7 @@ def go(args):
     run = wandb.init(job_type="process_data")
 
     logger.info("Downloading artifact")
-    artifact = run.use_artifact(args.input_artifact)
+    artifact = ArtifactCache.from_env().use_artifact(run, args.input_artifact)
     artifact_path = artifact.file()
 
     df = pd.read_parquet(artifact_path)
@@ -1,13 +1,14 @@
 #!/usr/bin/env python
 import argparse
 import logging
-import os
-import tempfile
 
 import pandas as pd
 import wandb
 from sklearn.model_selection import train_test_split
 
+from pipeline_utils.artifact_cache import ArtifactCache
+from pipeline_utils.uploader import BackgroundUploader, WandbStore
+
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
 logger = logging.getLogger()
@@ -17,8 +18,11 @@ def go(args):
 
     run = wandb.init(job_type="split_data")
 
+    # The input comes from the local artifact cache, the splits are added to it once uploaded
+    cache = ArtifactCache.from_env()
+
     logger.info("Downloading and reading artifact")
-    artifact = run.use_artifact(args.input_artifact)
+    artifact = cache.use_artifact(run, args.input_artifact)
     artifact_path = artifact.file()
 
     df = pd.read_csv(artifact_path, low_memory=False)
@@ -34,38 +38,30 @@ def go(args):
         stratify=df[args.stratify] if args.stratify != 'null' else None,
     )
 
-    # Save the artifacts. We use a temporary directory so we do not leave
-    # any trace behind
-    with tempfile.TemporaryDirectory() as tmp_dir:
+    # Save the artifacts in the staging directory of the uploader, which removes them
+    # once uploaded so we do not leave any trace behind. The uploads run in the
+    # background: the step only waits for them when the "with" block exits
+    with BackgroundUploader(WandbStore(run, cache)) as uploader:
 
         for split, df in splits.items():
 
             # Make the artifact name from the provided root plus the name of the split
             artifact_name = f"{args.artifact_root}_{split}.csv"
 
-            # Get the path on disk within the temp directory
-            temp_path = os.path.join(tmp_dir, artifact_name)
+            # Get the path on disk within the staging directory
+            temp_path = uploader.staging_path(artifact_name)
 
             logger.info(f"Uploading the {split} dataset to {artifact_name}")
 
-            # Save then upload to W&B
+            # Save then enqueue the upload to W&B
             df.to_csv(temp_path)
 
-            artifact = wandb.Artifact(
-                name=artifact_name,
-                type=args.artifact_type,
-                description=f"{split} split of dataset {args.input_artifact}",
+            uploader.log_artifact(
+                artifact_name,
+                args.artifact_type,
+                f"{split} split of dataset {args.input_artifact}",
+                [temp_path],
             )
-            artifact.add_file(temp_path)
-
-            logger.info("Logging artifact")
-            run.log_artifact(artifact)
-
-            # This waits for the artifact to be uploaded to W&B. If you
-            # do not add this, the temp directory might be removed before
-            # W&B had a chance to upload the datasets, and the upload
-            # might fail
-            artifact.wait()
 
 
 if __name__ == "__main__":
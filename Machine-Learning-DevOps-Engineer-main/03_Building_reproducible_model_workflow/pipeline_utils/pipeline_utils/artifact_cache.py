@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+"""
+Local content-addressed cache of the W&B artifacts used by the pipeline steps.
+
+Every artifact version is stored once per digest in <cache dir>/objects/<digest>, a manifest
+maps name:version to its digest and name:alias (latest, ...) to the version it last resolved
+to. Online, the step still resolves the artifact with run.use_artifact (a metadata call that
+also records the lineage) but only downloads it on a miss. Offline, name:alias resolves from
+the manifest and W&B is not contacted. The files are materialized in
+./artifacts/<name>:<version> as reflinks, or hard links to the read-only cached files, or
+copies. The least recently used digests are evicted above max_gb.
+
+ArtifactCache.from_env() reads the settings from the environment, which mlflow run passes on
+to every step: ARTIFACT_CACHE_DIR (default ~/.cache/artifact_cache), ARTIFACT_CACHE_MAX_GB
+(default 20) and ARTIFACT_CACHE_OFFLINE (default false, W&B itself goes offline with
+WANDB_MODE=offline), e.g. ARTIFACT_CACHE_OFFLINE=true mlflow run .
+"""
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import shutil
+import stat
+import tempfile
+import time
+
+logger = logging.getLogger()
+
+DEFAULT_DIR = os.path.join(os.path.expanduser("~"), ".cache", "artifact_cache")
+DEFAULT_MAX_GB = 20
+
+# ioctl cloning the blocks of a file on copy-on-write filesystems (btrfs, xfs)
+FICLONE = 0x40049409
+
+
+def split_name(name):
+
+    # "project/data.csv:v3" -> ("project/data.csv", "v3"), no version or alias means latest
+    base, _, alias = name.rpartition(":")
+    if not base or "/" in alias:
+        return name, "latest"
+    return base, alias
+
+
+def _clone(source, target):
+
+    # An existing target may be a hard link to a cached file (a previous download into the
+    # same root): it is unlinked, never opened for writing, which would truncate the cache
+    if os.path.lexists(target):
+        os.remove(target)
+    try:
+        with open(source, "rb") as src, open(target, "xb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        shutil.copystat(source, target)
+        return target
+    except OSError:
+        if os.path.exists(target):
+            os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+    return target
+
+
+def _read_only(directory):
+
+    # The materialized files may be hard links: a write would change the cached copy
+    for parent, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(parent, name)
+            os.chmod(path, os.stat(path).st_mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+
+def _size(directory):
+
+    return sum(
+        os.path.getsize(os.path.join(parent, name))
+        for parent, _, files in os.walk(directory) for name in files
+    )
+
+
+def _remove(directory):
+
+    # Read-only files in a writable directory can be unlinked
+    shutil.rmtree(directory, ignore_errors=True)
+
+
+class ArtifactCache:
+
+    def __init__(self, directory=DEFAULT_DIR, max_gb=DEFAULT_MAX_GB, offline=False):
+        self.directory = directory
+        self.max_bytes = max_gb * 1024 ** 3
+        self.offline = offline
+        self.objects_dir = os.path.join(directory, "objects")
+        os.makedirs(self.objects_dir, exist_ok=True)
+
+    @classmethod
+    def from_env(cls):
+
+        return cls(
+            directory=os.path.expanduser(os.environ.get("ARTIFACT_CACHE_DIR", DEFAULT_DIR)),
+            max_gb=float(os.environ.get("ARTIFACT_CACHE_MAX_GB", DEFAULT_MAX_GB)),
+            offline=os.environ.get("ARTIFACT_CACHE_OFFLINE", "false").lower() in ("1", "true"),
+        )
+
+    @contextlib.contextmanager
+    def _manifest(self):
+
+        # Read-modify-write of the manifest, serialized across processes by a lock file
+        path = os.path.join(self.directory, "manifest.json")
+        with open(os.path.join(self.directory, ".lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(path) as fp:
+                    manifest = json.load(fp)
+            except FileNotFoundError:
+                manifest = {"versions": {}, "aliases": {}}
+            yield manifest
+            with open(f"{path}.partial", "w") as fp:
+                json.dump(manifest, fp, indent=1)
+            os.replace(f"{path}.partial", path)
+
+    def object_dir(self, digest):
+
+        return os.path.join(self.objects_dir, digest)
+
+    def _commit(self, partial_dir, digest):
+
+        _read_only(partial_dir)
+        try:
+            os.rename(partial_dir, self.object_dir(digest))
+        except OSError:
+            # Another process stored the same digest first
+            _remove(partial_dir)
+
+    def _record(self, key, digest, alias=None):
+
+        with self._manifest() as manifest:
+            manifest["versions"][key] = {
+                "digest": digest,
+                "size": _size(self.object_dir(digest)),
+                "last_used": time.time(),
+            }
+            if alias is not None:
+                manifest["aliases"][f"{split_name(key)[0]}:{alias}"] = key
+            self._evict(manifest, keep=digest)
+
+    def _evict(self, manifest, keep):
+
+        last_used, sizes = {}, {}
+        for entry in manifest["versions"].values():
+            digest = entry["digest"]
+            last_used[digest] = max(last_used.get(digest, 0), entry["last_used"])
+            sizes[digest] = entry["size"]
+        total = sum(sizes.values())
+        for digest in sorted(last_used, key=last_used.get):
+            if total <= self.max_bytes:
+                break
+            if digest == keep:
+                continue
+            logger.info(f"Evicting {digest} from the artifact cache ({sizes[digest] / 1024 ** 2:.1f} MB)")
+            _remove(self.object_dir(digest))
+            total -= sizes[digest]
+            evicted = {key for key, entry in manifest["versions"].items() if entry["digest"] == digest}
+            for key in evicted:
+                del manifest["versions"][key]
+            for alias in [alias for alias, key in manifest["aliases"].items() if key in evicted]:
+                del manifest["aliases"][alias]
+
+    def add(self, name, version, digest, paths, alias=None):
+
+        # Seeds the cache with files just logged as name:version (a directory is added by
+        # its content, like wandb.Artifact.add_dir), so the next step does not download them
+        if not os.path.isdir(self.object_dir(digest)):
+            partial_dir = tempfile.mkdtemp(dir=self.directory, prefix=".partial_")
+            for path in paths:
+                if os.path.isdir(path):
+                    shutil.copytree(path, partial_dir, copy_function=_clone, dirs_exist_ok=True)
+                else:
+                    _clone(path, os.path.join(partial_dir, os.path.basename(path)))
+            self._commit(partial_dir, digest)
+        self._record(f"{split_name(name)[0]}:{version}", digest, alias)
+
+    def fetch(self, key, digest, remote=None, alias=None):
+
+        object_dir = self.object_dir(digest)
+        if os.path.isdir(object_dir):
+            logger.info(f"Artifact {key} found in the cache")
+        elif remote is None:
+            raise FileNotFoundError(f"Artifact {key} is not in the cache {self.directory}")
+        else:
+            logger.info(f"Downloading artifact {key} into the cache")
+            partial_dir = tempfile.mkdtemp(dir=self.directory, prefix=".partial_")
+            remote.download(root=partial_dir)
+            self._commit(partial_dir, digest)
+        self._record(key, digest, alias)
+        return object_dir
+
+    def resolve(self, name):
+
+        # name:version or name:alias from the manifest, for the offline mode
+        base, alias = split_name(name)
+        with self._manifest() as manifest:
+            key = manifest["aliases"].get(f"{base}:{alias}", f"{base}:{alias}")
+            if key not in manifest["versions"]:
+                raise FileNotFoundError(
+                    f"Artifact {name} is not in the cache {self.directory}, run the step online first"
+                )
+            return key, manifest["versions"][key]["digest"]
+
+    def use_artifact(self, run, name):
+
+        if self.offline:
+            key, digest = self.resolve(name)
+            logger.info(f"Offline: {name} resolved to {key}")
+            return CachedArtifact(self, key, digest)
+        artifact = run.use_artifact(name)
+        base, alias = split_name(name)
+        return CachedArtifact(
+            self, f"{base}:{artifact.version}", artifact.digest, remote=artifact, alias=alias
+        )
+
+
+class CachedArtifact:
+
+    # .file() and .download() of a wandb artifact, served from the cache
+    def __init__(self, cache, key, digest, remote=None, alias=None):
+        self.cache = cache
+        self.key = key
+        self.digest = digest
+        self.remote = remote
+        self.alias = alias
+
+    def download(self, root=None):
+
+        # The default ./artifacts/<name>:<version> is replaced, a root given by the caller
+        # only gets the files of the artifact added (or overwritten), like wandb's download
+        object_dir = self.cache.fetch(self.key, self.digest, self.remote, self.alias)
+        if root is None:
+            root = os.path.join("artifacts", os.path.basename(self.key))
+            _remove(root)
+        shutil.copytree(object_dir, root, copy_function=_clone, dirs_exist_ok=True)
+        return root
+
+    def file(self, root=None):
+
+        root = self.download(root)
+        object_dir = self.cache.object_dir(self.digest)
+        files = [
+            os.path.relpath(os.path.join(parent, name), object_dir)
+            for parent, _, names in os.walk(object_dir) for name in names
+        ]
+        if len(files) != 1:
+            raise ValueError(f"Artifact {self.key} has {len(files)} files, use download()")
+        return os.path.join(root, files[0])
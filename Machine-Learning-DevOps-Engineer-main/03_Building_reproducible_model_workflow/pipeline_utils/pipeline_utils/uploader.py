@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+"""
+Background uploader for the artifacts and images logged by the pipeline steps.
+
+The step stages the files (a hard link or copy into a private staging directory, so its
+own temporary directories can go away) and enqueues the upload. Figures are rendered to PNG
+on the calling thread, as pyplot is not thread-safe. Worker threads upload the artifacts and
+images, the step only blocks when the bounded queue is full. close() (or leaving the "with"
+block, or the interpreter exiting) flushes the queue and raises the first upload error, or
+TimeoutError when the uploads are not done within the flush timeout.
+
+WandbStore logs to a W&B run, LocalStore to a directory and stands in for W&B in tests.
+"""
+import atexit
+import logging
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger()
+
+
+class WandbStore:
+
+    # With an artifact_cache.ArtifactCache, the uploaded files are also added to the cache as
+    # the latest version, so the next step reads them from disk
+    def __init__(self, run, cache=None):
+        self.run = run
+        self.cache = cache
+
+    def log_artifact(self, name, artifact_type, description, paths):
+
+        import wandb
+
+        artifact = wandb.Artifact(name, type=artifact_type, description=description)
+        for path in paths:
+            if os.path.isdir(path):
+                artifact.add_dir(path)
+            else:
+                artifact.add_file(path)
+        self.run.log_artifact(artifact)
+        # Runs in a worker thread: the staged files must stay until the upload is done
+        artifact.wait()
+        if self.cache is not None:
+            self.cache.add(name, artifact.version, artifact.digest, paths, alias="latest")
+
+    def log_images(self, images):
+
+        import wandb
+
+        self.run.log({name: wandb.Image(path) for name, path in images.items()})
+
+
+class LocalStore:
+
+    # Artifacts go to <root>/artifacts/<name>/v<N>/ (a directory is added by its content, like
+    # wandb.Artifact.add_dir) and images to <root>/media/<name>.png
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+
+    def log_artifact(self, name, artifact_type, description, paths):
+
+        artifact_dir = os.path.join(self.root, "artifacts", name)
+        with self._lock:
+            os.makedirs(artifact_dir, exist_ok=True)
+            version_dir = os.path.join(artifact_dir, f"v{len(os.listdir(artifact_dir))}")
+            os.makedirs(version_dir)
+        for path in paths:
+            if os.path.isdir(path):
+                shutil.copytree(path, version_dir, dirs_exist_ok=True)
+            else:
+                shutil.copy2(path, os.path.join(version_dir, os.path.basename(path)))
+
+    def log_images(self, images):
+
+        media_dir = os.path.join(self.root, "media")
+        os.makedirs(media_dir, exist_ok=True)
+        for name, path in images.items():
+            shutil.copy2(path, os.path.join(media_dir, f"{name}.png"))
+
+
+def _stage(path, target):
+
+    # Hard links cost nothing and survive the deletion of the original, copy across devices
+    if os.path.isdir(path):
+        shutil.copytree(path, target, copy_function=_link_or_copy)
+    else:
+        _link_or_copy(path, target)
+    return target
+
+
+def _link_or_copy(path, target):
+
+    try:
+        os.link(path, target)
+    except OSError:
+        shutil.copy2(path, target)
+    return target
+
+
+class BackgroundUploader:
+
+    def __init__(self, store, max_queue=8, n_workers=2, flush_timeout=600):
+        self.store = store
+        self.flush_timeout = flush_timeout
+        self.staging_dir = tempfile.mkdtemp(prefix="uploader_")
+        self.errors = []
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._closed = False
+        self._workers = [
+            threading.Thread(target=self._work, name=f"uploader-{i}", daemon=True)
+            for i in range(n_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        # An upload error must not replace the exception leaving the block
+        self.close(raise_errors=exc_info[0] is None)
+
+    def _work(self):
+
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                name, func, kwargs = job
+                start = time.perf_counter()
+                func(**kwargs)
+                logger.info(f"Uploaded {name} in {time.perf_counter() - start:.1f}s")
+            except Exception as err:
+                logger.error(f"Upload of {job[0]} failed: {err}")
+                self.errors.append(err)
+            finally:
+                self._queue.task_done()
+
+    def _put(self, job, func, **kwargs):
+
+        if self._closed:
+            raise RuntimeError("The uploader is closed")
+        self._queue.put((job, func, kwargs))
+
+    def staging_path(self, name):
+
+        # A fresh path in the staging directory: files written there are uploaded as they are
+        return os.path.join(tempfile.mkdtemp(dir=self.staging_dir), name)
+
+    def log_artifact(self, name, artifact_type, description, paths):
+
+        staged = []
+        for path in paths:
+            if os.path.abspath(path).startswith(self.staging_dir + os.sep):
+                staged.append(path)
+            else:
+                staged.append(_stage(path, self.staging_path(os.path.basename(path))))
+        self._put(
+            f"artifact {name}", self.store.log_artifact,
+            name=name, artifact_type=artifact_type, description=description, paths=staged,
+        )
+
+    def log_figures(self, figures):
+
+        # pyplot is not thread-safe: the figures are rendered and closed here, only the PNG
+        # files are uploaded in the background
+        import matplotlib.pyplot as plt
+
+        images = {}
+        for name, figure in figures.items():
+            images[name] = self.staging_path(f"{name}.png")
+            figure.savefig(images[name])
+            plt.close(figure)
+        self._put(f"figures {', '.join(figures)}", self.store.log_images, images=images)
+
+    def flush(self, timeout=None):
+
+        # Waits until every enqueued upload is done, returns False on timeout
+        timeout = self.flush_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def close(self, timeout=None, raise_errors=True):
+
+        if self._closed:
+            return
+        self._closed = True
+        atexit.unregister(self.close)
+        if self.flush(timeout):
+            for _ in self._workers:
+                self._queue.put(None)
+            for worker in self._workers:
+                worker.join()
+            shutil.rmtree(self.staging_dir, ignore_errors=True)
+            error = self.errors[0] if self.errors else None
+        else:
+            # The daemon workers and the staged files are left to the pending uploads
+            error = TimeoutError(
+                f"{self._queue.unfinished_tasks} uploads still pending after the flush timeout"
+            )
+        if error is None:
+            return
+        if raise_errors:
+            raise error
+        logger.error(f"Uploads not completed: {error}")
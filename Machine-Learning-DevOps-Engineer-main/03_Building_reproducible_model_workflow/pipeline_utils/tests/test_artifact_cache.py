@@ -0,0 +1,128 @@
+import os
+
+import pytest
+
+from pipeline_utils.artifact_cache import ArtifactCache, split_name
+
+
+class FakeArtifact:
+
+    # What the cache uses of a wandb artifact: version, digest and download(root)
+    def __init__(self, version, digest, files):
+        self.version = version
+        self.digest = digest
+        self.files = files
+        self.downloads = 0
+
+    def download(self, root):
+        self.downloads += 1
+        for name, content in self.files.items():
+            with open(os.path.join(root, name), "w") as fp:
+                fp.write(content)
+        return root
+
+
+class FakeRun:
+
+    def __init__(self, artifacts):
+        self.artifacts = artifacts
+        self.used = []
+
+    def use_artifact(self, name):
+        self.used.append(name)
+        return self.artifacts[split_name(name)[0]]
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def test_split_name():
+
+    assert split_name("data_train.csv") == ("data_train.csv", "latest")
+    assert split_name("exercise_6/data_train.csv:v3") == ("exercise_6/data_train.csv", "v3")
+
+
+def test_download_once_then_offline(workdir):
+
+    artifact = FakeArtifact("v2", "abc", {"data.csv": "a,b\n1,2\n"})
+    run = FakeRun({"data.csv": artifact})
+    cache = ArtifactCache(workdir / "cache")
+
+    for _ in range(2):
+        path = cache.use_artifact(run, "data.csv:latest").file()
+        with open(path) as fp:
+            assert fp.read() == "a,b\n1,2\n"
+    assert artifact.downloads == 1
+    assert run.used == ["data.csv:latest"] * 2
+    assert path == os.path.join("artifacts", "data.csv:v2", "data.csv")
+
+    offline = ArtifactCache(workdir / "cache", offline=True)
+    assert offline.use_artifact(None, "data.csv:latest").key == "data.csv:v2"
+    assert offline.use_artifact(None, "data.csv:v2").file() == path
+    with pytest.raises(FileNotFoundError):
+        offline.use_artifact(None, "model_export:latest")
+
+
+def test_least_recently_used_eviction(workdir):
+
+    # Room for two of the three 1 KB artifacts
+    cache = ArtifactCache(workdir / "cache", max_gb=2500 / 1024 ** 3)
+    run = FakeRun({
+        name: FakeArtifact("v0", f"digest_{name}", {f"{name}.csv": "x" * 1000})
+        for name in ("a", "b", "c")
+    })
+
+    cache.use_artifact(run, "a").download()
+    cache.use_artifact(run, "b").download()
+    cache.use_artifact(run, "a").download()
+    cache.use_artifact(run, "c").download()
+
+    assert os.path.isdir(cache.object_dir("digest_a"))
+    assert not os.path.isdir(cache.object_dir("digest_b"))
+    assert os.path.isdir(cache.object_dir("digest_c"))
+    with pytest.raises(FileNotFoundError):
+        cache.resolve("b:latest")
+
+
+def test_add_logged_files(workdir):
+
+    export_dir = workdir / "export"
+    os.makedirs(export_dir / "model_export")
+    (export_dir / "model_export" / "MLmodel").write_text("flavors: {}\n")
+
+    cache = ArtifactCache(workdir / "cache", offline=True)
+    cache.add("model_export", "v5", "def", [str(export_dir)], alias="latest")
+
+    path = cache.use_artifact(None, "model_export:latest").download()
+    assert path == os.path.join("artifacts", "model_export:v5")
+    assert (workdir / path / "model_export" / "MLmodel").read_text() == "flavors: {}\n"
+
+
+def test_download_into_a_given_root(workdir):
+
+    artifact = FakeArtifact("v0", "abc", {"data.csv": "a,b\n1,2\n"})
+    cache = ArtifactCache(workdir / "cache")
+    (workdir / "outputs").mkdir()
+    (workdir / "outputs" / "report.txt").write_text("keep me")
+
+    path = cache.use_artifact(FakeRun({"data.csv": artifact}), "data.csv").file(root="outputs")
+    assert path == os.path.join("outputs", "data.csv")
+    assert (workdir / "outputs" / "report.txt").read_text() == "keep me"
+
+
+def test_download_twice_into_the_same_root(workdir):
+
+    artifact = FakeArtifact("v0", "abc", {"data.csv": "a,b\n1,2\n"})
+    run = FakeRun({"data.csv": artifact})
+    cache = ArtifactCache(workdir / "cache")
+
+    for _ in range(2):
+        path = cache.use_artifact(run, "data.csv").file(root="out")
+        with open(path) as fp:
+            assert fp.read() == "a,b\n1,2\n"
+    with open(os.path.join(cache.object_dir("abc"), "data.csv")) as fp:
+        assert fp.read() == "a,b\n1,2\n"
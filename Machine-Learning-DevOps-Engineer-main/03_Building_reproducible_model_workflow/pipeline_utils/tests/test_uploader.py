@@ -0,0 +1,121 @@
+import os
+import tempfile
+import threading
+import time
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import pytest
+
+from pipeline_utils.uploader import BackgroundUploader, LocalStore
+
+
+class SlowStore(LocalStore):
+
+    # LocalStore with the latency of a network upload
+    def __init__(self, root, delay):
+        super().__init__(root)
+        self.delay = delay
+
+    def log_artifact(self, *args, **kwargs):
+        time.sleep(self.delay)
+        super().log_artifact(*args, **kwargs)
+
+
+def test_artifacts_outlive_the_temporary_directory(tmp_path):
+
+    store = SlowStore(tmp_path / "store", delay=0.3)
+    with BackgroundUploader(store) as uploader:
+        start = time.perf_counter()
+        for split in ("train", "test"):
+            with tempfile.TemporaryDirectory() as temp_dir:
+                path = os.path.join(temp_dir, f"data_{split}.csv")
+                with open(path, "w") as fp:
+                    fp.write(f"{split}\n")
+                uploader.log_artifact(f"data_{split}.csv", "segregated_data", split, [path])
+        # Only the staging was paid, not the uploads
+        assert time.perf_counter() - start < 0.3
+
+    for split in ("train", "test"):
+        with open(tmp_path / "store" / "artifacts" / f"data_{split}.csv" / "v0" / f"data_{split}.csv") as fp:
+            assert fp.read() == f"{split}\n"
+    assert not os.path.exists(uploader.staging_dir)
+
+
+def test_directory_and_figures(tmp_path):
+
+    store = LocalStore(tmp_path / "store")
+    with BackgroundUploader(store) as uploader:
+        export_dir = uploader.staging_path("export")
+        os.makedirs(os.path.join(export_dir, "model_export"))
+        with open(os.path.join(export_dir, "model_export", "MLmodel"), "w") as fp:
+            fp.write("flavors: {}\n")
+        uploader.log_artifact("model_export", "model_export", "export", [export_dir])
+
+        fig, ax = plt.subplots()
+        ax.plot([0, 1], [1, 0])
+        uploader.log_figures({"confusion_matrix": fig})
+        # Rendered and closed by the calling thread
+        assert not plt.fignum_exists(fig.number)
+
+    assert (tmp_path / "store" / "artifacts" / "model_export" / "v0" / "model_export" / "MLmodel").exists()
+    assert (tmp_path / "store" / "media" / "confusion_matrix.png").stat().st_size > 0
+
+
+def test_bounded_queue_and_errors(tmp_path):
+
+    class FailingStore(LocalStore):
+        def log_artifact(self, name, *args, **kwargs):
+            release.wait()
+            if name == "broken":
+                raise IOError("upload failed")
+            super().log_artifact(name, *args, **kwargs)
+
+    release = threading.Event()
+    path = tmp_path / "file.txt"
+    path.write_text("content")
+
+    uploader = BackgroundUploader(FailingStore(tmp_path / "store"), max_queue=1, n_workers=1)
+    # One job in the worker and one in the queue: a third one blocks until release
+    uploader.log_artifact("broken", "raw", "", [str(path)])
+    uploader.log_artifact("ok", "raw", "", [str(path)])
+    blocked = threading.Thread(target=uploader.log_artifact, args=("late", "raw", "", [str(path)]))
+    blocked.start()
+    time.sleep(0.2)
+    assert blocked.is_alive()
+    assert not uploader.flush(timeout=0.1)
+
+    release.set()
+    blocked.join()
+    with pytest.raises(IOError, match="upload failed"):
+        uploader.close()
+    assert (tmp_path / "store" / "artifacts" / "ok" / "v0" / "file.txt").exists()
+    assert (tmp_path / "store" / "artifacts" / "late" / "v0" / "file.txt").exists()
+
+
+def test_flush_timeout_raises(tmp_path):
+
+    path = tmp_path / "file.txt"
+    path.write_text("content")
+
+    uploader = BackgroundUploader(SlowStore(tmp_path / "store", delay=0.5), flush_timeout=0.1)
+    uploader.log_artifact("slow", "raw", "", [str(path)])
+    with pytest.raises(TimeoutError, match="1 uploads still pending"):
+        uploader.close()
+
+
+def test_upload_errors_do_not_mask_the_exception(tmp_path):
+
+    class FailingStore(LocalStore):
+        def log_artifact(self, *args, **kwargs):
+            raise IOError("upload failed")
+
+    path = tmp_path / "file.txt"
+    path.write_text("content")
+
+    with pytest.raises(ValueError, match="training failed"):
+        with BackgroundUploader(FailingStore(tmp_path / "store")) as uploader:
+            uploader.log_artifact("broken", "raw", "", [str(path)])
+            uploader.flush()
+            raise ValueError("training failed")
@@ -0,0 +1,4 @@
+"""
+Benchmarks for churn_library, run from the project folder with
+python -m benchmarks.<module>
+"""
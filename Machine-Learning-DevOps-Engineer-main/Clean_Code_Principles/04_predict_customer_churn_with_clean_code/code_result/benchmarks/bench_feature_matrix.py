@@ -0,0 +1,110 @@
+"""
+Benchmark of the feature matrix handed to sklearn: the previous dataframe[KEEP_COLS]
+selection (mixed narrow ints, float32 and float64 columns) against churn_io.feature_matrix
+(one read-only C-contiguous float32 block). For both layouts it reports the size of the
+features, the bytes sklearn allocates while validating them, and the wall time and peak
+traced memory of a 5-fold random forest fit and of predict_proba.
+
+usage: python -m benchmarks.bench_feature_matrix [--rows 100000] [--n_estimators 100] [--repeat 3]
+
+author: jazielinho
+created: 2024 July
+"""
+
+from typing import Callable, Dict
+import argparse
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import StratifiedKFold
+from sklearn.utils.validation import check_array
+
+from benchmarks.synthetic import REFERENCE_PTH, generate_chunk
+from churn_encoder import TargetEncoder
+from churn_io import (
+    BANK_SCHEMA, CATEGORICAL_COLUMNS, KEEP_COLS, RESPONSE, add_response, feature_matrix,
+    read_csv_typed
+)
+
+
+LAYOUTS: Dict[str, Callable[[pd.DataFrame], pd.DataFrame]] = {
+    'select': lambda dataframe: dataframe[KEEP_COLS],
+    'feature_matrix': feature_matrix,
+}
+
+
+def _measure(func: Callable, repeat: int):
+    """
+    returns the best wall time in seconds and the peak traced memory in MB of func
+    """
+    best, peak = np.inf, 0
+    for _ in range(repeat):
+        tracemalloc.start()
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return best, peak / 1024 ** 2
+
+
+def _cv_fits(features: pd.DataFrame, target: np.ndarray, n_estimators: int):
+    """
+    fits one forest per stratified fold, like a single grid search candidate
+    """
+    values = features.to_numpy()
+    for train_idx, _ in StratifiedKFold(n_splits=5).split(values, target):
+        RandomForestClassifier(n_estimators=n_estimators, n_jobs=1, random_state=42).fit(
+            values[train_idx], target[train_idx]
+        )
+
+
+def run_benchmark(n_rows: int, n_estimators: int, repeat: int) -> pd.DataFrame:
+    """
+    measures both layouts on n_rows synthetic rows bootstrapped from the real extract
+    input:
+            n_rows: number of rows
+            n_estimators: trees of the benchmarked forest
+            repeat: repetitions per measure, the best wall time is kept
+    output:
+            results: dataframe indexed by layout, plus the feature_matrix / select ratio
+    """
+    reference = read_csv_typed(REFERENCE_PTH, BANK_SCHEMA)
+    dataframe = add_response(generate_chunk(reference, n_rows, 0, np.random.default_rng(42)))
+    dataframe = TargetEncoder(CATEGORICAL_COLUMNS).fit_transform(dataframe, dataframe[RESPONSE])
+    target = dataframe[RESPONSE].to_numpy()
+
+    rows = []
+    for layout, select in LAYOUTS.items():
+        features = select(dataframe)
+        model = RandomForestClassifier(n_estimators=n_estimators, n_jobs=1, random_state=42)
+        model.fit(features, target)
+        tracemalloc.start()
+        check_array(features, dtype=np.float32)
+        validation_mb = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        tracemalloc.stop()
+        cv_seconds, cv_mb = _measure(lambda: _cv_fits(features, target, n_estimators), repeat)
+        predict_seconds, predict_mb = _measure(lambda: model.predict_proba(features), repeat)
+        rows.append({
+            'layout': layout,
+            'features_mb': features.memory_usage(index=False).sum() / 1024 ** 2,
+            'validation_mb': validation_mb,
+            'cv_fit_seconds': cv_seconds,
+            'cv_fit_peak_mb': cv_mb,
+            'predict_seconds': predict_seconds,
+            'predict_peak_mb': predict_mb,
+        })
+    results = pd.DataFrame(rows).set_index('layout')
+    results.loc['ratio'] = results.loc['feature_matrix'] / results.loc['select']
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the float32 feature matrix')
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--n_estimators', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    print(run_benchmark(args.rows, args.n_estimators, args.repeat).round(3).to_string())
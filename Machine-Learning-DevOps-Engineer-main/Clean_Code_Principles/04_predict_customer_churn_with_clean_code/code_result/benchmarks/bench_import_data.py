@@ -0,0 +1,115 @@
+"""
+Benchmark of the typed, cached loader against the plain pd.read_csv loader.
+Each loader runs in a fresh process so resident memory is not shared between runs.
+
+usage: python -m benchmarks.bench_import_data [--data ./data/bank_data.csv] [--repeat 3]
+
+author: jazielinho
+created: 2024 July
+"""
+
+import argparse
+import multiprocessing
+import resource
+import shutil
+import tempfile
+import time
+import pandas as pd
+
+from churn_io import load_csv_cached, read_csv_typed
+
+
+CACHE_DIR = tempfile.gettempdir() + '/churn_bench_cache'
+
+
+def _rss_mb() -> float:
+    """
+    returns the current resident set size in MB, the peak one where /proc is missing
+    """
+    try:
+        with open('/proc/self/statm', encoding='utf-8') as file:
+            return int(file.read().split()[1]) * resource.getpagesize() / 1024 ** 2
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _plain_loader(pth: str, _: str) -> pd.DataFrame:
+    """
+    the loader used before churn_io
+    """
+    return pd.read_csv(pth)
+
+
+def _typed_loader(pth: str, _: str) -> pd.DataFrame:
+    """
+    typed parse without the sidecar cache
+    """
+    return read_csv_typed(pth)
+
+
+def _cached_loader(pth: str, cache_dir: str) -> pd.DataFrame:
+    """
+    typed parse through the parquet sidecar
+    """
+    return load_csv_cached(pth, cache_dir=cache_dir)
+
+
+LOADERS = {
+    'pd.read_csv': _plain_loader,
+    'typed (no cache)': _typed_loader,
+    'typed (cold cache)': _cached_loader,
+    'typed (warm cache)': _cached_loader,
+}
+
+
+def _measure(name: str, pth: str, cache_dir: str, queue: multiprocessing.Queue):
+    """
+    loads the csv once and reports seconds, rss growth and frame size in MB
+    """
+    rss_before = _rss_mb()
+    start = time.perf_counter()
+    dataframe = LOADERS[name](pth, cache_dir)
+    elapsed = time.perf_counter() - start
+    queue.put((
+        elapsed,
+        _rss_mb() - rss_before,
+        dataframe.memory_usage(deep=True).sum() / 1024 ** 2
+    ))
+
+
+def run_benchmark(pth: str, repeat: int) -> pd.DataFrame:
+    """
+    runs every loader `repeat` times and returns the median figures
+    input:
+            pth: a path to the csv
+            repeat: number of runs per loader
+    output:
+            results: dataframe indexed by loader name
+    """
+    context = multiprocessing.get_context('spawn')
+    rows = []
+    for name in LOADERS:
+        for _ in range(repeat):
+            cache_dir = tempfile.mkdtemp() if name == 'typed (cold cache)' else CACHE_DIR
+            queue = context.Queue()
+            process = context.Process(target=_measure, args=(name, pth, cache_dir, queue))
+            process.start()
+            elapsed, rss_mb, frame_mb = queue.get()
+            process.join()
+            if name == 'typed (cold cache)':
+                shutil.rmtree(cache_dir)
+            rows.append({
+                'loader': name, 'seconds': elapsed, 'rss_growth_mb': rss_mb, 'frame_mb': frame_mb
+            })
+    return pd.DataFrame(rows).groupby('loader', sort=False).median()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark churn data loaders')
+    parser.add_argument('--data', type=str, default='./data/bank_data.csv')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    # prime the warm cache
+    load_csv_cached(args.data, cache_dir=CACHE_DIR)
+    print(run_benchmark(args.data, args.repeat).round(4).to_string())
+    shutil.rmtree(CACHE_DIR, ignore_errors=True)
@@ -0,0 +1,81 @@
+"""
+Benchmark of the import time of the churn modules, measured with python -X importtime in
+fresh interpreters. Also reports which heavy plotting / training packages an import pulls in,
+and exits with status 1 when a module loads one of them or exceeds --max_ms, so it can guard
+the lazy imports of churn_library.
+
+usage: python -m benchmarks.bench_import_time [--repeat 5] [--max_ms 2000]
+
+author: jazielinho
+created: 2024 July
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import pandas as pd
+
+
+MODULES = ['churn_library', 'churn_scoring', 'churn_artifacts', 'churn_io']
+
+# packages only needed for plotting and training
+HEAVY_PACKAGES = ['matplotlib', 'seaborn', 'sklearn', 'scipy']
+
+
+def _import_once(module: str):
+    """
+    imports module in a fresh interpreter, returns the cumulative import time in ms and
+    the heavy packages it loaded
+    """
+    code = (
+        f'import sys, {module}; '
+        f'print(",".join(p for p in {HEAVY_PACKAGES!r} if p in sys.modules))'
+    )
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        capture_output=True, text=True, check=True
+    )
+    cumulative_us = None
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module:
+            cumulative_us = int(fields[1])
+    heavy = [name for name in result.stdout.strip().split(',') if name]
+    return cumulative_us / 1000, heavy
+
+
+def run_benchmark(repeat: int) -> pd.DataFrame:
+    """
+    measures every module of MODULES
+    input:
+            repeat: number of fresh interpreters per module, the median is reported
+    output:
+            results: dataframe indexed by module
+    """
+    rows = []
+    for module in MODULES:
+        runs = [_import_once(module) for _ in range(repeat)]
+        rows.append({
+            'module': module,
+            'import_ms': statistics.median(run[0] for run in runs),
+            'heavy_packages': ','.join(runs[0][1]) or '-',
+        })
+    return pd.DataFrame(rows).set_index('module')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the import time of the churn modules')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max_ms', type=float, default=None, help='fail above this import time')
+    args = parser.parse_args()
+    results = run_benchmark(args.repeat)
+    print(results.round(1).to_string())
+
+    failed = results['heavy_packages'] != '-'
+    if args.max_ms is not None:
+        failed |= results['import_ms'] > args.max_ms
+    if failed.any():
+        print(f"Import guard failed for: {', '.join(results.index[failed])}")
+        sys.exit(1)
@@ -0,0 +1,130 @@
+"""
+Benchmark of the model artifact formats: plain joblib pickle of the sklearn forest,
+uncompressed (memory-mapped) CompactForest and compressed CompactForest.
+Reports save time, file size, load time and resident / private memory per worker process.
+
+usage: python -m benchmarks.bench_model_artifacts [--n_estimators 500] [--max_depth 100] [--workers 4]
+
+author: jazielinho
+created: 2024 July
+"""
+
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+import joblib
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+
+from churn_artifacts import load_model_artifact, save_model_artifact
+from churn_io import CATEGORICAL_COLUMNS
+from churn_library import encoder_helper, import_data, perform_feature_engineering
+
+
+def _save_plain(model: RandomForestClassifier, path: str) -> str:
+    """
+    the format written before churn_artifacts
+    """
+    joblib.dump(model, path)
+    return path
+
+
+def _save_compact(model: RandomForestClassifier, path: str) -> str:
+    """
+    uncompressed, memory-mappable CompactForest
+    """
+    return save_model_artifact(model, path, compact=True)
+
+
+def _save_compressed(model: RandomForestClassifier, path: str) -> str:
+    """
+    compressed CompactForest for cold storage
+    """
+    return save_model_artifact(model, path, compress=True, compact=True)
+
+
+FORMATS = {
+    'joblib (sklearn)': (_save_plain, joblib.load),
+    'compact (mmap)': (_save_compact, load_model_artifact),
+    'compact (gz)': (_save_compressed, load_model_artifact),
+}
+
+
+def _memory_mb():
+    """
+    returns the resident and private (resident minus file backed) memory in MB
+    """
+    page_mb = resource.getpagesize() / 1024 ** 2
+    with open('/proc/self/statm', encoding='utf-8') as file:
+        _, resident, shared = [int(value) for value in file.read().split()[:3]]
+    return resident * page_mb, (resident - shared) * page_mb
+
+
+def _load_and_predict(name: str, path: str, test_df: pd.DataFrame, queue: multiprocessing.Queue):
+    """
+    worker: loads the artifact, scores the test set and reports seconds and memory growth
+    """
+    resident_before, private_before = _memory_mb()
+    start = time.perf_counter()
+    model = FORMATS[name][1](path)
+    elapsed = time.perf_counter() - start
+    model.predict_proba(test_df)
+    resident_after, private_after = _memory_mb()
+    queue.put((elapsed, resident_after - resident_before, private_after - private_before))
+
+
+def run_benchmark(n_estimators: int, max_depth: int, workers: int) -> pd.DataFrame:
+    """
+    fits a forest on the bank data and measures every artifact format
+    input:
+            n_estimators: number of trees
+            max_depth: depth of the trees
+            workers: number of concurrent worker processes loading each artifact
+    output:
+            results: dataframe indexed by format name
+    """
+    dataframe = encoder_helper(import_data('./data/bank_data.csv'), CATEGORICAL_COLUMNS, 'Churn')
+    train_df, test_df, y_train, _ = perform_feature_engineering(dataframe, 'Churn')
+    model = RandomForestClassifier(
+        n_estimators=n_estimators, max_depth=max_depth, n_jobs=-1, random_state=42
+    ).fit(train_df, y_train)
+
+    context = multiprocessing.get_context('spawn')
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, (save, _) in FORMATS.items():
+            start = time.perf_counter()
+            path = save(model, os.path.join(tmp_dir, f'model_{len(rows)}.pkl'))
+            save_seconds = time.perf_counter() - start
+
+            queue = context.Queue()
+            processes = [
+                context.Process(target=_load_and_predict, args=(name, path, test_df, queue))
+                for _ in range(workers)
+            ]
+            for process in processes:
+                process.start()
+            results = [queue.get() for _ in processes]
+            for process in processes:
+                process.join()
+            rows.append({
+                'format': name,
+                'save_seconds': save_seconds,
+                'file_mb': os.path.getsize(path) / 1024 ** 2,
+                'load_seconds': max(result[0] for result in results),
+                'rss_mb_per_worker': sum(result[1] for result in results) / workers,
+                'private_mb_per_worker': sum(result[2] for result in results) / workers,
+            })
+    return pd.DataFrame(rows).set_index('format')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark churn model artifact formats')
+    parser.add_argument('--n_estimators', type=int, default=500)
+    parser.add_argument('--max_depth', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+    print(run_benchmark(args.n_estimators, args.max_depth, args.workers).round(3).to_string())
@@ -0,0 +1,194 @@
+"""
+Scaling benchmark of the public churn_library functions on synthetic bank data.
+Every size runs in a fresh process inside a scratch working directory (copy of config.yaml,
+empty images / models / logs / cache), so the real artifacts and caches are not touched and
+peak memory is not shared between sizes. Wall time, cpu time, peak traced memory and peak
+rss come from the churn_instrumentation stage records.
+
+usage:
+    python -m benchmarks.bench_scaling run [--sizes 10000 100000 1000000 10000000]
+        [--max_train_rows 10000] [--output ./cache/bench_scaling.json] [--save_baseline]
+    python -m benchmarks.bench_scaling compare [--current ./cache/bench_scaling.json]
+        [--baseline ./benchmarks/baselines/bench_scaling.json] [--threshold 10]
+
+compare exits with status 1 when a stage is slower or uses more memory than the baseline
+by more than --threshold percent.
+
+author: jazielinho
+created: 2024 July
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import tracemalloc
+import pandas as pd
+
+from benchmarks.synthetic import generate_bank_data
+from churn_config import CONFIG_PTH
+from churn_encoder import TargetEncoder
+from churn_instrumentation import get_records, reset_records
+from churn_io import CATEGORICAL_COLUMNS
+from churn_library import (
+    encoder_helper, import_data, perform_eda, perform_feature_engineering, train_models
+)
+
+
+SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+DATA_DIR = './cache/bench_data'
+RESULTS_PTH = './cache/bench_scaling.json'
+BASELINE_PTH = './benchmarks/baselines/bench_scaling.json'
+
+# metrics compared against the baseline, with the smallest baseline value worth comparing
+COMPARED_METRICS = {'wall_seconds': 0.1, 'peak_traced_mb': 1.0, 'peak_rss_mb': 50.0}
+
+
+def _run_size(data_pth: str, n_rows: int, max_train_rows: int) -> List[Dict[str, Any]]:
+    """
+    runs the pipeline stages on one synthetic file in a scratch working directory,
+    runs in a fresh process
+    """
+    # churn_library imports its training dependencies lazily, load them before measuring
+    # pylint: disable=import-outside-toplevel,unused-import
+    import sklearn.ensemble
+    import sklearn.linear_model
+    import sklearn.model_selection
+    config_pth = os.path.abspath(CONFIG_PTH)
+    data_pth = os.path.abspath(data_pth)
+    with tempfile.TemporaryDirectory() as work_dir:
+        shutil.copy(config_pth, os.path.join(work_dir, 'config.yaml'))
+        for folder in ('images/eda', 'images/results', 'models', 'logs'):
+            os.makedirs(os.path.join(work_dir, folder))
+        os.chdir(work_dir)
+        tracemalloc.start()
+        reset_records()
+
+        dataframe = import_data(data_pth)
+        perform_eda(dataframe)
+        encoder_helper(dataframe.copy(), CATEGORICAL_COLUMNS, 'Churn')
+        train_df, test_df, y_train, y_test = perform_feature_engineering(
+            dataframe, 'Churn', TargetEncoder(CATEGORICAL_COLUMNS)
+        )
+        if n_rows <= max_train_rows:
+            render = train_models(train_df, test_df, y_train, y_test)
+            if render is not None:
+                render.result()
+        return [{'n_rows': n_rows, **record} for record in get_records()]
+
+
+def run_benchmark(sizes: List[int], max_train_rows: int) -> Dict[str, Any]:
+    """
+    generates (or reuses) the synthetic files and measures every size
+    input:
+            sizes: numbers of rows
+            max_train_rows: train_models is skipped above this many rows, the full
+                            hyperparameter search does not scale past it in reasonable time
+    output:
+            results: dict with run metadata and one record per size and stage
+    """
+    records = []
+    context = multiprocessing.get_context('spawn')
+    for n_rows in sizes:
+        data_pth = generate_bank_data(n_rows, os.path.join(DATA_DIR, f'bank_{n_rows}.csv'))
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            size_records = executor.submit(
+                _run_size, data_pth, n_rows, max_train_rows
+            ).result()
+        for record in size_records:
+            print(f"{n_rows:>10} {record['stage']:<28} {record['wall_seconds']:>9.2f}s")
+        records.extend(size_records)
+    return {
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'machine': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'records': records,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> pd.DataFrame:
+    """
+    compares the stages present in both runs
+    input:
+            current: results of run_benchmark
+            baseline: results of run_benchmark stored as baseline
+            threshold: percentage above the baseline flagged as a regression
+    output:
+            comparison: dataframe with one row per size, stage and metric
+    """
+    keys = ['n_rows', 'stage']
+    merged = pd.DataFrame(current['records']).merge(
+        pd.DataFrame(baseline['records']), on=keys, suffixes=('', '_baseline')
+    )
+    rows = []
+    for metric, minimum in COMPARED_METRICS.items():
+        for _, record in merged.iterrows():
+            before, after = record.get(f'{metric}_baseline'), record.get(metric)
+            if pd.isna(before) or pd.isna(after) or before < minimum:
+                continue
+            change = 100 * (after - before) / before
+            rows.append({
+                'n_rows': record['n_rows'], 'stage': record['stage'], 'metric': metric,
+                'baseline': before, 'current': after, 'change_pct': change,
+                'regression': change > threshold
+            })
+    return pd.DataFrame(
+        rows,
+        columns=['n_rows', 'stage', 'metric', 'baseline', 'current', 'change_pct', 'regression']
+    )
+
+
+def _write_json(results: Dict[str, Any], pth: str):
+    """
+    writes benchmark results as json
+    """
+    os.makedirs(os.path.dirname(pth) or '.', exist_ok=True)
+    with open(pth, 'w', encoding='utf-8') as file:
+        json.dump(results, file, indent=2, default=str)
+
+
+def _read_json(pth: str) -> Dict[str, Any]:
+    """
+    reads benchmark results
+    """
+    with open(pth, encoding='utf-8') as file:
+        return json.load(file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Scaling benchmark of churn_library')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help='measure every size')
+    run_parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    run_parser.add_argument('--max_train_rows', type=int, default=10_000)
+    run_parser.add_argument('--output', type=str, default=RESULTS_PTH)
+    run_parser.add_argument(
+        '--save_baseline', action='store_true', help=f'also write {BASELINE_PTH}'
+    )
+    compare_parser = commands.add_parser('compare', help='flag regressions against the baseline')
+    compare_parser.add_argument('--current', type=str, default=RESULTS_PTH)
+    compare_parser.add_argument('--baseline', type=str, default=BASELINE_PTH)
+    compare_parser.add_argument('--threshold', type=float, default=10.0, help='percent')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        results = run_benchmark(args.sizes, args.max_train_rows)
+        _write_json(results, args.output)
+        if args.save_baseline:
+            _write_json(results, BASELINE_PTH)
+    else:
+        comparison = compare(_read_json(args.current), _read_json(args.baseline), args.threshold)
+        print(comparison.round(2).to_string(index=False))
+        if comparison['regression'].any():
+            print(f"{int(comparison['regression'].sum())} regressions above {args.threshold}%")
+            sys.exit(1)
@@ -0,0 +1,94 @@
+"""
+Synthetic bank data generator for the scaling benchmarks. Rows are bootstrapped from the
+real extract so the joint distribution of Attrition_Flag, the categorical columns and the
+numeric model features is kept, float columns get a small multiplicative jitter and every
+row gets a fresh CLIENTNUM. Files are written chunk by chunk so 10M rows fit in memory.
+
+usage: python -m benchmarks.synthetic --rows 1000000 --output ./cache/bench_data/bank_1000000.csv
+
+author: jazielinho
+created: 2024 July
+"""
+
+import argparse
+import logging
+import os
+import numpy as np
+import pandas as pd
+
+from churn_io import BANK_SCHEMA, read_csv_typed
+
+
+REFERENCE_PTH = './data/bank_data.csv'
+
+_CHUNK_SIZE = 1_000_000
+_FIRST_CLIENTNUM = 900_000_000
+
+
+def generate_chunk(
+        reference: pd.DataFrame,
+        n_rows: int,
+        start: int,
+        rng: np.random.Generator,
+        jitter: float = 0.01
+) -> pd.DataFrame:
+    """
+    returns n_rows synthetic rows with the bank schema
+    input:
+            reference: typed real extract to bootstrap from
+            n_rows: number of rows
+            start: position of the first row in the whole file, used for the ids
+            rng: random generator
+            jitter: standard deviation of the multiplicative noise of float columns
+    output:
+            chunk: dataframe with the columns of reference
+    """
+    chunk = reference.iloc[rng.integers(0, len(reference), n_rows)].reset_index(drop=True)
+    for column in chunk.select_dtypes('float').columns:
+        noise = rng.normal(1.0, jitter, n_rows).astype(chunk[column].dtype)
+        chunk[column] = chunk[column] * noise
+    positions = np.arange(start, start + n_rows)
+    if 'Unnamed: 0' in chunk.columns:
+        chunk['Unnamed: 0'] = positions
+    chunk['CLIENTNUM'] = _FIRST_CLIENTNUM + positions
+    return chunk
+
+
+def generate_bank_data(
+        n_rows: int,
+        output_pth: str,
+        reference_pth: str = REFERENCE_PTH,
+        seed: int = 42
+) -> str:
+    """
+    writes a synthetic csv with n_rows rows, skipped when output_pth already exists
+    input:
+            n_rows: number of rows
+            output_pth: path of the csv
+            reference_pth: real extract to bootstrap from
+            seed: seed of the generator
+    output:
+            output_pth: path of the csv
+    """
+    if os.path.exists(output_pth):
+        return output_pth
+    logging.info('Generating %d synthetic rows to %s', n_rows, output_pth)
+    reference = read_csv_typed(reference_pth, BANK_SCHEMA)
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.dirname(output_pth) or '.', exist_ok=True)
+    partial_pth = f'{output_pth}.partial'
+    for start in range(0, n_rows, _CHUNK_SIZE):
+        chunk = generate_chunk(reference, min(_CHUNK_SIZE, n_rows - start), start, rng)
+        chunk.to_csv(partial_pth, mode='a' if start else 'w', header=not start, index=False)
+    os.replace(partial_pth, output_pth)
+    return output_pth
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate synthetic bank data')
+    parser.add_argument('--rows', type=int, required=True)
+    parser.add_argument('--output', type=str, required=True)
+    parser.add_argument('--reference', type=str, default=REFERENCE_PTH)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    print(generate_bank_data(args.rows, args.output, args.reference, args.seed))
@@ -0,0 +1,206 @@
+"""
+This module contains the model artifact format used by churn_library:
+* CompactForest, a random forest flattened into contiguous node arrays
+* uncompressed artifacts that joblib.load(..., mmap_mode='r') maps instead of copying
+* compressed artifacts for cold storage
+* a loader that picks the right variant
+
+author: jazielinho
+created: 2024 July
+"""
+
+from typing import TYPE_CHECKING, Any, Dict, Optional
+import logging
+import os
+import numpy as np
+import joblib
+
+if TYPE_CHECKING:
+    from sklearn.ensemble import RandomForestClassifier
+
+
+COMPRESSED_EXTENSIONS = ('.gz', '.z', '.bz2', '.xz', '.lzma')
+
+_PREDICT_CHUNK_SIZE = 8192
+
+
+class CompactForest:
+    """
+    read-only random forest whose trees are stored as flat numpy arrays, so an
+    uncompressed joblib artifact can be memory-mapped and shared by worker processes.
+    sklearn trees copy their nodes on unpickling, these arrays are used in place.
+    """
+
+    def __init__(
+            self,
+            feature: np.ndarray,
+            threshold: np.ndarray,
+            children: np.ndarray,
+            value: np.ndarray,
+            roots: np.ndarray,
+            classes: np.ndarray,
+            feature_importances: np.ndarray,
+            max_depth: int,
+            params: Optional[Dict[str, Any]] = None
+    ):
+        """
+        input:
+                feature: split feature per node, -2 for leaves
+                threshold: split threshold per node
+                children: (n_nodes, 2) left and right child per node, -1 for leaves
+                value: (n_nodes, n_classes) class probabilities per node
+                roots: index of the root node of every tree
+                classes: class labels
+                feature_importances: impurity importances of the original forest
+                max_depth: depth of the deepest tree
+                params: hyperparameters of the original forest
+        """
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.value = value
+        self.roots = roots
+        self.classes_ = classes
+        self.feature_importances_ = feature_importances
+        self.max_depth = max_depth
+        self.params = params or {}
+
+    @property
+    def n_features_in_(self) -> int:
+        """
+        number of features seen during fit
+        """
+        return len(self.feature_importances_)
+
+    @classmethod
+    def from_forest(cls, model: 'RandomForestClassifier') -> 'CompactForest':
+        """
+        flattens a fitted sklearn random forest
+        input:
+                model: fitted RandomForestClassifier
+        output:
+                forest: CompactForest with the same predictions
+        """
+        trees = [estimator.tree_ for estimator in model.estimators_]
+        sizes = np.array([tree.node_count for tree in trees])
+        roots = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int32)
+        children = []
+        for tree, root in zip(trees, roots):
+            # child indices are local to each tree, shift them to the flat arrays
+            pairs = np.stack([tree.children_left, tree.children_right], axis=1)
+            children.append(np.where(pairs >= 0, pairs + root, -1))
+        children = np.concatenate(children).astype(np.int32)
+        value = np.concatenate([tree.value[:, 0, :] for tree in trees])
+        value = (value / value.sum(axis=1, keepdims=True)).astype(np.float32)
+        return cls(
+            feature=np.concatenate([tree.feature for tree in trees]).astype(np.int32),
+            threshold=np.concatenate([tree.threshold for tree in trees]),
+            children=np.ascontiguousarray(children),
+            value=value,
+            roots=roots,
+            classes=model.classes_,
+            feature_importances=model.feature_importances_,
+            max_depth=max(tree.max_depth for tree in trees),
+            params=model.get_params()
+        )
+
+    def _leaves(self, features: np.ndarray) -> np.ndarray:
+        """
+        returns the (n_samples, n_trees) leaf index reached in every tree, only the
+        (sample, tree) pairs still at an internal node are advanced at every level
+        """
+        n_samples, n_trees = len(features), len(self.roots)
+        flat_features = features.ravel()
+        nodes = np.tile(self.roots, n_samples)
+        offsets = np.repeat(np.arange(n_samples) * features.shape[1], n_trees)
+        active = np.arange(nodes.size)
+        while active.size:
+            node = nodes[active]
+            feature = self.feature[node]
+            internal = feature >= 0
+            active, node, feature = active[internal], node[internal], feature[internal]
+            go_right = flat_features[offsets[active] + feature] > self.threshold[node]
+            nodes[active] = self.children[node, go_right.view(np.int8)]
+        return nodes.reshape(n_samples, n_trees)
+
+    def predict_proba(self, features: Any) -> np.ndarray:
+        """
+        returns the class probabilities averaged over all trees
+        input:
+                features: X data, array or dataframe with the training columns in order
+        output:
+                proba: (n_samples, n_classes) probabilities
+        """
+        # sklearn trees compare float32 features against float64 thresholds
+        features = np.ascontiguousarray(features, dtype=np.float32)
+        proba = np.empty((len(features), len(self.classes_)))
+        for start in range(0, len(features), _PREDICT_CHUNK_SIZE):
+            leaves = self._leaves(features[start:start + _PREDICT_CHUNK_SIZE])
+            proba[start:start + len(leaves)] = self.value[leaves].mean(axis=1)
+        return proba
+
+    def predict(self, features: Any) -> np.ndarray:
+        """
+        returns the most likely class
+        """
+        return self.classes_[self.predict_proba(features).argmax(axis=1)]
+
+
+def _is_compressed(path: str) -> bool:
+    """
+    returns whether joblib compresses an artifact written to path
+    """
+    return path.endswith(COMPRESSED_EXTENSIONS)
+
+
+def save_model_artifact(
+        model: Any,
+        path: str,
+        compress: bool = False,
+        compact: bool = False
+) -> str:
+    """
+    saves a model as an uncompressed artifact, or as a compressed one for cold storage.
+    With compact, a random forest is flattened to a CompactForest first, whose arrays
+    load memory-mapped but which only keeps predict and predict_proba
+    input:
+            model: fitted model
+            path: path of the artifact
+            compress: write path + '.gz' instead of path
+            compact: flatten random forests to a CompactForest
+    output:
+            path: path of the written artifact
+    """
+    if compact:
+        # sklearn is only needed to save, loading and predicting a CompactForest does not
+        # import it
+        # pylint: disable=import-outside-toplevel
+        from sklearn.ensemble import RandomForestClassifier
+        if isinstance(model, RandomForestClassifier):
+            model = CompactForest.from_forest(model)
+    if compress and not _is_compressed(path):
+        path = f'{path}.gz'
+    # joblib infers the compressor from the extension and writes arrays uncompressed
+    # and aligned otherwise, which is what mmap_mode needs
+    joblib.dump(model, path)
+    return path
+
+
+def load_model_artifact(path: str, mmap: bool = True) -> Any:
+    """
+    loads a model artifact, memory-mapping the uncompressed variant when present and
+    falling back to a compressed sibling (path + '.gz', ...) otherwise
+    input:
+            path: path of the artifact
+            mmap: map arrays of uncompressed artifacts read-only instead of reading them
+    output:
+            model: fitted model
+    """
+    candidates = [path] + [f'{path}{extension}' for extension in COMPRESSED_EXTENSIONS]
+    for candidate in candidates:
+        if os.path.exists(candidate):
+            if _is_compressed(candidate) or not mmap:
+                return joblib.load(candidate)
+            logging.info('Memory-mapping model artifact %s', candidate)
+            return joblib.load(candidate, mmap_mode='r')
+    raise FileNotFoundError(f'No model artifact found at {path}')
@@ -0,0 +1,168 @@
+"""
+This module contains helpers to cache intermediate results:
+* hash dataframes, arrays, fitted models and parameter dicts
+* persist per-fold search scores in a local result store
+* persist refitted models keyed by data and parameters
+
+author: jazielinho
+created: 2024 July
+"""
+
+from typing import Dict, Optional, Tuple, Union
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import pandas as pd
+import numpy as np
+import joblib
+
+
+CACHE_DIR = './cache'
+
+
+def hash_data(*objects: Union[pd.DataFrame, pd.Series, np.ndarray]) -> str:
+    """
+    returns a short content hash for dataframes, series and arrays
+    input:
+            objects: pandas objects or numpy arrays to hash together
+    output:
+            digest: hex string identifying the content
+    """
+    digest = hashlib.sha256()
+    for obj in objects:
+        if isinstance(obj, (pd.DataFrame, pd.Series)):
+            names = list(obj.columns) if isinstance(obj, pd.DataFrame) else [obj.name]
+            digest.update(repr(names).encode())
+            digest.update(pd.util.hash_pandas_object(obj, index=True).to_numpy().tobytes())
+        else:
+            array = np.ascontiguousarray(obj)
+            digest.update(f'{array.dtype}{array.shape}'.encode())
+            digest.update(array.tobytes())
+    return digest.hexdigest()[:16]
+
+
+def hash_model(model: object) -> str:
+    """
+    returns a short content hash for a fitted model. Tree nodes are hashed through their
+    arrays, their pickled form contains uninitialized padding bytes
+    input:
+            model: fitted model
+    output:
+            digest: hex string identifying the model
+    """
+    trees = [
+        estimator.tree_ for estimator in getattr(model, 'estimators_', [])
+        if hasattr(estimator, 'tree_')
+    ]
+    if not trees:
+        return joblib.hash(model)[:16]
+    digest = hashlib.sha256(joblib.hash(model.get_params()).encode())
+    for tree in trees:
+        digest.update(hash_data(
+            tree.children_left, tree.children_right, tree.feature, tree.threshold, tree.value
+        ).encode())
+    return digest.hexdigest()[:16]
+
+
+def hash_params(params: Dict) -> str:
+    """
+    returns a canonical string key for a dict of hyperparameters
+    input:
+            params: dict of hyperparameters
+    output:
+            key: json string with sorted keys
+    """
+    return json.dumps(params, sort_keys=True, default=str)
+
+
+class ResultStore:
+    """
+    sqlite backed store of (data hash, params, fold) -> score and of refitted models
+    """
+
+    def __init__(self, path: str = os.path.join(CACHE_DIR, 'search_results.sqlite')):
+        """
+        input:
+                path: path to the sqlite file, created if missing
+        """
+        self.path = path
+        self.model_dir = os.path.join(os.path.dirname(path) or '.', 'models')
+        os.makedirs(self.model_dir, exist_ok=True)
+        with sqlite3.connect(self.path) as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS fold_scores ('
+                'data_hash TEXT, params TEXT, fold INTEGER, score REAL, '
+                'PRIMARY KEY (data_hash, params, fold))'
+            )
+
+    def get_scores(self, data_hash: str) -> Dict[Tuple[str, int], float]:
+        """
+        returns every stored fold score for a data hash
+        input:
+                data_hash: hash of the training data and cv setup
+        output:
+                scores: dict of (params key, fold) -> score, failed fits are nan
+        """
+        with sqlite3.connect(self.path) as conn:
+            rows = conn.execute(
+                'SELECT params, fold, score FROM fold_scores WHERE data_hash = ?', (data_hash,)
+            ).fetchall()
+        return {
+            (params, fold): np.nan if score is None else score
+            for params, fold, score in rows
+        }
+
+    def put_score(self, data_hash: str, params_key: str, fold: int, score: float):
+        """
+        persists a single fold score, committed immediately so a crash keeps it
+        input:
+                data_hash: hash of the training data and cv setup
+                params_key: key from hash_params
+                fold: fold number
+                score: validation score, nan for failed fits
+        output:
+                None
+        """
+        with sqlite3.connect(self.path) as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO fold_scores VALUES (?, ?, ?, ?)',
+                (data_hash, params_key, fold, None if np.isnan(score) else float(score))
+            )
+
+    def _model_path(self, data_hash: str, params_key: str) -> str:
+        """
+        returns the path of the refitted model for data and params
+        """
+        name = hashlib.sha256(f'{data_hash}{params_key}'.encode()).hexdigest()[:16]
+        return os.path.join(self.model_dir, f'{name}.pkl')
+
+    def load_model(self, data_hash: str, params_key: str) -> Optional[object]:
+        """
+        returns the cached refitted model or None
+        input:
+                data_hash: hash of the training data
+                params_key: key from hash_params
+        output:
+                model: fitted model or None
+        """
+        path = self._model_path(data_hash, params_key)
+        if not os.path.exists(path):
+            return None
+        logging.info('Loading cached model from %s', path)
+        return joblib.load(path)
+
+    def save_model(self, data_hash: str, params_key: str, model: object):
+        """
+        caches a refitted model
+        input:
+                data_hash: hash of the training data
+                params_key: key from hash_params
+                model: fitted model
+        output:
+                None
+        """
+        path = self._model_path(data_hash, params_key)
+        logging.info('Caching model to %s', path)
+        joblib.dump(model, path)
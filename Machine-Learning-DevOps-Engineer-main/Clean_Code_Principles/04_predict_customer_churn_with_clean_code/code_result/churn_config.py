@@ -0,0 +1,29 @@
+"""
+This module contains the loader of config.yaml, the settings shared by churn_library
+and its engines
+
+author: jazielinho
+created: 2024 July
+"""
+
+from typing import Any, Dict, Optional
+import os
+import yaml
+
+
+# jobs can point the library at their own settings, e.g. a nightly search budget
+CONFIG_PTH = os.environ.get('CHURN_CONFIG', './config.yaml')
+
+
+def load_config(section: Optional[str] = None, pth: str = CONFIG_PTH) -> Dict[str, Any]:
+    """
+    returns the parsed config, or one of its top level sections
+    input:
+            section: name of the top level section, None for the whole file
+            pth: path to the yaml config
+    output:
+            config: dict of settings
+    """
+    with open(pth, encoding='utf-8') as file:
+        config = yaml.safe_load(file)
+    return config if section is None else config[section]
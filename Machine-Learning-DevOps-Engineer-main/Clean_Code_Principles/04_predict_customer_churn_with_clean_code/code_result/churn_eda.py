@@ -0,0 +1,157 @@
+"""
+This module contains the EDA engine used by churn_library.perform_eda:
+* plot list driven by the eda section of config.yaml
+* every figure rendered in a worker process on the Agg backend
+* figures skipped when the content hash of their input columns did not change
+
+author: jazielinho
+created: 2024 July
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+import json
+import logging
+import os
+import pandas as pd
+
+from churn_cache import CACHE_DIR, hash_data, hash_params
+
+
+MANIFEST_PTH = os.path.join(CACHE_DIR, 'eda_manifest.json')
+
+
+def use_agg_backend():
+    """
+    worker initializer, renders without a display
+    """
+    import matplotlib  # pylint: disable=import-outside-toplevel
+    matplotlib.use('Agg')
+
+
+def plot_categorical(dataframe: pd.DataFrame, column: str, output_pth: str):
+    """
+    plots the normalized value counts of a categorical column
+    input:
+            dataframe: pandas dataframe
+            column: string of category column
+            output_pth: path to store the figure
+    output:
+            None
+    """
+    import matplotlib.pyplot as plt  # pylint: disable=import-outside-toplevel
+    plt.figure(figsize=(20, 10))
+    dataframe[column].value_counts(normalize=True).plot(kind='bar')
+    plt.savefig(output_pth)
+    plt.close()
+
+
+def plot_numerical(dataframe: pd.DataFrame, column: str, output_pth: str, density: bool = False):
+    """
+    plots the histogram of a numerical column
+    input:
+            dataframe: pandas dataframe
+            column: string of numerical column
+            output_pth: path to store the figure
+            density: add a kde line
+    output:
+            None
+    """
+    import matplotlib.pyplot as plt  # pylint: disable=import-outside-toplevel
+    import seaborn as sns  # pylint: disable=import-outside-toplevel
+    plt.figure(figsize=(20, 10))
+    sns.histplot(dataframe[column], stat='density', kde=density)
+    plt.savefig(output_pth)
+    plt.close()
+
+
+def plot_correlation(dataframe: pd.DataFrame, output_pth: str):
+    """
+    plots the correlation heatmap of the numerical columns
+    input:
+            dataframe: pandas dataframe
+            output_pth: path to store the figure
+    output:
+            None
+    """
+    import matplotlib.pyplot as plt  # pylint: disable=import-outside-toplevel
+    import seaborn as sns  # pylint: disable=import-outside-toplevel
+    plt.figure(figsize=(20, 10))
+    sns.heatmap(dataframe.corr(numeric_only=True), annot=False, cmap='Dark2_r', linewidths=2)
+    plt.savefig(output_pth)
+    plt.close()
+
+
+def _input_columns(dataframe: pd.DataFrame, plot: Dict) -> List[str]:
+    """
+    returns the columns a plot reads
+    """
+    if plot['kind'] == 'correlation':
+        return list(dataframe.select_dtypes('number').columns)
+    return [plot['column']]
+
+
+def _render(plot: Dict, dataframe: pd.DataFrame, output_pth: str):
+    """
+    renders a single plot spec, runs in a worker process
+    """
+    if plot['kind'] == 'categorical':
+        plot_categorical(dataframe, plot['column'], output_pth)
+    elif plot['kind'] == 'numerical':
+        plot_numerical(dataframe, plot['column'], output_pth, plot.get('density', False))
+    elif plot['kind'] == 'correlation':
+        plot_correlation(dataframe, output_pth)
+    else:
+        raise ValueError(f"Unknown plot kind {plot['kind']}")
+
+
+def render_plots(
+        dataframe: pd.DataFrame,
+        plots: List[Dict],
+        output_dir: str,
+        manifest_pth: str = MANIFEST_PTH,
+        n_jobs: Optional[int] = None
+) -> List[str]:
+    """
+    renders the plots whose inputs changed since the last render
+    input:
+            dataframe: pandas dataframe
+            plots: list of plot specs with kind, column and optional name / density
+            output_dir: folder to store the figures
+            manifest_pth: json file with the input hash of every rendered figure
+            n_jobs: number of worker processes, None uses all cores
+    output:
+            rendered: paths of the figures that were rendered
+    """
+    manifest = {}
+    if os.path.exists(manifest_pth):
+        with open(manifest_pth, encoding='utf-8') as file:
+            manifest = json.load(file)
+
+    tasks = {}
+    for plot in plots:
+        output_pth = os.path.join(output_dir, f"{plot.get('name', plot.get('column'))}.png")
+        columns = _input_columns(dataframe, plot)
+        subset = dataframe[columns]
+        content_hash = hash_data(subset) + hash_params(plot)
+        if manifest.get(output_pth) == content_hash and os.path.exists(output_pth):
+            logging.info('Skipping %s, inputs unchanged', output_pth)
+            continue
+        tasks[output_pth] = (plot, subset, content_hash)
+
+    if tasks:
+        os.makedirs(output_dir, exist_ok=True)
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=use_agg_backend) as executor:
+            futures = {
+                output_pth: executor.submit(_render, plot, subset, output_pth)
+                for output_pth, (plot, subset, _) in tasks.items()
+            }
+            for output_pth, future in futures.items():
+                logging.info('Plotting %s', output_pth)
+                future.result()
+                manifest[output_pth] = tasks[output_pth][2]
+
+        os.makedirs(os.path.dirname(manifest_pth) or '.', exist_ok=True)
+        with open(manifest_pth, 'w', encoding='utf-8') as file:
+            json.dump(manifest, file, indent=2)
+    return list(tasks)
@@ -0,0 +1,145 @@
+"""
+This module contains the fit/transform target encoder used by churn_library:
+* fitted once on training rows for all categorical columns
+* stores a compact integer code -> mean response lookup array per column
+* transforms new batches with np.take over category codes
+* can be fitted chunk by chunk from aggregated per-category statistics
+
+author: jazielinho
+created: 2024 July
+"""
+
+from typing import Dict, List
+import pandas as pd
+import numpy as np
+import joblib
+
+
+class TargetEncoder:
+    """
+    replaces each categorical column by the mean response of its category, categories
+    not seen during fit (and missing values) get the overall mean response
+    """
+
+    def __init__(self, columns: List[str], suffix: str = '_Churn'):
+        """
+        input:
+                columns: list of columns that contain categorical features
+                suffix: suffix of the encoded column names
+        """
+        self.columns = list(columns)
+        self.suffix = suffix
+        self.categories_: Dict[str, pd.Index] = {}
+        self.lookups_: Dict[str, np.ndarray] = {}
+        self.prior_: float = np.nan
+        # per column dataframe of response sum and count per category, for partial_fit
+        self.stats_: Dict[str, pd.DataFrame] = {}
+        self.target_sum_: float = 0.0
+        self.n_rows_: int = 0
+
+    def _codes(self, values: pd.Series, column: str) -> np.ndarray:
+        """
+        returns the category codes of values against the fitted categories, -1 if unseen
+        """
+        categories = self.categories_[column]
+        if isinstance(values.dtype, pd.CategoricalDtype) and values.cat.categories.equals(categories):
+            return values.cat.codes.to_numpy()
+        return pd.Index(categories).get_indexer(np.asarray(values))
+
+    def fit(self, dataframe: pd.DataFrame, target: pd.Series) -> 'TargetEncoder':
+        """
+        fits the lookup arrays of every column
+        input:
+                dataframe: pandas dataframe with the categorical columns
+                target: response values aligned with dataframe
+        output:
+                self: fitted encoder
+        """
+        target = np.asarray(target, dtype=float)
+        self.prior_ = float(target.mean())
+        for column in self.columns:
+            values = dataframe[column]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                self.categories_[column] = values.cat.categories
+            else:
+                self.categories_[column] = pd.Index(values.dropna().unique()).sort_values()
+            codes = self._codes(values, column)
+            seen = codes >= 0
+            size = len(self.categories_[column])
+            counts = np.bincount(codes[seen], minlength=size)
+            sums = np.bincount(codes[seen], weights=target[seen], minlength=size)
+            means = np.divide(sums, counts, out=np.full(size, self.prior_), where=counts > 0)
+            # the last slot holds the prior, so code -1 (unseen) takes it through np.take
+            self.lookups_[column] = np.append(means, self.prior_)
+        return self
+
+    def partial_fit(self, dataframe: pd.DataFrame, target: pd.Series) -> 'TargetEncoder':
+        """
+        adds the response sum and count per category of a chunk to the statistics of the
+        previous chunks and refreshes the lookup arrays, so chunks of a file too large for
+        memory give the same encoder as fit on all rows
+        input:
+                dataframe: pandas dataframe chunk with the categorical columns
+                target: response values aligned with dataframe
+        output:
+                self: fitted encoder
+        """
+        target = np.asarray(target, dtype=float)
+        for column in self.columns:
+            chunk_stats = pd.DataFrame({
+                'value': np.asarray(dataframe[column], dtype=object), 'target': target
+            }).groupby('value')['target'].agg(['sum', 'count'])
+            if column in self.stats_:
+                chunk_stats = self.stats_[column].add(chunk_stats, fill_value=0)
+            self.stats_[column] = chunk_stats.sort_index()
+
+        self.target_sum_ += float(target.sum())
+        self.n_rows_ += len(target)
+        self.prior_ = self.target_sum_ / self.n_rows_
+        for column in self.columns:
+            stats = self.stats_[column]
+            self.categories_[column] = pd.Index(stats.index)
+            means = (stats['sum'] / stats['count']).to_numpy(dtype=float)
+            self.lookups_[column] = np.append(means, self.prior_)
+        return self
+
+    def transform(self, dataframe: pd.DataFrame, inplace: bool = False) -> pd.DataFrame:
+        """
+        adds the encoded columns to dataframe
+        input:
+                dataframe: pandas dataframe with the categorical columns
+                inplace: add the columns to dataframe instead of a copy
+        output:
+                dataframe: pandas dataframe with new columns {column}{suffix}
+        """
+        if not self.lookups_:
+            raise ValueError('TargetEncoder is not fitted')
+        dataframe = dataframe if inplace else dataframe.copy()
+        for column in self.columns:
+            codes = self._codes(dataframe[column], column)
+            dataframe[f'{column}{self.suffix}'] = np.take(self.lookups_[column], codes)
+        return dataframe
+
+    def fit_transform(
+            self,
+            dataframe: pd.DataFrame,
+            target: pd.Series,
+            inplace: bool = False
+    ) -> pd.DataFrame:
+        """
+        fits the encoder and transforms the same rows
+        """
+        return self.fit(dataframe, target).transform(dataframe, inplace=inplace)
+
+    def save(self, path: str):
+        """
+        serializes the fitted encoder to path
+        """
+        joblib.dump(self, path)
+
+    @staticmethod
+    def load(path: str) -> 'TargetEncoder':
+        """
+        loads an encoder written by save
+        """
+        return joblib.load(path)
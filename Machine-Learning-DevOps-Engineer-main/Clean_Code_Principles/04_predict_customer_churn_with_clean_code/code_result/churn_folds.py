@@ -0,0 +1,193 @@
+"""
+This module contains the cross-validation fold plan shared by the model families:
+* stratified fold indices computed once from the raw training rows
+* a TargetEncoder fitted per fold on the fold training rows only, so the validation
+  rows never leak into their own encoding
+* the encoded float32 matrices of every fold stored as .npy files, keyed on the content
+  of the rows, and memory-mapped by the workers
+* every (model, fold) fit runs in parallel against the same matrices, adding a model
+  costs its own fits only
+
+author: jazielinho
+created: 2024 July
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+import json
+import logging
+import os
+import shutil
+import time
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+
+from churn_cache import CACHE_DIR, hash_data
+from churn_encoder import TargetEncoder
+from churn_io import CATEGORICAL_COLUMNS, KEEP_COLS, NUMERICAL_COLUMNS, feature_matrix
+
+
+FOLDS_DIR = os.path.join(CACHE_DIR, 'folds')
+
+_ARRAYS = ('train_idx', 'val_idx', 'x_train', 'y_train', 'x_val', 'y_val')
+
+
+class FoldPlan:
+    """
+    stratified folds of the training rows with their encoded matrices on disk
+    """
+
+    def __init__(self, directory: str):
+        """
+        opens a plan written by FoldPlan.build
+        input:
+                directory: folder of the plan
+        """
+        with open(os.path.join(directory, 'plan.json'), encoding='utf-8') as file:
+            manifest = json.load(file)
+        self.directory = directory
+        self.n_splits = manifest['n_splits']
+        self.columns = manifest['columns']
+        self.n_rows = manifest['n_rows']
+
+    @classmethod
+    def build(
+            cls,
+            dataframe: pd.DataFrame,
+            response: str,
+            n_splits: int = 5,
+            random_state: int = 42,
+            cache_dir: str = FOLDS_DIR
+    ) -> 'FoldPlan':
+        """
+        computes the folds of dataframe, or opens them when the same rows were planned before
+        input:
+                dataframe: raw training rows with the categorical, numerical and response
+                           columns, the test rows must be left out
+                response: name of the response column
+                n_splits: number of stratified folds
+                random_state: seed of the shuffle of the folds
+                cache_dir: folder of the plans
+        output:
+                plan: FoldPlan
+        """
+        # pylint: disable=import-outside-toplevel
+        from sklearn.model_selection import StratifiedKFold
+        rows = dataframe[NUMERICAL_COLUMNS + CATEGORICAL_COLUMNS]
+        target = dataframe[response]
+        key = hash_data(rows, target, np.array([n_splits, random_state]))
+        directory = os.path.join(cache_dir, key)
+        if os.path.exists(os.path.join(directory, 'plan.json')):
+            logging.info('Loading cached fold plan %s', directory)
+            return cls(directory)
+
+        logging.info('Building a %d-fold plan of %d rows in %s', n_splits, len(dataframe), directory)
+        partial_dir = f'{directory}.partial'
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        os.makedirs(partial_dir)
+        folds = StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=random_state)
+        for fold, (train_idx, val_idx) in enumerate(folds.split(rows, target)):
+            train_rows, val_rows = dataframe.iloc[train_idx], dataframe.iloc[val_idx]
+            encoder = TargetEncoder(CATEGORICAL_COLUMNS)
+            encoder.fit(train_rows, train_rows[response])
+            arrays = {
+                'train_idx': train_idx,
+                'val_idx': val_idx,
+                'x_train': feature_matrix(encoder.transform(train_rows), KEEP_COLS).to_numpy(),
+                'y_train': train_rows[response].to_numpy(),
+                'x_val': feature_matrix(encoder.transform(val_rows), KEEP_COLS).to_numpy(),
+                'y_val': val_rows[response].to_numpy(),
+            }
+            for name, array in arrays.items():
+                np.save(os.path.join(partial_dir, f'fold_{fold}_{name}.npy'), array)
+            encoder.save(os.path.join(partial_dir, f'fold_{fold}_encoder.pkl'))
+        with open(os.path.join(partial_dir, 'plan.json'), 'w', encoding='utf-8') as file:
+            json.dump({'n_splits': n_splits, 'columns': KEEP_COLS, 'n_rows': len(dataframe)}, file)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(partial_dir, directory)
+        return cls(directory)
+
+    def fold(self, fold: int) -> Dict[str, np.ndarray]:
+        """
+        returns the read-only memory-mapped arrays of a fold
+        input:
+                fold: fold number
+        output:
+                arrays: dict with train_idx, val_idx, x_train, y_train, x_val and y_val
+        """
+        return {
+            name: np.load(os.path.join(self.directory, f'fold_{fold}_{name}.npy'), mmap_mode='r')
+            for name in _ARRAYS
+        }
+
+    def encoder(self, fold: int) -> TargetEncoder:
+        """
+        returns the encoder fitted on the training rows of a fold
+        """
+        return TargetEncoder.load(os.path.join(self.directory, f'fold_{fold}_encoder.pkl'))
+
+
+def _fit_fold(estimator: Any, directory: str, fold: int) -> Tuple[float, float]:
+    """
+    fits estimator on a fold and scores it on the validation rows, runs in a worker
+    process that maps the fold from disk
+    output:
+            score: validation accuracy, nan if the fit failed
+            fit_seconds: seconds of the fit
+    """
+    arrays = FoldPlan(directory).fold(fold)
+    start = time.perf_counter()
+    try:
+        estimator.fit(arrays['x_train'], arrays['y_train'])
+    except Exception as err:  # pylint: disable=broad-except
+        logging.warning('Fit of fold %d failed, %s', fold, err)
+        return np.nan, time.perf_counter() - start
+    fit_seconds = time.perf_counter() - start
+    return float(estimator.score(arrays['x_val'], arrays['y_val'])), fit_seconds
+
+
+def cross_validate(
+        plan: FoldPlan,
+        estimators: Dict[str, Any],
+        n_jobs: Optional[int] = None
+) -> pd.DataFrame:
+    """
+    scores every estimator on every fold of plan, all (estimator, fold) fits run in
+    parallel and only the plan directory is sent to the workers
+    input:
+            plan: FoldPlan
+            estimators: dict of name -> unfitted estimator
+            n_jobs: number of worker processes, None uses all cores
+    output:
+            scores: dataframe with one row per model and fold, with score and fit_seconds
+    """
+    # pylint: disable=import-outside-toplevel
+    from sklearn.base import clone
+    tasks: List[Tuple[str, int]] = [
+        (name, fold) for name in estimators for fold in range(plan.n_splits)
+    ]
+    logging.info(
+        'Cross-validating %d models on %d folds, %d fits', len(estimators), plan.n_splits, len(tasks)
+    )
+    results = Parallel(n_jobs=-1 if n_jobs is None else n_jobs)(
+        delayed(_fit_fold)(clone(estimators[name]), plan.directory, fold) for name, fold in tasks
+    )
+    return pd.DataFrame([
+        {'model': name, 'fold': fold, 'score': score, 'fit_seconds': fit_seconds}
+        for (name, fold), (score, fit_seconds) in zip(tasks, results)
+    ])
+
+
+def summarize(scores: pd.DataFrame) -> pd.DataFrame:
+    """
+    returns the mean and standard deviation of the fold scores per model, best first
+    input:
+            scores: output of cross_validate
+    output:
+            summary: dataframe indexed by model
+    """
+    summary = scores.groupby('model').agg(
+        mean_score=('score', 'mean'), std_score=('score', 'std'),
+        fit_seconds=('fit_seconds', 'sum')
+    )
+    return summary.sort_values('mean_score', ascending=False)
@@ -0,0 +1,139 @@
+"""
+This module contains the permutation importance engine used by churn_library:
+* a stratified subsample of the evaluation data, scored once for the base accuracy
+* columns shuffled in parallel workers, each worker receives the model once
+* results cached per (model hash, data hash, settings)
+
+author: jazielinho
+created: 2024 July
+"""
+
+from typing import Any, List, Optional
+import logging
+import os
+import numpy as np
+import pandas as pd
+import joblib
+from joblib import Parallel, delayed
+
+from churn_cache import CACHE_DIR, hash_data, hash_model
+
+
+IMPORTANCE_DIR = os.path.join(CACHE_DIR, 'importance')
+
+
+def stratified_sample(
+        dataframe: pd.DataFrame,
+        target: pd.Series,
+        sample_size: int,
+        random_state: int = 42
+) -> np.ndarray:
+    """
+    returns the positions of a subsample that keeps the class proportions of target
+    input:
+            dataframe: X data
+            target: y data
+            sample_size: number of rows, all rows when the data is smaller
+            random_state: seed of the sample
+    output:
+            positions: sorted row positions of the subsample
+    """
+    if sample_size >= len(dataframe):
+        return np.arange(len(dataframe))
+    rng = np.random.default_rng(random_state)
+    target = np.asarray(target)
+    positions = []
+    for label in np.unique(target):
+        members = np.flatnonzero(target == label)
+        size = max(1, int(round(len(members) * sample_size / len(target))))
+        positions.append(rng.choice(members, size=min(size, len(members)), replace=False))
+    return np.sort(np.concatenate(positions))
+
+
+def _permuted_drops(
+        model: Any,
+        dataframe: pd.DataFrame,
+        target: np.ndarray,
+        base_score: float,
+        columns: List[int],
+        n_repeats: int,
+        random_state: int
+) -> np.ndarray:
+    """
+    shuffles each column of columns n_repeats times and returns the accuracy drops,
+    runs in a worker process
+    output:
+            drops: (len(columns), n_repeats) base accuracy minus permuted accuracy
+    """
+    permuted = dataframe.copy()
+    drops = np.empty((len(columns), n_repeats))
+    for i, column in enumerate(columns):
+        original = dataframe.iloc[:, column].to_numpy()
+        rng = np.random.default_rng([random_state, column])
+        for repeat in range(n_repeats):
+            permuted.iloc[:, column] = rng.permutation(original)
+            drops[i, repeat] = base_score - np.mean(model.predict(permuted) == target)
+        permuted.iloc[:, column] = original
+    return drops
+
+
+def permutation_importance(
+        model: Any,
+        dataframe: pd.DataFrame,
+        target: pd.Series,
+        n_repeats: int = 5,
+        sample_size: int = 2000,
+        n_jobs: Optional[int] = None,
+        random_state: int = 42,
+        cache_dir: str = IMPORTANCE_DIR
+) -> pd.DataFrame:
+    """
+    returns the permutation importance (drop of accuracy when a column is shuffled) of
+    every column, computed on a stratified subsample and cached per model and data
+    input:
+            model: fitted classifier with predict
+            dataframe: X data, preferably held out
+            target: y data
+            n_repeats: number of shuffles per column
+            sample_size: number of rows of the stratified subsample
+            n_jobs: number of worker processes, None uses all cores
+            random_state: seed of the subsample and the shuffles
+            cache_dir: folder of the cached results
+    output:
+            importances: dataframe indexed by column with importance_mean and importance_std
+    """
+    settings = {'n_repeats': n_repeats, 'sample_size': sample_size, 'random_state': random_state}
+    key = '_'.join([
+        hash_model(model), hash_data(dataframe, target), joblib.hash(settings)[:8]
+    ])
+    cache_pth = os.path.join(cache_dir, f'{key}.json')
+    if os.path.exists(cache_pth):
+        logging.info('Loading cached permutation importance %s', cache_pth)
+        return pd.read_json(cache_pth, orient='index')
+
+    positions = stratified_sample(dataframe, target, sample_size, random_state)
+    sample, sample_target = dataframe.iloc[positions], np.asarray(target)[positions]
+    base_score = float(np.mean(model.predict(sample) == sample_target))
+    n_workers = joblib.effective_n_jobs(-1 if n_jobs is None else n_jobs)
+    chunks = [
+        chunk.tolist() for chunk in np.array_split(np.arange(sample.shape[1]), n_workers)
+        if len(chunk)
+    ]
+    logging.info(
+        'Permutation importance: %d columns x %d repeats on %d rows, %d workers',
+        sample.shape[1], n_repeats, len(sample), len(chunks)
+    )
+    results = Parallel(n_jobs=len(chunks))(
+        delayed(_permuted_drops)(
+            model, sample, sample_target, base_score, chunk, n_repeats, random_state
+        )
+        for chunk in chunks
+    )
+    drops = np.concatenate(results)
+    importances = pd.DataFrame(
+        {'importance_mean': drops.mean(axis=1), 'importance_std': drops.std(axis=1)},
+        index=dataframe.columns
+    )
+    os.makedirs(cache_dir, exist_ok=True)
+    importances.to_json(cache_pth, orient='index')
+    return importances
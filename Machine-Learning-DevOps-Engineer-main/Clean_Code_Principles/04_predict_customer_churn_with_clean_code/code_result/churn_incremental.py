@@ -0,0 +1,144 @@
+"""
+This module contains the incremental retraining mode of the churn random forest:
+* a checkpoint with the last selected sklearn forest, its search score and the rows it has seen
+* growing additional trees on the new rows only, with warm_start
+* a holdout check on new rows that tells the caller to fall back to the full search
+
+author: jazielinho
+created: 2024 July
+"""
+
+from typing import Any, Dict, List, Optional, Tuple
+import copy
+import logging
+import os
+import numpy as np
+import pandas as pd
+import joblib
+
+from churn_cache import CACHE_DIR
+
+
+CHECKPOINT_PTH = os.path.join(CACHE_DIR, 'rf_checkpoint.joblib')
+
+
+def row_hashes(dataframe: pd.DataFrame, target: pd.Series, columns: List[str]) -> np.ndarray:
+    """
+    returns one uint64 content hash per row, used to tell new rows from seen ones
+    input:
+            dataframe: X data
+            target: y data
+            columns: columns identifying a row, e.g. the raw features. Target encoded columns
+                     change whenever the data is refreshed and should be left out
+    output:
+            hashes: uint64 array with one hash per row
+    """
+    identity = dataframe[columns].assign(_target=np.asarray(target))
+    return pd.util.hash_pandas_object(identity, index=False).to_numpy()
+
+
+def save_checkpoint(checkpoint: Dict[str, Any], pth: str = CHECKPOINT_PTH):
+    """
+    saves a checkpoint dict with model, score and seen (row hashes)
+    """
+    os.makedirs(os.path.dirname(pth) or '.', exist_ok=True)
+    joblib.dump(checkpoint, pth)
+
+
+def load_checkpoint(pth: str = CHECKPOINT_PTH) -> Optional[Dict[str, Any]]:
+    """
+    returns the checkpoint saved at pth, None when there is none
+    """
+    if not os.path.exists(pth):
+        return None
+    return joblib.load(pth)
+
+
+def warm_start_forest(
+        checkpoint: Dict[str, Any],
+        train_df: pd.DataFrame,
+        y_train: pd.Series,
+        id_columns: List[str],
+        n_new_trees: int = 100,
+        max_trees: int = 1000,
+        holdout_size: float = 0.3,
+        min_new_rows: int = 100,
+        max_score_drop: float = 0.01,
+        n_jobs: int = -1
+) -> Tuple[Optional[Any], Dict[str, Any]]:
+    """
+    grows n_new_trees trees on the rows of train_df the checkpointed forest has not seen,
+    keeping its hyperparameters, and scores the result on held out new rows
+    input:
+            checkpoint: dict with model (fitted RandomForestClassifier), score (accuracy
+                        of the last full search) and seen (row hashes)
+            train_df: X training data, old and new rows
+            y_train: y training data
+            id_columns: columns identifying a row, see row_hashes
+            n_new_trees: number of trees added per refresh
+            max_trees: a forest that would grow past this many trees is searched again
+            holdout_size: share of the new rows held out to score the updated forest
+            min_new_rows: below this many new rows no trees are added, the forest is only
+                          scored on the new rows and they stay unseen for the next refresh
+            max_score_drop: largest accepted drop of the holdout accuracy below the score
+                            of the last full search
+            n_jobs: number of cores used to grow the trees
+    output:
+            model: updated forest, None when the caller should fall back to a full search
+            checkpoint: checkpoint to save with the updated model and seen rows
+    """
+    # pylint: disable=import-outside-toplevel
+    from sklearn.model_selection import train_test_split
+
+    model = checkpoint['model']
+    if list(train_df.columns) != list(getattr(model, 'feature_names_in_', train_df.columns)):
+        logging.info('Incremental training: features changed, a full search is needed')
+        return None, checkpoint
+
+    hashes = row_hashes(train_df, y_train, id_columns)
+    new_rows = ~np.isin(hashes, checkpoint['seen'])
+    n_new = int(new_rows.sum())
+    new_df, new_y = train_df[new_rows], y_train[new_rows]
+    logging.info('Incremental training: %d new rows out of %d', n_new, len(train_df))
+    if n_new == 0:
+        return model, checkpoint
+
+    if n_new < min_new_rows:
+        holdout_df, holdout_y = new_df, new_y
+        seen = checkpoint['seen']
+    else:
+        try:
+            grow_df, holdout_df, grow_y, holdout_y = train_test_split(
+                new_df, new_y, test_size=holdout_size, random_state=42, stratify=new_y
+            )
+        except ValueError:
+            # a class with a single new row cannot be stratified
+            grow_df, holdout_df, grow_y, holdout_y = train_test_split(
+                new_df, new_y, test_size=holdout_size, random_state=42
+            )
+        if model.n_estimators + n_new_trees > max_trees:
+            logging.info(
+                'Incremental training: forest reached %d trees, a full search is needed', max_trees
+            )
+            return None, checkpoint
+        if not np.array_equal(np.unique(grow_y), model.classes_):
+            # trees fitted on a subset of the classes cannot be averaged with the others
+            logging.info('Incremental training: new rows miss a class, a full search is needed')
+            return None, checkpoint
+        # the checkpointed forest is left untouched in case the update is rejected
+        model = copy.deepcopy(model)
+        model.set_params(
+            warm_start=True, n_estimators=model.n_estimators + n_new_trees, n_jobs=n_jobs
+        )
+        model.fit(grow_df, grow_y)
+        model.set_params(warm_start=False)
+        seen = np.union1d(checkpoint['seen'], hashes[new_rows])
+
+    score = float(np.mean(model.predict(holdout_df) == np.asarray(holdout_y)))
+    logging.info(
+        'Incremental training: holdout accuracy %.4f, last full search %.4f',
+        score, checkpoint['score']
+    )
+    if score < checkpoint['score'] - max_score_drop:
+        return None, checkpoint
+    return model, {**checkpoint, 'model': model, 'seen': seen}
@@ -0,0 +1,166 @@
+"""
+This module contains the stage instrumentation used by churn_library:
+* wall time, cpu time (including reaped worker processes), peak traced memory, peak rss
+  and rows per stage
+* a machine-readable json report of the current run
+* a jsonl history of every stage, appended run after run, to spot regressions
+
+author: jazielinho
+created: 2024 July
+"""
+
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import wraps
+from typing import Any, Callable, Dict, Iterator, List, Optional
+import json
+import logging
+import os
+import resource
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+
+REPORT_PTH = './logs/run_report.json'
+HISTORY_PTH = './logs/stage_history.jsonl'
+
+_RUN_RECORDS: List[Dict[str, Any]] = []
+# running peak of every open stage, inner stages reset the tracemalloc peak
+_PEAK_STACK: List[int] = []
+
+
+def _cpu_seconds() -> float:
+    """
+    returns the user + system cpu time of this process and its reaped children
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def _count_rows(args: tuple) -> Optional[int]:
+    """
+    returns the length of the first dataframe, series or array argument
+    """
+    for arg in args:
+        if isinstance(arg, (pd.DataFrame, pd.Series, np.ndarray)):
+            return len(arg)
+    return None
+
+
+def add_record(record: Dict[str, Any]):
+    """
+    adds a stage record to the current run, e.g. one measured in a worker process
+    """
+    _RUN_RECORDS.append(record)
+
+
+def get_records() -> List[Dict[str, Any]]:
+    """
+    returns the stage records of the current run
+    """
+    return list(_RUN_RECORDS)
+
+
+def reset_records():
+    """
+    starts a new run
+    """
+    _RUN_RECORDS.clear()
+
+
+@contextmanager
+def measure(stage: str, rows: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """
+    measures the enclosed block, the yielded record is filled in on exit. The record is
+    not added to the run, see add_record and instrument
+    input:
+            stage: name of the stage
+            rows: number of rows processed
+    output:
+            record: dict with stage, rows, wall_seconds, cpu_seconds, peak_traced_mb (None
+                    unless tracemalloc is tracing) and peak_rss_mb of the process so far
+    """
+    record = {'stage': stage, 'rows': rows}
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        if _PEAK_STACK:
+            _PEAK_STACK[-1] = max(_PEAK_STACK[-1], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        _PEAK_STACK.append(0)
+    wall_start, cpu_start = time.perf_counter(), _cpu_seconds()
+    try:
+        yield record
+    finally:
+        record['wall_seconds'] = time.perf_counter() - wall_start
+        record['cpu_seconds'] = _cpu_seconds() - cpu_start
+        record['peak_traced_mb'] = None
+        # ru_maxrss is in KB on linux
+        record['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        if tracing:
+            peak = max(_PEAK_STACK.pop(), tracemalloc.get_traced_memory()[1])
+            if _PEAK_STACK:
+                _PEAK_STACK[-1] = max(_PEAK_STACK[-1], peak)
+            record['peak_traced_mb'] = peak / 1024 ** 2
+        logging.info(
+            'Stage %s: %.3fs wall, %.3fs cpu, peak %s MB, %s rows',
+            stage, record['wall_seconds'], record['cpu_seconds'],
+            None if record['peak_traced_mb'] is None else round(record['peak_traced_mb'], 1),
+            rows
+        )
+
+
+def instrument(stage: str) -> Callable:
+    """
+    decorator that measures every call of a function and adds it to the current run,
+    rows are taken from the first dataframe, series or array argument, or from the result
+    input:
+            stage: name of the stage
+    output:
+            decorator
+    """
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with measure(stage, _count_rows(args)) as record:
+                result = func(*args, **kwargs)
+            if record['rows'] is None:
+                record['rows'] = _count_rows((result,))
+            add_record(record)
+            return result
+        return wrapper
+    return decorator
+
+
+def write_run_report(
+        metadata: Optional[Dict[str, Any]] = None,
+        report_pth: str = REPORT_PTH,
+        history_pth: str = HISTORY_PTH
+) -> Dict[str, Any]:
+    """
+    writes the json report of the current run and appends its stages to the history
+    input:
+            metadata: extra fields identifying the run, e.g. the data path and size
+            report_pth: path of the json run report, overwritten
+            history_pth: path of the jsonl history, appended
+    output:
+            report: the written report
+    """
+    report = {
+        'run_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'metadata': metadata or {},
+        'stages': get_records(),
+    }
+    for pth in (report_pth, history_pth):
+        os.makedirs(os.path.dirname(pth) or '.', exist_ok=True)
+    with open(report_pth, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2, default=str)
+    with open(history_pth, 'a', encoding='utf-8') as file:
+        for record in report['stages']:
+            file.write(json.dumps(
+                {'run_at': report['run_at'], **report['metadata'], **record}, default=str
+            ) + '\n')
+    logging.info('Wrote run report to %s', report_pth)
+    return report
@@ -0,0 +1,237 @@
+"""
+This module contains the typed ingestion layer used by churn_library:
+* explicit schema for the bank extract (category and narrow numeric dtypes)
+* pyarrow backed csv parser, with a fallback to the pandas c parser
+* parquet sidecar cache keyed on the csv size, mtime and content hash and on the schema
+* fixed-size chunk readers for csv and parquet inputs
+* compact float32 feature matrix shared by the fits and predictions
+
+author: jazielinho
+created: 2024 July
+"""
+
+from typing import Dict, Iterator, List, Optional
+import hashlib
+import json
+import logging
+import os
+import numpy as np
+import pandas as pd
+
+from churn_cache import CACHE_DIR
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - pyarrow is optional
+    pq = None
+
+
+CATEGORICAL_COLUMNS = [
+    'Gender', 'Education_Level', 'Marital_Status', 'Income_Category', 'Card_Category'
+]
+
+NUMERICAL_COLUMNS = [
+    'Customer_Age', 'Dependent_count', 'Months_on_book',
+    'Total_Relationship_Count', 'Months_Inactive_12_mon',
+    'Contacts_Count_12_mon', 'Credit_Limit', 'Total_Revolving_Bal',
+    'Avg_Open_To_Buy', 'Total_Amt_Chng_Q4_Q1', 'Total_Trans_Amt',
+    'Total_Trans_Ct', 'Total_Ct_Chng_Q4_Q1', 'Avg_Utilization_Ratio'
+]
+
+# model features, the numerical columns plus the target encoded categorical columns
+KEEP_COLS = NUMERICAL_COLUMNS + [f'{column}_Churn' for column in CATEGORICAL_COLUMNS]
+
+BANK_SCHEMA: Dict[str, str] = {
+    'Unnamed: 0': 'int32',
+    'CLIENTNUM': 'int64',
+    'Attrition_Flag': 'category',
+    'Customer_Age': 'int16',
+    'Gender': 'category',
+    'Dependent_count': 'int8',
+    'Education_Level': 'category',
+    'Marital_Status': 'category',
+    'Income_Category': 'category',
+    'Card_Category': 'category',
+    'Months_on_book': 'int16',
+    'Total_Relationship_Count': 'int8',
+    'Months_Inactive_12_mon': 'int8',
+    'Contacts_Count_12_mon': 'int8',
+    'Credit_Limit': 'float32',
+    'Total_Revolving_Bal': 'int32',
+    'Avg_Open_To_Buy': 'float32',
+    'Total_Amt_Chng_Q4_Q1': 'float32',
+    'Total_Trans_Amt': 'int32',
+    'Total_Trans_Ct': 'int16',
+    'Total_Ct_Chng_Q4_Q1': 'float32',
+    'Avg_Utilization_Ratio': 'float32',
+}
+
+RESPONSE = 'Churn'
+
+_HASH_CHUNK_SIZE = 1 << 20
+
+
+def add_response(dataframe: pd.DataFrame) -> pd.DataFrame:
+    """
+    adds the binary response column derived from Attrition_Flag, in place
+    input:
+            dataframe: pandas dataframe with the bank columns
+    output:
+            dataframe: the same dataframe
+    """
+    dataframe[RESPONSE] = (dataframe['Attrition_Flag'] != 'Attrited Customer').astype(int)
+    return dataframe
+
+
+def _file_sha256(pth: str) -> str:
+    """
+    returns the sha256 of a file read in chunks
+    """
+    digest = hashlib.sha256()
+    with open(pth, 'rb') as file:
+        for chunk in iter(lambda: file.read(_HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _schema_hash(schema: Dict[str, str]) -> str:
+    """
+    returns a short hash of a schema, independent of the order of its columns
+    """
+    return hashlib.sha256(json.dumps(schema, sort_keys=True).encode()).hexdigest()[:8]
+
+
+def _sidecar_paths(pth: str, cache_dir: str, schema_hash: str):
+    """
+    returns the parquet and manifest paths of the sidecar cache of a csv read with a schema
+    """
+    name = hashlib.sha256(os.path.abspath(pth).encode()).hexdigest()[:16]
+    base = os.path.join(cache_dir, f'{os.path.basename(pth)}.{name}.{schema_hash}')
+    return f'{base}.parquet', f'{base}.json'
+
+
+def read_csv_typed(pth: str, schema: Optional[Dict[str, str]] = None) -> pd.DataFrame:
+    """
+    parses a csv with an explicit schema, using pyarrow when available
+    input:
+            pth: a path to the csv
+            schema: dict of column -> dtype, columns not listed are inferred
+    output:
+            dataframe: pandas dataframe
+    """
+    schema = BANK_SCHEMA if schema is None else schema
+    header = pd.read_csv(pth, nrows=0).columns
+    dtype = {column: dtype for column, dtype in schema.items() if column in header}
+    if pq is not None:
+        # the pyarrow engine leaves unnamed columns empty, the names of the c parser are
+        # passed so the schema also types them
+        return pd.read_csv(pth, engine='pyarrow', header=0, names=list(header), dtype=dtype)
+    return pd.read_csv(pth, dtype=dtype)
+
+
+def load_csv_cached(
+        pth: str,
+        schema: Optional[Dict[str, str]] = None,
+        cache_dir: str = CACHE_DIR
+) -> pd.DataFrame:
+    """
+    returns the typed dataframe for a csv, read from a parquet sidecar when the csv did
+    not change since the sidecar was written with the same schema
+    input:
+            pth: a path to the csv
+            schema: dict of column -> dtype, defaults to BANK_SCHEMA
+            cache_dir: folder holding the sidecar files
+    output:
+            dataframe: pandas dataframe
+    """
+    schema = BANK_SCHEMA if schema is None else schema
+    if pq is None:
+        return read_csv_typed(pth, schema)
+
+    schema_hash = _schema_hash(schema)
+    parquet_pth, manifest_pth = _sidecar_paths(pth, cache_dir, schema_hash)
+    stat = os.stat(pth)
+    manifest = None
+    if os.path.exists(manifest_pth) and os.path.exists(parquet_pth):
+        with open(manifest_pth, encoding='utf-8') as file:
+            manifest = json.load(file)
+
+    if (
+            manifest is not None and manifest.get('schema') == schema_hash
+            and manifest['size'] == stat.st_size
+    ):
+        fresh = manifest['mtime_ns'] == stat.st_mtime_ns
+        if not fresh and manifest['sha256'] == _file_sha256(pth):
+            # touched but unchanged, refresh the mtime so the next load skips the hash
+            manifest['mtime_ns'] = stat.st_mtime_ns
+            with open(manifest_pth, 'w', encoding='utf-8') as file:
+                json.dump(manifest, file)
+            fresh = True
+        if fresh:
+            logging.info('Loading cached parquet %s', parquet_pth)
+            return pq.read_table(parquet_pth).to_pandas()
+
+    logging.info('Parsing %s and writing parquet sidecar %s', pth, parquet_pth)
+    dataframe = read_csv_typed(pth, schema)
+    os.makedirs(cache_dir, exist_ok=True)
+    dataframe.to_parquet(parquet_pth, index=False)
+    with open(manifest_pth, 'w', encoding='utf-8') as file:
+        json.dump(
+            {
+                'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                'sha256': _file_sha256(pth), 'schema': schema_hash
+            },
+            file
+        )
+    return dataframe
+
+
+def iter_chunks(
+        pth: str,
+        chunk_size: int,
+        schema: Optional[Dict[str, str]] = None
+) -> Iterator[pd.DataFrame]:
+    """
+    streams a csv or parquet file in typed chunks of at most chunk_size rows
+    input:
+            pth: a path to a csv or parquet file
+            chunk_size: number of rows per chunk
+            schema: dict of column -> dtype, defaults to BANK_SCHEMA
+    output:
+            chunks: iterator of pandas dataframes
+    """
+    schema = BANK_SCHEMA if schema is None else schema
+    if pth.endswith('.parquet'):
+        if pq is None:
+            raise ImportError('pyarrow is required to read parquet files')
+        for batch in pq.ParquetFile(pth).iter_batches(batch_size=chunk_size):
+            chunk = batch.to_pandas()
+            yield chunk.astype({
+                column: dtype for column, dtype in schema.items() if column in chunk.columns
+            })
+        return
+    header = pd.read_csv(pth, nrows=0).columns
+    yield from pd.read_csv(
+        pth,
+        chunksize=chunk_size,
+        dtype={column: dtype for column, dtype in schema.items() if column in header}
+    )
+
+
+def feature_matrix(dataframe: pd.DataFrame, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    returns the model features as a dataframe over a single read-only, C-contiguous float32
+    block. sklearn validates it without copying (to_numpy returns the block itself), the
+    forests compare float32 features anyway, and row slices are views of the block
+    input:
+            dataframe: pandas dataframe with the feature columns, e.g. encoded bank data
+            columns: feature columns in model order, defaults to KEEP_COLS
+    output:
+            features: pandas dataframe with the index of dataframe
+    """
+    columns = KEEP_COLS if columns is None else columns
+    values = np.empty((len(dataframe), len(columns)), dtype=np.float32)
+    for position, column in enumerate(columns):
+        values[:, position] = dataframe[column].to_numpy()
+    values.flags.writeable = False
+    return pd.DataFrame(values, index=dataframe.index, columns=columns, copy=False)
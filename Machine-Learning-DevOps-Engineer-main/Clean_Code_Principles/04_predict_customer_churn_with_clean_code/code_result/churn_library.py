@@ -8,121 +8,124 @@ This module contains functions to:
 
 author: jazielinho
 created: 2024 July
+
+plotting and training dependencies (matplotlib, sklearn, the search) are imported by the
+functions that use them, so importing this module for data loading and scoring stays cheap.
+logging is configured by entry points with configure_logging, not on import.
 """
 
-from typing import List, Tuple, Union
+from __future__ import annotations
+
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple, Union
+import json
 import logging
+import os
+import tracemalloc
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-from sklearn.model_selection import train_test_split, GridSearchCV
-from sklearn.metrics import classification_report
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.linear_model import LogisticRegression
-import joblib
-
-
-logging.basicConfig(
-    filename='./logs/churn_library.log',
-    level = logging.INFO,
-    filemode='w',
-    format='%(name)s - %(levelname)s - %(message)s'
+
+from churn_artifacts import save_model_artifact
+from churn_config import load_config
+from churn_eda import render_plots, use_agg_backend
+from churn_encoder import TargetEncoder
+from churn_folds import FoldPlan, cross_validate, summarize
+from churn_importance import permutation_importance
+from churn_incremental import load_checkpoint, row_hashes, save_checkpoint, warm_start_forest
+from churn_instrumentation import add_record, instrument, measure, write_run_report
+from churn_metrics import classification_metrics, draw_report, render_report_image, save_metrics
+from churn_io import (
+    CATEGORICAL_COLUMNS, KEEP_COLS, NUMERICAL_COLUMNS, add_response, feature_matrix,
+    load_csv_cached, read_csv_typed
 )
 
+if TYPE_CHECKING:
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.linear_model import LogisticRegression
 
-def import_data(pth: str) -> pd.DataFrame:
-    """
-    returns dataframe for the csv found at pth
+LOG_PTH = './logs/churn_library.log'
+ENCODER_PTH = './models/target_encoder.pkl'
 
-    input:
-            pth: a path to the csv
-    output:
-            dataframe: pandas dataframe
-    """
-    try:
-        logging.info('Importing data from %s', pth)
-        dataframe = pd.read_csv(pth)
-        dataframe['Churn'] = (dataframe['Attrition_Flag'] != "Attrited Customer").astype(int)
-        return dataframe
-    except FileNotFoundError as err:
-        logging.error('File not found at %s', pth)
-        raise err
-    except Exception as err:
-        logging.error('An error occurred while importing data from %s, %s', pth, err)
-        raise err
+RF_PARAM_GRID = {
+    'n_estimators': [200, 500],
+    'max_features': ['auto', 'sqrt'],
+    'max_depth': [4, 5, 100],
+    'criterion': ['gini', 'entropy']
+}
 
 
-def _plot_categorical(dataframe: pd.DataFrame, category: str):
+def configure_logging(pth: str = LOG_PTH):
     """
-    helper function to plot categorical data
+    sends the logs of the churn modules to pth, overwriting it. Called by entry points
     input:
-            dataframe: pandas dataframe
-            category: string of category column
+            pth: path of the log file
     output:
             None
     """
-    plt.figure(figsize=(20, 10))
-    dataframe[category].value_counts(normalize=True).plot(kind='bar')
-    plt.savefig(f'./images/eda/{category}.png')
-    plt.close()
+    os.makedirs(os.path.dirname(pth) or '.', exist_ok=True)
+    logging.basicConfig(
+        filename=pth,
+        level=logging.INFO,
+        filemode='w',
+        format='%(name)s - %(levelname)s - %(message)s'
+    )
 
 
-def _plot_numerical(dataframe: pd.DataFrame, category: str, add_density: bool):
-    """
-    helper function to plot numerical data
-    input:
-            dataframe: pandas dataframe
-            category: string of category column
-    output:
-            None
+@instrument('import_data')
+def import_data(pth: str, use_cache: bool = True) -> pd.DataFrame:
     """
-    plt.figure(figsize=(20, 10))
-    sns.histplot(dataframe[category], stat='density', kde=add_density)
-    plt.savefig(f'./images/eda/{category}.png')
-    plt.close()
-
+    returns dataframe for the csv found at pth, typed with churn_io.BANK_SCHEMA
 
-def _plot_correlation(dataframe: pd.DataFrame):
-    """
-    helper function to plot correlation
     input:
-            dataframe: pandas dataframe
+            pth: a path to the csv
+            use_cache: reuse the parquet sidecar when the csv did not change
     output:
-            None
+            dataframe: pandas dataframe
     """
-    plt.figure(figsize=(20, 10))
-    sns.heatmap(dataframe.corr(numeric_only=True), annot=False, cmap='Dark2_r', linewidths=2)
-    plt.savefig('./images/eda/corr_heatmap.png')
-    plt.close()
+    try:
+        logging.info('Importing data from %s', pth)
+        dataframe = load_csv_cached(pth) if use_cache else read_csv_typed(pth)
+        return add_response(dataframe)
+    except FileNotFoundError as err:
+        logging.error('File not found at %s', pth)
+        raise err
+    except Exception as err:
+        logging.error('An error occurred while importing data from %s, %s', pth, err)
+        raise err
 
 
-def perform_eda(dataframe: pd.DataFrame):
+@instrument('perform_eda')
+def perform_eda(
+        dataframe: pd.DataFrame,
+        plots: Optional[List[Dict]] = None,
+        output_dir: Optional[str] = None,
+        n_jobs: Optional[int] = None
+):
     """
-    perform eda on dataframe and save figures to images folder
+    perform eda on dataframe and save figures to images folder, figures are rendered in
+    parallel and skipped when their input columns did not change since the last run
     input:
             dataframe: pandas dataframe
+            plots: list of plot specs, defaults to the eda section of config.yaml
+            output_dir: folder to store the figures, defaults to the eda section of config.yaml
+            n_jobs: number of worker processes, None uses all cores
 
     output:
             None
     """
     try:
         logging.info('Performing EDA')
-        logging.info('Plotting Churn')
-        _plot_categorical(dataframe, 'Churn')
-        logging.info('Plotting Customer_Age')
-        _plot_numerical(dataframe, 'Customer_Age', False)
-        logging.info('Plotting Marital_Status')
-        _plot_categorical(dataframe, 'Marital_Status')
-        logging.info('Plotting Total_Trans_Ct')
-        _plot_numerical(dataframe, 'Total_Trans_Ct', True)
-        logging.info('Plotting correlation')
-        _plot_correlation(dataframe)
+        eda_config = load_config('eda')
+        plots = eda_config['plots'] if plots is None else plots
+        output_dir = eda_config['output_dir'] if output_dir is None else output_dir
+        rendered = render_plots(dataframe, plots, output_dir, n_jobs=n_jobs)
+        logging.info('Rendered %d of %d plots', len(rendered), len(plots))
     except Exception as err:
         logging.error('An error occurred during EDA, %s', err)
         raise err
 
 
+@instrument('encoder_helper')
 def encoder_helper(dataframe: pd.DataFrame, category_lst: List[str], response: str) -> pd.DataFrame:
     """
     helper function to turn each categorical column into a new column with
@@ -136,25 +139,18 @@ def encoder_helper(dataframe: pd.DataFrame, category_lst: List[str], response: s
     output:
             dataframe: pandas dataframe with new columns for
     """
-    category = None
     try:
-        logging.info('Encoding categorical features')
-        for category in category_lst:
-            logging.info('Encoding %s', category)
-            groups = dataframe.groupby(category)[response].mean().to_dict()
-            dataframe[f'{category}_Churn'] = dataframe[category].map(groups)
-        return dataframe
+        logging.info('Encoding categorical features %s', category_lst)
+        encoder = TargetEncoder(category_lst)
+        return encoder.fit_transform(dataframe, dataframe[response], inplace=True)
     except Exception as err:
-        if category is not None:
-            logging.error('An error occurred while encoding %s', category)
-        else:
-            logging.error('An error occurred while encoding')
+        logging.error('An error occurred while encoding, %s', err)
         raise err
 
 
 def _select_features(dataframe: pd.DataFrame, response: str) -> Tuple[pd.DataFrame, pd.Series]:
     """
-    select features for the model
+    select features for the model as a compact float32 matrix, see churn_io.feature_matrix
     input:
               dataframe: pandas dataframe
               response: string of response name
@@ -165,17 +161,8 @@ def _select_features(dataframe: pd.DataFrame, response: str) -> Tuple[pd.DataFra
     """
     try:
         logging.info('Selecting features')
-        keep_cols = [
-            'Customer_Age', 'Dependent_count', 'Months_on_book',
-            'Total_Relationship_Count', 'Months_Inactive_12_mon',
-            'Contacts_Count_12_mon', 'Credit_Limit', 'Total_Revolving_Bal',
-            'Avg_Open_To_Buy', 'Total_Amt_Chng_Q4_Q1', 'Total_Trans_Amt',
-            'Total_Trans_Ct', 'Total_Ct_Chng_Q4_Q1', 'Avg_Utilization_Ratio',
-            'Gender_Churn', 'Education_Level_Churn', 'Marital_Status_Churn',
-            'Income_Category_Churn', 'Card_Category_Churn'
-        ]
-        logging.info('Selecting columns %s', keep_cols)
-        dataframe_selected = dataframe[keep_cols]
+        logging.info('Selecting columns %s', KEEP_COLS)
+        dataframe_selected = feature_matrix(dataframe, KEEP_COLS)
         target = dataframe[response]
         return dataframe_selected, target
     except Exception as err:
@@ -195,6 +182,7 @@ def _split_data(
     output:
                 X_train: X training data
     """
+    from sklearn.model_selection import train_test_split  # pylint: disable=import-outside-toplevel
     try:
         logging.info('Splitting data')
         train_df, test_df, y_train, y_test = train_test_split(
@@ -209,15 +197,19 @@ def _split_data(
         raise err
 
 
+@instrument('perform_feature_engineering')
 def perform_feature_engineering(
         dataframe: pd.DataFrame,
-        response: str
+        response: str,
+        encoder: Optional[TargetEncoder] = None
 ) -> Tuple[pd.DataFrame, pd.DataFrame, pd.Series, pd.Series]:
     """
     perform feature engineering
     input:
               dataframe: pandas dataframe
               response: string of response name
+              encoder: unfitted TargetEncoder, fitted here on the training rows only. If None
+                       the encoded columns must already be in dataframe (see encoder_helper)
 
     output:
               X_train: X training data
@@ -227,8 +219,14 @@ def perform_feature_engineering(
     """
     try:
         logging.info('Performing feature engineering')
-        dataframe, target = _select_features(dataframe, response)
-        train_df, test_df, y_train, y_test = _split_data(dataframe, target)
+        if encoder is None:
+            dataframe, target = _select_features(dataframe, response)
+            train_df, test_df, y_train, y_test = _split_data(dataframe, target)
+            return train_df, test_df, y_train, y_test
+        train_rows, test_rows, _, _ = _split_data(dataframe, dataframe[response])
+        encoder.fit(train_rows, train_rows[response])
+        train_df, y_train = _select_features(encoder.transform(train_rows, inplace=True), response)
+        test_df, y_test = _select_features(encoder.transform(test_rows, inplace=True), response)
         return train_df, test_df, y_train, y_test
     except Exception as err:
         logging.error('An error occurred during feature engineering, %s', err)
@@ -244,7 +242,7 @@ def classification_report_image(
 ):
     """
     produces classification report for training and testing results and stores report as image
-    in images folder
+    in images folder. train_models stores the metrics as json and renders this image from it
     input:
             y_train: training response values
             y_test:  test response values
@@ -257,27 +255,13 @@ def classification_report_image(
     """
     try:
         logging.info('Creating classification report')
-        plt.figure(figsize=(10, 10))
-
-        # Ajustar el tamaño de fuente para las diferentes secciones
-        plt.text(0.01, 1.05, f'{title} Train', {'fontsize': 14}, fontproperties='monospace')
-        plt.text(
-            0.01, 0.6,
-            str(classification_report(y_train, y_train_preds)), {'fontsize': 12},
-            fontproperties='monospace'
+        labels = np.unique(np.concatenate([y_train, y_test, y_train_preds, y_test_preds]))
+        draw_report(
+            title,
+            classification_metrics(y_train, y_train_preds, labels)['report'],
+            classification_metrics(y_test, y_test_preds, labels)['report'],
+            f'./images/results/{title}_classification_report.png'
         )
-        plt.text(0.01, 0.5, f'{title} Test', {'fontsize': 14}, fontproperties='monospace')
-        plt.text(
-            0.01, 0.0,
-            str(classification_report(y_test, y_test_preds)), {'fontsize': 12},
-            fontproperties='monospace'
-        )
-
-        plt.axis('off')
-        plt.tight_layout()
-
-        plt.savefig(f'./images/results/{title}_classification_report.png', bbox_inches='tight')
-        plt.close()
     except Exception as err:
         logging.error('An error occurred while creating classification report, %s', err)
         raise err
@@ -286,7 +270,8 @@ def classification_report_image(
 def feature_importance_plot(
         model: Union[RandomForestClassifier, LogisticRegression],
         train_df: pd.DataFrame,
-        output_pth: str
+        output_pth: str,
+        importances: Optional[pd.Series] = None
 ):
     """
     creates and stores the feature importances in pth
@@ -294,21 +279,25 @@ def feature_importance_plot(
             model: model object containing feature_importances_
             train_df: pandas dataframe of X values
             output_pth: path to store the figure
+            importances: importance per column of train_df, e.g. from
+                         churn_importance.permutation_importance. Defaults to the
+                         feature_importances_ or coef_ of the model
 
     output:
              None
     """
-
+    import matplotlib.pyplot as plt  # pylint: disable=import-outside-toplevel
     try:
         logging.info('Plotting feature importance')
 
-        if not hasattr(model, 'feature_importances_') and not hasattr(model, 'coef_'):
-            raise ValueError('Model does not have feature_importances_ or coef_ attribute')
-
-        if hasattr(model, 'feature_importances_'):
+        if importances is not None:
+            importances = importances.reindex(train_df.columns).to_numpy()
+        elif hasattr(model, 'feature_importances_'):
             importances = model.feature_importances_
-        else:
+        elif hasattr(model, 'coef_'):
             importances = model.coef_[0]
+        else:
+            raise ValueError('Model does not have feature_importances_ or coef_ attribute')
 
         indices = np.argsort(importances)[::-1]
         names = [train_df.columns[i] for i in indices]
@@ -325,32 +314,52 @@ def feature_importance_plot(
 
 def _select_best_random_forest_model(
         train_df: pd.DataFrame,
-        y_train: pd.Series
-) -> RandomForestClassifier:
+        y_train: pd.Series,
+        search_mode: str = 'resumable',
+        n_jobs: int = -1,
+        halving: Optional[Dict] = None
+) -> Tuple[RandomForestClassifier, float]:
     """
-    trains random forest model and returns the model
+    trains random forest model and returns the model with its cross-validated accuracy
     input:
             X_train: X training data
-            X_test: X testing data
             y_train: y training data
-            y_test: y testing data
+            search_mode: 'resumable' for the parallel search backed by the result store,
+                         'halving' for the budgeted successive halving search,
+                         'grid' for a plain single-threaded GridSearchCV
+            n_jobs: number of cores for the resumable and halving searches, -1 uses all cores
+            halving: keyword arguments of churn_search.budgeted_halving_search, e.g.
+                     time_budget in seconds
 
     output:
             rf: trained random forest model
+            score: mean cross-validated accuracy of the selected hyperparameters
     """
+    # pylint: disable=import-outside-toplevel
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.model_selection import GridSearchCV
+    from churn_search import budgeted_halving_search, resumable_grid_search
     try:
-        logging.info('Training Random Forest')
+        logging.info('Training Random Forest with %s search', search_mode)
         rf_model = RandomForestClassifier(random_state=42)
-        param_grid = {
-            'n_estimators': [200, 500],
-            'max_features': ['auto', 'sqrt'],
-            'max_depth': [4, 5, 100],
-            'criterion': ['gini', 'entropy']
-        }
-        cv_rfc = GridSearchCV(estimator=rf_model, param_grid=param_grid, cv=5)
-        cv_rfc.fit(train_df, y_train)
-        rf_model = cv_rfc.best_estimator_
-        return rf_model
+        if search_mode == 'resumable':
+            rf_model, cv_results = resumable_grid_search(
+                rf_model, RF_PARAM_GRID, train_df, y_train, cv=5, n_jobs=n_jobs
+            )
+            score = float(cv_results['mean_test_score'].max())
+        elif search_mode == 'halving':
+            rf_model, cv_results = budgeted_halving_search(
+                rf_model, RF_PARAM_GRID, train_df, y_train, n_jobs=n_jobs, **(halving or {})
+            )
+            last_rung = cv_results[cv_results['rung'] == cv_results['rung'].max()]
+            score = float(last_rung['mean_test_score'].max())
+        elif search_mode == 'grid':
+            cv_rfc = GridSearchCV(estimator=rf_model, param_grid=RF_PARAM_GRID, cv=5)
+            cv_rfc.fit(train_df, y_train)
+            rf_model, score = cv_rfc.best_estimator_, float(cv_rfc.best_score_)
+        else:
+            raise ValueError(f'Unknown search mode {search_mode}')
+        return rf_model, score
     except Exception as err:
         logging.error('An error occurred while training random forest, %s', err)
         raise err
@@ -371,6 +380,7 @@ def _get_logistic_regression_model(
     output:
             lr: trained logistic regression model
     """
+    from sklearn.linear_model import LogisticRegression  # pylint: disable=import-outside-toplevel
     try:
         logging.info('Training Logistic Regression')
         lr_model = LogisticRegression(solver='lbfgs', max_iter=3000)
@@ -385,39 +395,49 @@ def _get_predictions(
         model: Union[RandomForestClassifier, LogisticRegression],
         train_df: pd.DataFrame,
         test_df: pd.DataFrame
-):
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
     """
-    get predictions from model
+    get predictions from model, predict_proba runs once per split and the labels are
+    derived from it the same way the sklearn classifiers do
     input:
             model: model object
             train_df: training data
             test_df: testing data
     output:
+            y_train_proba: training class probabilities
+            y_test_proba: testing class probabilities
             y_train_preds: training predictions
             y_test_preds: testing predictions
     """
     try:
         logging.info('Getting predictions')
-        y_train_preds = model.predict(train_df)
-        y_test_preds = model.predict(test_df)
-        return y_train_preds, y_test_preds
+        y_train_proba = model.predict_proba(train_df)
+        y_test_proba = model.predict_proba(test_df)
+        y_train_preds = model.classes_[y_train_proba.argmax(axis=1)]
+        y_test_preds = model.classes_[y_test_proba.argmax(axis=1)]
+        return y_train_proba, y_test_proba, y_train_preds, y_test_preds
     except Exception as err:
         logging.error('An error occurred while getting predictions, %s', err)
         raise err
 
 
-def _save_models(model: Union[RandomForestClassifier, LogisticRegression], path: str):
+def _save_models(
+        model: Union[RandomForestClassifier, LogisticRegression, TargetEncoder],
+        path: str,
+        compact: bool = False
+):
     """
-    save model to path
+    save model to path as an uncompressed artifact
     input:
             model: model object
             path: path to save model
+            compact: flatten a random forest to a memory-mappable churn_artifacts.CompactForest
     output:
             None
     """
     try:
         logging.info('Saving model to %s', path)
-        joblib.dump(model, path)
+        save_model_artifact(model, path, compact=compact)
     except Exception as err:
         logging.error('An error occurred while saving model to %s, %s', path, err)
         raise err
@@ -425,102 +445,353 @@ def _save_models(model: Union[RandomForestClassifier, LogisticRegression], path:
 
 def _train_rf_model(
         train_df: pd.DataFrame,
-        test_df: pd.DataFrame,
         y_train: pd.Series,
-        y_test: pd.Series
-):
+        n_jobs: int = -1
+) -> RandomForestClassifier:
     """
-    train random forest model
+    train random forest model, runs in a worker process of train_models. With
+    training.rf_mode 'incremental' in config.yaml, the forest of the last run grows trees
+    on the new rows and the full search only runs when its holdout accuracy drops
     input:
             X_train: X training data
-            X_test: X testing data
             y_train: y training data
-            y_test: y testing data
+            n_jobs: number of cores for the hyperparameter search
     output:
             rf_model: trained random forest model
-            y_train_preds_rf: training predictions
-            y_test_preds_rf: testing predictions
     """
     try:
-        rf_model = _select_best_random_forest_model(train_df, y_train)
-        y_train_preds_rf, y_test_preds_rf = _get_predictions(rf_model, train_df, test_df)
-        feature_importance_plot(rf_model, train_df, './images/results/rf_feature_importance.png')
-        classification_report_image(y_train, y_test, y_train_preds_rf, y_test_preds_rf, 'rf')
-        _save_models(rf_model, './models/rf_model.pkl')
+        config = load_config('training')
+        if config['rf_mode'] not in ('full', 'incremental'):
+            raise ValueError(f"Unknown rf_mode {config['rf_mode']}")
+        if config['rf_mode'] == 'incremental':
+            checkpoint = load_checkpoint(config['checkpoint_pth'])
+            if checkpoint is not None:
+                rf_model, checkpoint = warm_start_forest(
+                    checkpoint, train_df, y_train, NUMERICAL_COLUMNS,
+                    n_jobs=n_jobs, **config['incremental']
+                )
+                if rf_model is not None:
+                    save_checkpoint(checkpoint, config['checkpoint_pth'])
+                    return rf_model
+                logging.info('Falling back to the full random forest search')
+        search = load_config('search')
+        halving = dict(search['halving'])
+        minutes = halving.pop('time_budget_minutes')
+        halving['time_budget'] = None if minutes is None else 60 * minutes
+        rf_model, score = _select_best_random_forest_model(
+            train_df, y_train, search['mode'], n_jobs, halving
+        )
+        # in incremental mode every full search starts a new checkpoint for the next run,
+        # the full mode does not pay for pickling the forest
+        if config['rf_mode'] == 'incremental':
+            save_checkpoint(
+                {'model': rf_model, 'score': score,
+                 'seen': row_hashes(train_df, y_train, NUMERICAL_COLUMNS)},
+                config['checkpoint_pth']
+            )
+        return rf_model
     except Exception as err:
         logging.error('An error occurred while training random forest model, %s', err)
         raise err
+    finally:
+        # idle loky workers of the search would keep the pool worker alive until they time out
+        from joblib.externals.loky import get_reusable_executor  # pylint: disable=import-outside-toplevel
+        get_reusable_executor().shutdown(wait=True)
 
 
 def _train_lr_model(
         train_df: pd.DataFrame,
-        test_df: pd.DataFrame,
         y_train: pd.Series,
-        y_test: pd.Series
-):
+        n_jobs: int = 1  # pylint: disable=unused-argument
+) -> LogisticRegression:
     """
-    train logistic regression model
+    train logistic regression model, runs in a worker process of train_models
     input:
             X_train: X training data
-            X_test: X testing data
             y_train: y training data
-            y_test: y testing data
+            n_jobs: unused, lbfgs fits on a single core
     output:
             lr_model: trained logistic regression model
-            y_train_preds_lr: training predictions
-            y_test_preds_lr: testing predictions
     """
     try:
-        lr_model = _get_logistic_regression_model(train_df, y_train)
-        y_train_preds_lr, y_test_preds_lr = _get_predictions(lr_model, train_df, test_df)
-        feature_importance_plot(lr_model, train_df, './images/results/lr_feature_importance.png')
-        classification_report_image(y_train, y_test, y_train_preds_lr, y_test_preds_lr, 'lr')
-        _save_models(lr_model, './models/logistic_model.pkl')
+        return _get_logistic_regression_model(train_df, y_train)
     except Exception as err:
         logging.error('An error occurred while training logistic regression model, %s', err)
         raise err
 
 
-def train_models(
+MODEL_FAMILIES = {
+    'rf': {
+        'train': _train_rf_model,
+        'model_pth': './models/rf_model.pkl',
+        'compact_pth': './models/rf_model_compact.pkl',
+        'importance_pth': './images/results/rf_feature_importance.png'
+    },
+    'lr': {
+        'train': _train_lr_model,
+        'model_pth': './models/logistic_model.pkl',
+        'importance_pth': './images/results/lr_feature_importance.png'
+    },
+}
+
+
+def _write_model_outputs(
+        family: str,
+        model: Union[RandomForestClassifier, LogisticRegression],
         train_df: pd.DataFrame,
         test_df: pd.DataFrame,
         y_train: pd.Series,
-        y_test: pd.Series
-):
+        y_test: pd.Series,
+        y_train_preds: np.ndarray,
+        y_test_preds: np.ndarray,
+        metrics_config: Dict,
+        importance_config: Dict,
+        artifacts_config: Dict
+) -> str:
+    """
+    stores the metrics, feature importances and model of a family, runs in the background
+    writer
+    input:
+            family: key of MODEL_FAMILIES
+            model: trained model
+            train_df: X training data
+            test_df: X testing data
+            y_train: y training data
+            y_test: y testing data
+            y_train_preds: training predictions
+            y_test_preds: testing predictions
+            metrics_config: metrics section of config.yaml
+            importance_config: importance section of config.yaml
+            artifacts_config: artifacts section of config.yaml
+    output:
+            metrics_pth: path of the json metrics
+    """
+    labels = np.asarray(model.classes_)
+    metrics_pth = save_metrics(
+        family,
+        {
+            'train': classification_metrics(y_train, y_train_preds, labels),
+            'test': classification_metrics(y_test, y_test_preds, labels)
+        },
+        metrics_config['output_dir'],
+        metrics_config['history_pth']
+    )
+    importances = None
+    if importance_config['method'] == 'permutation':
+        importances = permutation_importance(
+            model, test_df, y_test,
+            n_repeats=importance_config['n_repeats'],
+            sample_size=importance_config['sample_size'],
+            n_jobs=importance_config['n_jobs']
+        )['importance_mean']
+    elif importance_config['method'] != 'native':
+        raise ValueError(f"Unknown importance method {importance_config['method']}")
+    feature_importance_plot(
+        model, train_df, MODEL_FAMILIES[family]['importance_pth'], importances
+    )
+    _save_models(model, MODEL_FAMILIES[family]['model_pth'])
+    if artifacts_config['compact_forest'] and 'compact_pth' in MODEL_FAMILIES[family]:
+        _save_models(model, MODEL_FAMILIES[family]['compact_pth'], compact=True)
+    return metrics_pth
+
+
+def _fit_family(
+        name: str,
+        train_df: pd.DataFrame,
+        y_train: pd.Series,
+        n_jobs: int
+) -> Tuple[Union[RandomForestClassifier, LogisticRegression], Dict]:
+    """
+    fits a model family and measures it, runs in a worker process of train_models
+    input:
+            name: key of MODEL_FAMILIES
+            train_df: X training data
+            y_train: y training data
+            n_jobs: number of cores for the family
+    output:
+            model: trained model
+            record: stage record of the fit, added to the run by the parent process
+    """
+    if tracemalloc.is_tracing():
+        # tracing allocations inherited from the parent slows the search down 2-3x,
+        # the record keeps peak_rss_mb for the fit instead
+        tracemalloc.stop()
+    with measure(f'train_{name}', len(train_df)) as record:
+        model = MODEL_FAMILIES[name]['train'](train_df, y_train, n_jobs)
+    return model, record
+
+
+def _render_family_reports(metrics_pths: Dict[str, str]):
     """
-    train, store model results: images + scores, and store models
+    renders the classification report image of every family from its json metrics, runs
+    in the worker process started by _render_report_images
+    input:
+            metrics_pths: dict of family -> json metrics
+    output:
+            None
+    """
+    for family, metrics_pth in metrics_pths.items():
+        render_report_image(metrics_pth, f'./images/results/{family}_classification_report.png')
+
+
+def _render_report_images(metrics_pths: Dict[str, str]) -> Future:
+    """
+    starts rendering the classification report images in a worker process on the Agg
+    backend, without waiting for them
+    input:
+            metrics_pths: dict of family -> json metrics
+    output:
+            render: future of the rendering, render.result() waits for the images
+    """
+    renderer = ProcessPoolExecutor(max_workers=1, initializer=use_agg_backend)
+    render = renderer.submit(_render_family_reports, metrics_pths)
+    # the worker process exits once the rendering is done
+    renderer.shutdown(wait=False)
+    return render
+
+
+@instrument('train_models')
+def train_models(
+        train_df: pd.DataFrame,
+        test_df: pd.DataFrame,
+        y_train: pd.Series,
+        y_test: pd.Series,
+        n_jobs: Optional[int] = None
+) -> Optional[Future]:
+    """
+    train, store model results: images + scores, and store models. The model families are
+    fitted concurrently in a process pool and their metrics, plots and pickles are written by
+    a background thread while the remaining families train. Classification report images are
+    rendered from the stored metrics in a background process once all families are trained,
+    see the metrics section of config.yaml
     input:
               X_train: X training data
               X_test: X testing data
               y_train: y training data
               y_test: y testing data
+              n_jobs: cpu budget shared by all model families, None uses all cores
     output:
-              None
+              render: future of the report images, None when they are not rendered
     """
     try:
         logging.info('Training models')
-        _train_rf_model(train_df, test_df, y_train, y_test)
-        _train_lr_model(train_df, test_df, y_train, y_test)
+        metrics_config = load_config('metrics')
+        importance_config = load_config('importance')
+        artifacts_config = load_config('artifacts')
+        budget = n_jobs or os.cpu_count() or 1
+        # logistic regression uses a single core, the forest search gets the rest
+        family_jobs = {'rf': max(1, budget - 1), 'lr': 1}
+        with ProcessPoolExecutor(max_workers=min(len(MODEL_FAMILIES), budget)) as fit_pool, \
+                ThreadPoolExecutor(max_workers=1) as writer:
+            fits = {
+                fit_pool.submit(_fit_family, name, train_df, y_train, family_jobs[name]): name
+                for name in MODEL_FAMILIES
+            }
+            writes = {}
+            for fit in as_completed(fits):
+                name = fits[fit]
+                model, record = fit.result()
+                add_record(record)
+                logging.info('Trained %s', name)
+                _, _, y_train_preds, y_test_preds = _get_predictions(model, train_df, test_df)
+                writes[name] = writer.submit(
+                    _write_model_outputs,
+                    name, model, train_df, test_df, y_train, y_test, y_train_preds, y_test_preds,
+                    metrics_config, importance_config, artifacts_config
+                )
+            metrics_pths = {name: write.result() for name, write in writes.items()}
+        if metrics_config['render_images']:
+            return _render_report_images(metrics_pths)
+        return None
     except Exception as err:
         logging.error('An error occurred while training models, %s', err)
         raise err
 
 
+def _cv_candidates() -> Dict[str, Any]:
+    """
+    default estimators of cross_validate_families, one per model family
+    """
+    # pylint: disable=import-outside-toplevel
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.linear_model import LogisticRegression
+    return {
+        'rf': RandomForestClassifier(random_state=42, n_jobs=1),
+        'lr': LogisticRegression(solver='lbfgs', max_iter=3000),
+    }
+
+
+@instrument('cross_validate_families')
+def cross_validate_families(
+        dataframe: pd.DataFrame,
+        response: str,
+        estimators: Optional[Dict[str, Any]] = None,
+        n_splits: int = 5,
+        n_jobs: Optional[int] = None,
+        output_pth: Optional[str] = None
+) -> pd.DataFrame:
+    """
+    cross-validates every model on the same fold plan of the training rows, see
+    churn_folds. The plan (folds, per-fold encoders and matrices) is built once per data
+    and reused by every model and run, so adding a model costs only its own fits
+    input:
+              dataframe: pandas dataframe with the raw columns and the response
+              response: string of response name
+              estimators: dict of name -> unfitted estimator, defaults to one per family
+              n_splits: number of stratified folds
+              n_jobs: number of worker processes, None uses all cores
+              output_pth: json file for the fold scores and the summary, None to skip
+    output:
+              summary: dataframe indexed by model with mean_score, std_score and fit_seconds
+    """
+    try:
+        logging.info('Cross-validating the model families')
+        train_rows, _, _, _ = _split_data(dataframe, dataframe[response])
+        plan = FoldPlan.build(train_rows, response, n_splits)
+        scores = cross_validate(plan, estimators or _cv_candidates(), n_jobs)
+        summary = summarize(scores)
+        logging.info('Cross-validation scores\n%s', summary.round(4).to_string())
+        if output_pth is not None:
+            os.makedirs(os.path.dirname(output_pth) or '.', exist_ok=True)
+            with open(output_pth, 'w', encoding='utf-8') as file:
+                json.dump({
+                    'n_splits': n_splits,
+                    'folds': scores.to_dict(orient='records'),
+                    'summary': summary.reset_index().to_dict(orient='records')
+                }, file, indent=2)
+        return summary
+    except Exception as err:
+        logging.error('An error occurred during cross-validation, %s', err)
+        raise err
+
+
 def main():
     """
     main function to run the entire module
     """
-    dataframe = import_data('./data/bank_data.csv')
+    configure_logging()
+    instrumentation = load_config('instrumentation')
+    if instrumentation['trace_memory']:
+        tracemalloc.start()
+    data_pth = './data/bank_data.csv'
+    dataframe = import_data(data_pth)
     perform_eda(dataframe)
-    dataframe = encoder_helper(
-        dataframe,
-        [
-            'Gender', 'Education_Level', 'Marital_Status', 'Income_Category', 'Card_Category'
-        ],
-        'Churn'
+    encoder = TargetEncoder(CATEGORICAL_COLUMNS)
+    train_df, test_df, y_train, y_test = perform_feature_engineering(dataframe, 'Churn', encoder)
+    _save_models(encoder, ENCODER_PTH)
+    render = train_models(train_df, test_df, y_train, y_test)
+    cv_config = load_config('cv')
+    if cv_config['enabled']:
+        cross_validate_families(
+            dataframe, 'Churn', n_splits=cv_config['n_splits'], output_pth=cv_config['output_pth']
+        )
+    if render is not None:
+        render.result()
+    write_run_report(
+        {'data_pth': data_pth, 'data_rows': len(dataframe)},
+        instrumentation['report_pth'],
+        instrumentation['history_pth']
     )
-    train_df, test_df, y_train, y_test = perform_feature_engineering(dataframe, 'Churn')
-    train_models(train_df, test_df, y_train, y_test)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,267 @@
+"""
+This module contains the classification metrics engine used by churn_library:
+* a confusion matrix computed in one np.bincount pass over encoded label pairs
+* precision, recall, f1-score and support derived from it, laid out like
+  sklearn's classification_report(output_dict=True)
+* json metrics per model family and a parquet history for comparison across runs
+* report images rendered from the stored json, as an optional deferred step
+
+usage: python churn_metrics.py --metrics ./logs/metrics/rf_metrics.json \
+           --output ./images/results/rf_classification_report.png
+
+author: jazielinho
+created: 2024 July
+"""
+
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+import argparse
+import json
+import logging
+import os
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow  # pylint: disable=unused-import
+except ImportError:  # pragma: no cover - pyarrow is optional
+    pyarrow = None
+
+
+METRICS_DIR = './logs/metrics'
+HISTORY_PTH = os.path.join(METRICS_DIR, 'metrics_history.parquet')
+
+_AVERAGES = ('macro avg', 'weighted avg')
+
+
+def confusion_matrix(
+        y_true: Any,
+        y_pred: Any,
+        labels: Optional[np.ndarray] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    returns the confusion matrix, rows are true labels and columns predicted labels
+    input:
+            y_true: true labels
+            y_pred: predicted labels
+            labels: sorted labels, defaults to the labels found in y_true and y_pred
+    output:
+            matrix: (n_labels, n_labels) int64 counts
+            labels: labels of the rows and columns
+    """
+    y_true, y_pred = np.asarray(y_true), np.asarray(y_pred)
+    if labels is None:
+        labels = np.unique(np.concatenate([y_true, y_pred]))
+    n_labels = len(labels)
+    pairs = np.searchsorted(labels, y_true) * n_labels + np.searchsorted(labels, y_pred)
+    matrix = np.bincount(pairs, minlength=n_labels * n_labels).reshape(n_labels, n_labels)
+    return matrix, labels
+
+
+def _safe_divide(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    """
+    element-wise division that returns 0 where the denominator is 0, like zero_division=0
+    """
+    result = np.zeros(len(numerator))
+    np.divide(numerator, denominator, out=result, where=denominator > 0)
+    return result
+
+
+def metrics_from_confusion_matrix(matrix: np.ndarray, labels: np.ndarray) -> Dict[str, Any]:
+    """
+    derives the classification metrics from a confusion matrix, e.g. one summed over chunks
+    input:
+            matrix: (n_labels, n_labels) counts, rows are true labels
+            labels: labels of the rows and columns
+    output:
+            metrics: dict with labels, confusion_matrix and report, the report has the
+                     layout of sklearn's classification_report(output_dict=True)
+    """
+    matrix, labels = np.asarray(matrix), np.asarray(labels)
+    true_positives = np.diag(matrix).astype(float)
+    support = matrix.sum(axis=1)
+    predicted = matrix.sum(axis=0)
+    precision = _safe_divide(true_positives, predicted)
+    recall = _safe_divide(true_positives, support)
+    f1_score = _safe_divide(2 * true_positives, predicted + support)
+
+    report = {
+        str(label): {
+            'precision': float(precision[i]),
+            'recall': float(recall[i]),
+            'f1-score': float(f1_score[i]),
+            'support': int(support[i])
+        }
+        for i, label in enumerate(labels)
+    }
+    total = int(support.sum())
+    report['accuracy'] = float(true_positives.sum() / total) if total else 0.0
+    weights = support / total if total else np.zeros(len(labels))
+    for name, weight in zip(_AVERAGES, (np.full(len(labels), 1 / len(labels)), weights)):
+        report[name] = {
+            'precision': float(precision @ weight),
+            'recall': float(recall @ weight),
+            'f1-score': float(f1_score @ weight),
+            'support': total
+        }
+    return {'labels': labels.tolist(), 'confusion_matrix': matrix.tolist(), 'report': report}
+
+
+def classification_metrics(
+        y_true: Any,
+        y_pred: Any,
+        labels: Optional[np.ndarray] = None
+) -> Dict[str, Any]:
+    """
+    computes the classification metrics of one split from a single confusion matrix
+    input:
+            y_true: true labels
+            y_pred: predicted labels
+            labels: sorted labels, defaults to the labels found in y_true and y_pred
+    output:
+            metrics: see metrics_from_confusion_matrix
+    """
+    return metrics_from_confusion_matrix(*confusion_matrix(y_true, y_pred, labels))
+
+
+def format_report(report: Dict[str, Any], digits: int = 2) -> str:
+    """
+    returns the report as text, in the layout of sklearn's classification_report
+    input:
+            report: report of classification_metrics
+            digits: number of digits of the scores
+    output:
+            text: formatted report
+    """
+    names = [name for name in report if name not in ('accuracy',) + _AVERAGES]
+    width = max(len(name) for name in names + list(_AVERAGES))
+    columns = ['precision', 'recall', 'f1-score', 'support']
+    row_fmt = '{:>{width}s} ' + ' {:>9.{digits}f}' * 3 + ' {:>9}\n'
+
+    text = ' ' * width + ' ' + ''.join(f' {column:>9}' for column in columns) + '\n\n'
+    for name in names:
+        text += row_fmt.format(
+            name, *[report[name][column] for column in columns], width=width, digits=digits
+        )
+    text += '\n'
+    support = report[_AVERAGES[0]]['support']
+    text += (
+        '{:>{width}s} ' + ' {:>9}' * 2 + ' {:>9.{digits}f}' + ' {:>9}\n'
+    ).format('accuracy', '', '', report['accuracy'], support, width=width, digits=digits)
+    for name in _AVERAGES:
+        text += row_fmt.format(
+            name, *[report[name][column] for column in columns], width=width, digits=digits
+        )
+    return text
+
+
+def metrics_table(metrics: Dict[str, Any]) -> pd.DataFrame:
+    """
+    flattens the json metrics of a model family into one row per split, label and metric
+    input:
+            metrics: dict written by save_metrics
+    output:
+            table: dataframe with run_at, family, split, label, metric and value
+    """
+    rows = []
+    for split, split_metrics in metrics['splits'].items():
+        for label, values in split_metrics['report'].items():
+            values = {'accuracy': values} if label == 'accuracy' else values
+            for metric, value in values.items():
+                rows.append({
+                    'run_at': metrics['run_at'], 'family': metrics['family'], 'split': split,
+                    'label': label, 'metric': metric, 'value': float(value)
+                })
+    return pd.DataFrame(rows)
+
+
+def save_metrics(
+        family: str,
+        splits: Dict[str, Dict[str, Any]],
+        output_dir: str = METRICS_DIR,
+        history_pth: str = HISTORY_PTH
+) -> str:
+    """
+    writes output_dir/<family>_metrics.json and appends its rows to the parquet history
+    input:
+            family: name of the model family
+            splits: dict of split name -> metrics of classification_metrics
+            output_dir: folder of the json metrics
+            history_pth: parquet file appended run after run, skipped without pyarrow
+    output:
+            metrics_pth: path of the json metrics
+    """
+    metrics = {
+        'run_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'family': family,
+        'splits': splits
+    }
+    os.makedirs(output_dir, exist_ok=True)
+    metrics_pth = os.path.join(output_dir, f'{family}_metrics.json')
+    with open(metrics_pth, 'w', encoding='utf-8') as file:
+        json.dump(metrics, file, indent=2)
+
+    if pyarrow is None:
+        logging.info('pyarrow is not installed, skipping the metrics history')
+        return metrics_pth
+    table = metrics_table(metrics)
+    if os.path.exists(history_pth):
+        table = pd.concat([pd.read_parquet(history_pth), table], ignore_index=True)
+    os.makedirs(os.path.dirname(history_pth) or '.', exist_ok=True)
+    table.to_parquet(history_pth, index=False)
+    return metrics_pth
+
+
+def draw_report(
+        title: str,
+        train_report: Dict[str, Any],
+        test_report: Dict[str, Any],
+        output_pth: str
+):
+    """
+    draws the train and test reports as text in a figure
+    input:
+            title: title for the plot
+            train_report: report of the training split
+            test_report: report of the testing split
+            output_pth: path to store the figure
+    output:
+            None
+    """
+    import matplotlib.pyplot as plt  # pylint: disable=import-outside-toplevel
+    plt.figure(figsize=(10, 10))
+    plt.text(0.01, 1.05, f'{title} Train', {'fontsize': 14}, fontproperties='monospace')
+    plt.text(0.01, 0.6, format_report(train_report), {'fontsize': 12}, fontproperties='monospace')
+    plt.text(0.01, 0.5, f'{title} Test', {'fontsize': 14}, fontproperties='monospace')
+    plt.text(0.01, 0.0, format_report(test_report), {'fontsize': 12}, fontproperties='monospace')
+    plt.axis('off')
+    plt.tight_layout()
+    plt.savefig(output_pth, bbox_inches='tight')
+    plt.close()
+
+
+def render_report_image(metrics_pth: str, output_pth: str):
+    """
+    renders the classification report image of a family from its json metrics, does not
+    need the models or the data
+    input:
+            metrics_pth: json written by save_metrics
+            output_pth: path to store the figure
+    output:
+            None
+    """
+    with open(metrics_pth, encoding='utf-8') as file:
+        metrics = json.load(file)
+    draw_report(
+        metrics['family'], metrics['splits']['train']['report'],
+        metrics['splits']['test']['report'], output_pth
+    )
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Render a classification report from json metrics')
+    parser.add_argument('--metrics', type=str, required=True, help='json written by save_metrics')
+    parser.add_argument('--output', type=str, required=True, help='png to write')
+    args = parser.parse_args()
+    render_report_image(args.metrics, args.output)
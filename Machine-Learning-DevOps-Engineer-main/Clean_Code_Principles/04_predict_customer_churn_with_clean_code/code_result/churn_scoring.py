@@ -0,0 +1,131 @@
+"""
+This module contains the out-of-core batch scoring entry point for the churn models:
+* streams a csv or parquet input in fixed-size chunks
+* encodes and selects features like churn_library, then scores across a process pool
+* writes the probabilities to partitioned parquet with a bounded number of chunks in flight
+
+usage: python churn_scoring.py --input ./data/bank_data.csv --output ./scores
+
+author: jazielinho
+created: 2024 July
+"""
+
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, Optional
+import argparse
+import logging
+import os
+import time
+import pandas as pd
+
+from churn_artifacts import load_model_artifact
+from churn_encoder import TargetEncoder
+from churn_io import KEEP_COLS, feature_matrix, iter_chunks
+
+
+MODEL_PTH = './models/rf_model.pkl'
+ENCODER_PTH = './models/target_encoder.pkl'
+ID_COLUMN = 'CLIENTNUM'
+
+# loaded once per worker process by _init_worker
+_WORKER_STATE = {}
+
+
+def _init_worker(model_pth: str, encoder_pth: str):
+    """
+    loads the model (memory-mapped, shared between workers) and the encoder
+    """
+    _WORKER_STATE['model'] = load_model_artifact(model_pth)
+    _WORKER_STATE['encoder'] = TargetEncoder.load(encoder_pth)
+
+
+def _score_chunk(chunk: pd.DataFrame) -> pd.DataFrame:
+    """
+    encodes, selects features and scores a chunk, runs in a worker process
+    input:
+            chunk: pandas dataframe with the raw bank columns
+    output:
+            scores: pandas dataframe with the id column (when present) and one
+                    probability column per class
+    """
+    model, encoder = _WORKER_STATE['model'], _WORKER_STATE['encoder']
+    features = feature_matrix(encoder.transform(chunk, inplace=True), KEEP_COLS)
+    proba = model.predict_proba(features)
+    scores = pd.DataFrame(
+        proba, columns=[f'proba_{label}' for label in model.classes_], index=chunk.index
+    )
+    if ID_COLUMN in chunk.columns:
+        scores.insert(0, ID_COLUMN, chunk[ID_COLUMN].to_numpy())
+    return scores
+
+
+def _write_partition(output_dir: str, partition: int, future: Future) -> int:
+    """
+    waits for a scored chunk and writes it as a parquet partition
+    """
+    scores = future.result()
+    scores.to_parquet(os.path.join(output_dir, f'part-{partition:05d}.parquet'), index=False)
+    return len(scores)
+
+
+def score(
+        input_pth: str,
+        output_dir: str,
+        model_pth: str = MODEL_PTH,
+        encoder_pth: str = ENCODER_PTH,
+        chunk_size: int = 100_000,
+        n_jobs: Optional[int] = None
+) -> Dict[str, float]:
+    """
+    scores every row of input_pth and writes output_dir/part-00000.parquet, ...
+    input:
+            input_pth: path to a csv or parquet file with the bank columns
+            output_dir: folder for the parquet partitions
+            model_pth: path of the model artifact
+            encoder_pth: path of the fitted TargetEncoder
+            chunk_size: number of rows per chunk and per partition
+            n_jobs: number of worker processes, None uses all cores
+    output:
+            report: dict with rows, seconds and rows_per_sec
+    """
+    try:
+        logging.info('Scoring %s with %s', input_pth, model_pth)
+        os.makedirs(output_dir, exist_ok=True)
+        n_jobs = n_jobs or os.cpu_count() or 1
+        start = time.perf_counter()
+        rows = 0
+        with ProcessPoolExecutor(
+                max_workers=n_jobs, initializer=_init_worker, initargs=(model_pth, encoder_pth)
+        ) as executor:
+            # at most two chunks per worker are read but not yet written
+            in_flight = deque()
+            for partition, chunk in enumerate(iter_chunks(input_pth, chunk_size)):
+                in_flight.append((partition, executor.submit(_score_chunk, chunk)))
+                if len(in_flight) >= 2 * n_jobs:
+                    rows += _write_partition(output_dir, *in_flight.popleft())
+            while in_flight:
+                rows += _write_partition(output_dir, *in_flight.popleft())
+        seconds = time.perf_counter() - start
+        report = {'rows': rows, 'seconds': seconds, 'rows_per_sec': rows / seconds if seconds else 0.0}
+        logging.info('Scored %d rows in %.2fs (%.0f rows/sec)', rows, seconds, report['rows_per_sec'])
+        return report
+    except Exception as err:
+        logging.error('An error occurred while scoring %s, %s', input_pth, err)
+        raise err
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='Score customers with a trained churn model')
+    parser.add_argument('--input', type=str, required=True, help='csv or parquet file to score')
+    parser.add_argument('--output', type=str, required=True, help='folder for the parquet partitions')
+    parser.add_argument('--model', type=str, default=MODEL_PTH, help='model artifact')
+    parser.add_argument('--encoder', type=str, default=ENCODER_PTH, help='fitted target encoder')
+    parser.add_argument('--chunk_size', type=int, default=100_000, help='rows per chunk')
+    parser.add_argument('--n_jobs', type=int, default=None, help='worker processes')
+    args = parser.parse_args()
+
+    result = score(args.input, args.output, args.model, args.encoder, args.chunk_size, args.n_jobs)
+    print(f"Scored {result['rows']} rows in {result['seconds']:.2f}s "
+          f"({result['rows_per_sec']:.0f} rows/sec)")
@@ -6,16 +6,41 @@ created: 2024 July
 """
 
 
+import json
 import os
+import subprocess
+import sys
+import tracemalloc
 import pytest
+import numpy as np
 import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import classification_report
+import churn_search
+from churn_artifacts import CompactForest, load_model_artifact, save_model_artifact
+from churn_cache import ResultStore
+from churn_eda import render_plots
+from churn_encoder import TargetEncoder
+from churn_folds import FoldPlan, cross_validate
+from churn_importance import permutation_importance, stratified_sample
+from churn_incremental import row_hashes, warm_start_forest
+from churn_instrumentation import get_records, instrument, reset_records, write_run_report
+from churn_metrics import classification_metrics, format_report, metrics_table, save_metrics
+from churn_io import (
+    CATEGORICAL_COLUMNS, KEEP_COLS, NUMERICAL_COLUMNS, feature_matrix, load_csv_cached
+)
+from churn_scoring import score
+from churn_streaming import is_test_row, train_streaming
 from churn_library import (
     import_data, perform_eda, encoder_helper,
-    perform_feature_engineering, train_models, logging
+    perform_feature_engineering, train_models, logging, _get_predictions, configure_logging
 )
 
 DATA_PATH = './data/bank_data.csv'
 
+configure_logging()
+
 
 @pytest.fixture(scope="module", name="bank_data")
 def bank_data_fixture():
@@ -35,6 +60,29 @@ def test_import_data(bank_data: pd.DataFrame):
     assert isinstance(bank_data, pd.DataFrame), "Output is not a pandas DataFrame"
     assert 'Attrition_Flag' in bank_data.columns, "Attrition_Flag column is missing"
     assert 'Churn' in bank_data.columns, "Churn column is missing"
+    for category in CATEGORICAL_COLUMNS:
+        assert isinstance(bank_data[category].dtype, pd.CategoricalDtype), f"{category} is not a category"
+
+
+def test_load_csv_cached(tmp_path):
+    """
+    Test that the parquet sidecar is reused and invalidated when the csv changes
+    """
+    logging.info("Testing the load_csv_cached function")
+    csv_path = tmp_path / 'bank_data.csv'
+    pd.read_csv(DATA_PATH, nrows=50).to_csv(csv_path, index=False)
+    cache_dir = str(tmp_path / 'cache')
+
+    first = load_csv_cached(str(csv_path), cache_dir=cache_dir)
+    assert any(name.endswith('.parquet') for name in os.listdir(cache_dir)), "Sidecar not written"
+    second = load_csv_cached(str(csv_path), cache_dir=cache_dir)
+    pd.testing.assert_frame_equal(first, second)
+    plain = load_csv_cached(str(csv_path), schema={}, cache_dir=cache_dir)
+    assert first['Gender'].dtype == 'category'
+    assert plain['Gender'].dtype != 'category', "Sidecar of another schema was used"
+
+    pd.read_csv(DATA_PATH, nrows=60).to_csv(csv_path, index=False)
+    assert len(load_csv_cached(str(csv_path), cache_dir=cache_dir)) == 60, "Stale sidecar was used"
 
 
 def test_perform_eda(bank_data: pd.DataFrame):
@@ -52,6 +100,29 @@ def test_perform_eda(bank_data: pd.DataFrame):
     assert os.path.exists('./images/eda/corr_heatmap.png'), "Correlation heatmap was not created"
 
 
+def test_render_plots_skips_unchanged(bank_data: pd.DataFrame, tmp_path):
+    """
+    Test that only plots whose input columns changed are rendered again
+    input:
+            bank_data: the output of the import_data function
+    """
+    logging.info("Testing the render_plots function")
+    plots = [
+        {'kind': 'categorical', 'column': 'Gender'},
+        {'kind': 'numerical', 'column': 'Customer_Age', 'density': False},
+    ]
+    dataframe = bank_data[['Gender', 'Customer_Age']].copy()
+    manifest_pth = str(tmp_path / 'manifest.json')
+
+    rendered = render_plots(dataframe, plots, str(tmp_path), manifest_pth, n_jobs=2)
+    assert len(rendered) == 2, "Not every plot was rendered"
+    assert not render_plots(dataframe, plots, str(tmp_path), manifest_pth), "Unchanged plot rendered"
+
+    dataframe['Customer_Age'] += 1
+    rendered = render_plots(dataframe, plots, str(tmp_path), manifest_pth)
+    assert rendered == [str(tmp_path / 'Customer_Age.png')], "Changed plot was not rendered"
+
+
 def test_encoder_helper(bank_data: pd.DataFrame):
     """
     Test the encoder_helper function
@@ -69,6 +140,30 @@ def test_encoder_helper(bank_data: pd.DataFrame):
         assert f"{category}_Churn" in dataframe.columns, f"{category}_Churn column is missing"
 
 
+def test_target_encoder(bank_data: pd.DataFrame, tmp_path):
+    """
+    Test that the TargetEncoder matches the per-category churn mean and survives a round trip
+    input:
+            bank_data: the output of the import_data function
+    """
+    logging.info("Testing the TargetEncoder")
+    train_rows, new_rows = bank_data.iloc[:5000], bank_data.iloc[5000:].copy()
+    encoder = TargetEncoder(['Gender', 'Card_Category']).fit(train_rows, train_rows['Churn'])
+    encoder.save(str(tmp_path / 'encoder.pkl'))
+    encoder = TargetEncoder.load(str(tmp_path / 'encoder.pkl'))
+
+    expected = train_rows.groupby('Card_Category', observed=True)['Churn'].mean()
+    encoded = encoder.transform(new_rows)
+    assert np.allclose(
+        encoded['Card_Category_Churn'], new_rows['Card_Category'].map(expected).astype(float)
+    ), "Encoded values differ from the category means"
+
+    new_rows['Card_Category'] = new_rows['Card_Category'].astype(str).replace('Blue', 'Unseen')
+    encoded = encoder.transform(new_rows)
+    unseen = new_rows['Card_Category'] == 'Unseen'
+    assert np.allclose(encoded.loc[unseen, 'Card_Category_Churn'], train_rows['Churn'].mean())
+
+
 def test_perform_feature_engineering(bank_data: pd.DataFrame):
     """
     Test the perform_feature_engineering function
@@ -91,10 +186,12 @@ def test_train_models(bank_data: pd.DataFrame):
     """
     logging.info("Testing the train_models function")
     train_df, test_df, y_train, y_test = perform_feature_engineering(bank_data, 'Churn')
-    train_models(train_df, test_df, y_train, y_test)
+    render = train_models(train_df, test_df, y_train, y_test)
     assert os.path.exists(
         './models/rf_model.pkl'
     ), "Random forest model was not saved"
+    assert render is not None, "Classification report images were not started"
+    render.result()
     assert os.path.exists(
         './models/logistic_model.pkl'
     ), "Logistic regression model was not saved"
@@ -112,5 +209,375 @@ def test_train_models(bank_data: pd.DataFrame):
     ), "Logistic regression feature importance plot was not created"
 
 
+def test_resumable_grid_search(bank_data: pd.DataFrame, tmp_path, monkeypatch):
+    """
+    Test that the grid search persists fold scores and resumes from the store
+    input:
+            bank_data: the output of the import_data function
+    """
+    logging.info("Testing the resumable_grid_search function")
+    sample = bank_data.sample(300, random_state=0)
+    train_df, y_train = sample[['Customer_Age', 'Total_Trans_Ct']], sample['Churn']
+    param_grid = {'n_estimators': [5, 10], 'max_depth': [2, 3]}
+    store = ResultStore(str(tmp_path / 'results.sqlite'))
+
+    model, cv_results = churn_search.resumable_grid_search(
+        RandomForestClassifier(random_state=42), param_grid, train_df, y_train, cv=3, store=store
+    )
+    assert len(cv_results) == 4, "Not every candidate was scored"
+    data_hash = churn_search.search_key(
+        RandomForestClassifier(random_state=42), train_df, y_train, 3
+    )
+    assert len(store.get_scores(data_hash)) == 12, "Fold scores were not stored"
+
+    def fail(*args, **kwargs):
+        raise AssertionError("Cached fold was refitted")
+
+    monkeypatch.setattr(churn_search, '_fit_and_score', fail)
+    resumed, resumed_results = churn_search.resumable_grid_search(
+        RandomForestClassifier(random_state=42), param_grid, train_df, y_train, cv=3, store=store
+    )
+    assert resumed.get_params() == model.get_params(), "Resumed search picked another model"
+    assert resumed_results['mean_test_score'].equals(cv_results['mean_test_score'])
+    with pytest.raises(AssertionError, match="Cached fold was refitted"):
+        churn_search.resumable_grid_search(
+            RandomForestClassifier(random_state=0), param_grid, train_df, y_train, cv=3,
+            store=store, n_jobs=1
+        )
+
+
+def test_budgeted_halving_search(bank_data: pd.DataFrame):
+    """
+    Test that successive halving narrows the candidates over rungs, prunes failing fits
+    and still returns a refitted model when the time budget ends after the first batch
+    input:
+            bank_data: the output of the import_data function
+    """
+    logging.info("Testing the budgeted_halving_search function")
+    train_df = bank_data[['Customer_Age', 'Total_Trans_Ct', 'Total_Trans_Amt']]
+    y_train = bank_data['Churn']
+    param_grid = {'n_estimators': [20, 40], 'max_depth': [1, 8], 'max_features': [None, 'bad']}
+    model, cv_results = churn_search.budgeted_halving_search(
+        RandomForestClassifier(random_state=42), param_grid, train_df, y_train,
+        factor=2, min_samples=1000, n_jobs=1
+    )
+    assert sorted(cv_results['rung'].unique()) == [0, 1, 2, 3], "Rungs were skipped"
+    assert len(cv_results[cv_results['rung'] == 0]) == 8
+    later_rungs = cv_results[cv_results['rung'] > 0]
+    assert all(params['max_features'] is None for params in later_rungs['params']), "Failed fits survived"
+    assert model.get_params()['max_depth'] == 8 and hasattr(model, 'estimators_')
+
+    budgeted, budgeted_results = churn_search.budgeted_halving_search(
+        RandomForestClassifier(random_state=42), param_grid, train_df, y_train,
+        factor=2, min_samples=1000, time_budget=0, n_jobs=1
+    )
+    assert list(budgeted_results['rung'].unique()) == [0], "The search ran past its budget"
+    assert hasattr(budgeted, 'estimators_')
+
+
+def test_get_predictions(bank_data: pd.DataFrame):
+    """
+    Test that labels derived from the single predict_proba pass match model.predict
+    input:
+            bank_data: the output of the import_data function
+    """
+    logging.info("Testing the _get_predictions function")
+    train_df, test_df, y_train, _ = perform_feature_engineering(bank_data, 'Churn')
+    model = RandomForestClassifier(n_estimators=10, random_state=42).fit(train_df, y_train)
+    train_proba, test_proba, train_preds, test_preds = _get_predictions(model, train_df, test_df)
+    assert train_proba.shape == (len(train_df), 2), "Unexpected probability shape"
+    assert np.array_equal(test_preds, model.predict(test_df)), "Derived labels differ from predict"
+    assert np.array_equal(train_preds, model.predict(train_df)), "Derived labels differ from predict"
+    assert np.allclose(test_proba, model.predict_proba(test_df))
+
+
+def test_model_artifacts(bank_data: pd.DataFrame, tmp_path):
+    """
+    Test that both artifact variants round trip a forest with the same predictions
+    input:
+            bank_data: the output of the import_data function
+    """
+    logging.info("Testing the model artifact format")
+    train_df, test_df, y_train, _ = perform_feature_engineering(bank_data, 'Churn')
+    model = RandomForestClassifier(n_estimators=20, random_state=42).fit(train_df, y_train)
+
+    save_model_artifact(model, str(tmp_path / 'rf_model.pkl'))
+    plain = load_model_artifact(str(tmp_path / 'rf_model.pkl'))
+    assert isinstance(plain, RandomForestClassifier), "Default artifact is not the sklearn model"
+    assert np.array_equal(plain.predict(test_df), model.predict(test_df))
+
+    save_model_artifact(model, str(tmp_path / 'rf_model_compact.pkl'), compact=True)
+    mapped = load_model_artifact(str(tmp_path / 'rf_model_compact.pkl'))
+    assert isinstance(mapped, CompactForest), "Forest was not flattened"
+    assert isinstance(mapped.threshold, np.memmap), "Node arrays were not memory-mapped"
+    assert np.allclose(mapped.predict_proba(test_df), model.predict_proba(test_df), atol=1e-6)
+    assert np.array_equal(mapped.predict(test_df), model.predict(test_df))
+
+    path = save_model_artifact(
+        model, str(tmp_path / 'cold_model.pkl'), compress=True, compact=True
+    )
+    assert path.endswith('.gz'), "Compressed variant has no compression extension"
+    cold = load_model_artifact(str(tmp_path / 'cold_model.pkl'))
+    assert np.array_equal(cold.predict(test_df), model.predict(test_df))
+
+
+def test_score(tmp_path):
+    """
+    Test that batch scoring writes one partition per chunk with the model probabilities
+    """
+    logging.info("Testing the score function")
+    dataframe = pd.read_csv(DATA_PATH, nrows=2500)
+    dataframe.to_csv(tmp_path / 'customers.csv', index=False)
+    dataframe['Churn'] = (dataframe['Attrition_Flag'] != "Attrited Customer").astype(int)
+    encoder = TargetEncoder(CATEGORICAL_COLUMNS).fit(dataframe, dataframe['Churn'])
+    encoder.save(str(tmp_path / 'encoder.pkl'))
+    features = encoder.transform(dataframe)[KEEP_COLS]
+    model = RandomForestClassifier(n_estimators=10, random_state=42).fit(features, dataframe['Churn'])
+    save_model_artifact(model, str(tmp_path / 'model.pkl'))
+
+    report = score(
+        str(tmp_path / 'customers.csv'), str(tmp_path / 'scores'),
+        str(tmp_path / 'model.pkl'), str(tmp_path / 'encoder.pkl'), chunk_size=1000, n_jobs=2
+    )
+    assert report['rows'] == 2500, "Not every row was scored"
+    assert sorted(os.listdir(tmp_path / 'scores')) == [
+        'part-00000.parquet', 'part-00001.parquet', 'part-00002.parquet'
+    ], "Unexpected partitions"
+    scores = pd.read_parquet(tmp_path / 'scores')
+    assert np.allclose(scores['proba_1'], model.predict_proba(features)[:, 1], atol=1e-6)
+    assert scores['CLIENTNUM'].tolist() == dataframe['CLIENTNUM'].tolist()
+
+
+def test_run_report(tmp_path):
+    """
+    Test that instrumented stages end up in the run report and the history
+    """
+    logging.info("Testing the run report")
+
+    @instrument('double')
+    def double(dataframe: pd.DataFrame) -> pd.DataFrame:
+        return pd.concat([dataframe, dataframe])
+
+    reset_records()
+    tracemalloc.start()
+    try:
+        double(pd.DataFrame({'a': range(1000)}))
+    finally:
+        tracemalloc.stop()
+    record = get_records()[0]
+    assert record['stage'] == 'double' and record['rows'] == 1000, "Stage was not recorded"
+    assert record['wall_seconds'] >= 0 and record['peak_traced_mb'] > 0
+
+    for _ in range(2):
+        write_run_report(
+            {'data_rows': 1000}, str(tmp_path / 'report.json'), str(tmp_path / 'history.jsonl')
+        )
+    with open(tmp_path / 'report.json', encoding='utf-8') as file:
+        assert json.load(file)['stages'][0]['stage'] == 'double'
+    with open(tmp_path / 'history.jsonl', encoding='utf-8') as file:
+        assert len(file.readlines()) == 2, "History was not appended"
+
+
+def test_lazy_imports():
+    """
+    Test that importing churn_library and churn_scoring does not load the plotting and
+    training packages, nor configure logging
+    """
+    logging.info("Testing lazy imports")
+    code = (
+        'import logging, sys, churn_library, churn_scoring; '
+        'print(sorted(p for p in ("matplotlib", "seaborn", "sklearn") if p in sys.modules), '
+        'len(logging.getLogger().handlers))'
+    )
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    assert result.stdout.split() == ['[]', '0'], \
+        f"Heavy packages or logging loaded on import {result.stdout}"
+
+
+def test_warm_start_forest(bank_data: pd.DataFrame):
+    """
+    Test that the incremental mode grows trees on new rows only and asks for a full
+    search when the holdout accuracy drops
+    input:
+            bank_data: the output of the import_data function
+    """
+    logging.info("Testing the warm_start_forest function")
+    dataframe = encoder_helper(bank_data.copy(), CATEGORICAL_COLUMNS, 'Churn')
+    train_df, _, y_train, _ = perform_feature_engineering(dataframe, 'Churn')
+    old_df, old_y = train_df.iloc[:4000], y_train.iloc[:4000]
+    model = RandomForestClassifier(n_estimators=20, max_depth=5, random_state=42)
+    checkpoint = {
+        'model': model.fit(old_df, old_y),
+        'score': 0.85,
+        'seen': row_hashes(old_df, old_y, NUMERICAL_COLUMNS)
+    }
+    same_model, same_checkpoint = warm_start_forest(
+        checkpoint, old_df, old_y, NUMERICAL_COLUMNS, n_new_trees=10
+    )
+    assert same_model is model and same_checkpoint is checkpoint, "Seen rows were refit"
+
+    few_df, few_y = train_df.iloc[:4050], y_train.iloc[:4050]
+    few_model, few_checkpoint = warm_start_forest(
+        checkpoint, few_df, few_y, NUMERICAL_COLUMNS, n_new_trees=10, min_new_rows=100
+    )
+    assert few_model is model and len(model.estimators_) == 20, "Trees grown on a small batch"
+    assert np.array_equal(few_checkpoint['seen'], checkpoint['seen']), \
+        "Rows of a small batch were marked as seen without training on them"
+
+    updated, updated_checkpoint = warm_start_forest(
+        checkpoint, train_df, y_train, NUMERICAL_COLUMNS, n_new_trees=10
+    )
+    assert updated is not None and len(updated.estimators_) == 30, "No trees were grown"
+    assert len(updated_checkpoint['seen']) == len(np.unique(
+        row_hashes(train_df, y_train, NUMERICAL_COLUMNS)
+    )), "New rows were not marked as seen"
+
+    fallback, fallback_checkpoint = warm_start_forest(
+        {**checkpoint, 'score': 1.01}, train_df, y_train, NUMERICAL_COLUMNS
+    )
+    assert fallback is None, "A drop of the holdout accuracy did not trigger a full search"
+    assert len(fallback_checkpoint['model'].estimators_) == 20, "Rejected trees were kept"
+
+
+def test_classification_metrics(tmp_path):
+    """
+    Test that the bincount metrics match sklearn's classification_report and are stored
+    """
+    logging.info("Testing the classification_metrics function")
+    rng = np.random.default_rng(0)
+    y_true = rng.integers(0, 3, 1000)
+    y_pred = np.where(rng.random(1000) < 0.7, y_true, rng.integers(0, 3, 1000))
+    y_pred[y_pred == 2] = 1  # a label that is never predicted
+    metrics = classification_metrics(y_true, y_pred)
+    expected = classification_report(y_true, y_pred, output_dict=True, zero_division=0)
+    for name, values in expected.items():
+        assert metrics['report'][name] == pytest.approx(values), f"{name} differs from sklearn"
+    assert format_report(metrics['report']) == classification_report(
+        y_true, y_pred, zero_division=0
+    ), "Formatted report differs from sklearn"
+
+    history_pth = str(tmp_path / 'history.parquet')
+    metrics_pth = save_metrics('rf', {'train': metrics, 'test': metrics}, str(tmp_path), history_pth)
+    save_metrics('rf', {'train': metrics, 'test': metrics}, str(tmp_path), history_pth)
+    with open(metrics_pth, encoding='utf-8') as file:
+        assert len(metrics_table(json.load(file))) * 2 == len(
+            pd.read_parquet(history_pth)
+        ), "History was not appended"
+
+
+def test_permutation_importance(tmp_path):
+    """
+    Test that permutation importance ranks the informative column first, keeps the class
+    proportions of the subsample and is cached
+    """
+    logging.info("Testing the permutation_importance function")
+    rng = np.random.default_rng(0)
+    features = pd.DataFrame(rng.normal(size=(3000, 3)), columns=['signal', 'noise_a', 'noise_b'])
+    target = pd.Series((features['signal'] > 1).astype(int))
+    model = RandomForestClassifier(n_estimators=20, max_depth=4, random_state=42)
+    model.fit(features, target)
+
+    positions = stratified_sample(features, target, 500)
+    assert len(positions) == 500, "Unexpected sample size"
+    assert target.iloc[positions].mean() == pytest.approx(target.mean(), abs=0.01), \
+        "Sample does not keep the class proportions"
+
+    importances = permutation_importance(
+        model, features, target, n_repeats=3, sample_size=500, n_jobs=2, cache_dir=str(tmp_path)
+    )
+    assert importances['importance_mean'].idxmax() == 'signal', "Signal is not ranked first"
+    assert len(os.listdir(tmp_path)) == 1, "Importances were not cached"
+    cached = permutation_importance(
+        model, features, target, n_repeats=3, sample_size=500, n_jobs=2, cache_dir=str(tmp_path)
+    )
+    pd.testing.assert_frame_equal(cached, importances, check_dtype=False)
+
+
+def test_train_streaming(tmp_path):
+    """
+    Test that the out-of-core path splits customers deterministically, learns from the
+    chunks and writes artifacts that churn_scoring can load
+    """
+    logging.info("Testing the train_streaming function")
+    dataframe = pd.read_csv(DATA_PATH)
+    dataframe.to_csv(tmp_path / 'customers.csv', index=False)
+    test_rows = is_test_row(dataframe['CLIENTNUM'])
+    assert np.array_equal(test_rows, is_test_row(dataframe['CLIENTNUM'].iloc[::-1])[::-1]), \
+        "The split depends on the row order"
+    assert test_rows.mean() == pytest.approx(0.3, abs=0.02), "Unexpected test share"
+
+    report = train_streaming(
+        str(tmp_path / 'customers.csv'), chunk_size=2000, epochs=2,
+        model_pth=str(tmp_path / 'model.pkl'), encoder_pth=str(tmp_path / 'encoder.pkl'),
+        metrics_dir=str(tmp_path / 'metrics')
+    )
+    assert report['test_rows'] == test_rows.sum(), "Rows changed split between passes"
+    assert report['train_rows'] + report['test_rows'] == len(dataframe), "Rows were lost"
+    assert report['metrics']['test']['report']['accuracy'] > 0.8, "The model did not learn"
+    assert os.path.exists(tmp_path / 'metrics' / 'sgd_metrics.json'), "Metrics were not written"
+
+    scores = score(
+        str(tmp_path / 'customers.csv'), str(tmp_path / 'scores'),
+        str(tmp_path / 'model.pkl'), str(tmp_path / 'encoder.pkl'), chunk_size=5000, n_jobs=1
+    )
+    assert scores['rows'] == len(dataframe), "Streaming artifacts could not be scored"
+
+
+def test_feature_matrix(bank_data: pd.DataFrame):
+    """
+    Test that the features are one read-only float32 block that sklearn uses without
+    copying, and that forests predict as with the previous column selection
+    input:
+            bank_data: the output of the import_data function
+    """
+    logging.info("Testing the feature_matrix function")
+    dataframe = encoder_helper(bank_data.copy(), CATEGORICAL_COLUMNS, 'Churn')
+    features = feature_matrix(dataframe)
+    values = features.to_numpy()
+    assert list(features.columns) == KEEP_COLS and features.index.equals(dataframe.index), \
+        "Unexpected columns or index"
+    assert values.dtype == np.float32 and values.flags['C_CONTIGUOUS'], "Not a float32 block"
+    assert not values.flags['WRITEABLE'], "Shared features are writeable"
+    assert np.shares_memory(values, features.iloc[:100].to_numpy()), "Row slices copy"
+
+    model = RandomForestClassifier(n_estimators=10, random_state=42)
+    model.fit(features, dataframe['Churn'])
+    assert np.array_equal(
+        model.predict_proba(features), model.predict_proba(dataframe[KEEP_COLS])
+    ), "Predictions differ from the column selection"
+
+
+def test_fold_plan(bank_data: pd.DataFrame, tmp_path):
+    """
+    Test that the fold plan encodes every fold from its own training rows, is cached,
+    and that every model is scored on every fold
+    input:
+            bank_data: the output of the import_data function
+    """
+    logging.info("Testing the fold plan")
+    rows = bank_data.iloc[:3000]
+    plan = FoldPlan.build(rows, 'Churn', n_splits=3, cache_dir=str(tmp_path))
+    arrays = plan.fold(0)
+    assert isinstance(arrays['x_train'], np.memmap) and arrays['x_train'].dtype == np.float32, \
+        "Fold matrices are not memory-mapped float32"
+    assert len(arrays['train_idx']) + len(arrays['val_idx']) == len(rows), "Rows were lost"
+    assert not set(arrays['train_idx']) & set(arrays['val_idx']), "Folds overlap"
+    train_rows = rows.iloc[arrays['train_idx']]
+    expected = TargetEncoder(CATEGORICAL_COLUMNS).fit(train_rows, train_rows['Churn'])
+    assert np.allclose(
+        arrays['x_val'], expected.transform(rows.iloc[arrays['val_idx']])[KEEP_COLS]
+    ), "Validation rows were encoded with their own target"
+    cached = FoldPlan.build(rows, 'Churn', n_splits=3, cache_dir=str(tmp_path))
+    assert cached.directory == plan.directory and len(os.listdir(tmp_path)) == 1, \
+        "Fold plan was not cached"
+
+    scores = cross_validate(plan, {
+        'rf': RandomForestClassifier(n_estimators=10, random_state=42),
+        'lr': LogisticRegression(max_iter=3000),
+    }, n_jobs=2)
+    assert len(scores) == 6, "Not every model was scored on every fold"
+    assert scores['score'].between(0.7, 1).all(), "Unexpected fold scores"
+
+
 if __name__ == "__main__":
     pytest.main()
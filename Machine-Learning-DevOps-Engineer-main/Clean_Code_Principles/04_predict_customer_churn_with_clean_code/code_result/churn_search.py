@@ -0,0 +1,301 @@
+"""
+This module contains the hyperparameter search engine used by churn_library:
+* fans fold x candidate fits across all cores
+* persists each finished fold score to a local result store
+* resumes from the store after a crash or when the grid is extended
+* budgeted successive halving over sample size and n_estimators, with a deadline
+
+author: jazielinho
+created: 2024 July
+"""
+
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import logging
+import math
+import time
+import pandas as pd
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.base import BaseEstimator, clone
+from sklearn.model_selection import ParameterGrid, StratifiedKFold, train_test_split
+
+from churn_cache import ResultStore, hash_data, hash_params
+
+
+def _fit_and_score(
+        estimator: BaseEstimator,
+        params: Dict,
+        features: np.ndarray,
+        target: np.ndarray,
+        train_idx: np.ndarray,
+        test_idx: np.ndarray
+) -> float:
+    """
+    fits a single candidate on a single fold and returns its validation score
+    input:
+            estimator: unfitted estimator
+            params: candidate hyperparameters
+            features: X data
+            target: y data
+            train_idx: fold training indices
+            test_idx: fold validation indices
+    output:
+            score: validation score, nan if the fit failed
+    """
+    try:
+        estimator.set_params(**params)
+        estimator.fit(features[train_idx], target[train_idx])
+        return estimator.score(features[test_idx], target[test_idx])
+    except Exception as err:  # pylint: disable=broad-except
+        # same behaviour as GridSearchCV(error_score=np.nan)
+        logging.warning('Fit failed for %s, %s', params, err)
+        return np.nan
+
+
+def _timed_fit_and_score(
+        estimator: BaseEstimator,
+        params: Dict,
+        features: np.ndarray,
+        target: np.ndarray,
+        train_idx: np.ndarray,
+        test_idx: np.ndarray
+) -> Tuple[float, float]:
+    """
+    _fit_and_score that also returns the seconds it took
+    """
+    start = time.perf_counter()
+    score = _fit_and_score(estimator, params, features, target, train_idx, test_idx)
+    return score, time.perf_counter() - start
+
+
+def search_key(
+        estimator: BaseEstimator,
+        train_df: pd.DataFrame,
+        y_train: pd.Series,
+        cv: int
+) -> str:
+    """
+    returns the key of the stored fold scores: the training data and cv setup, plus the
+    class and fixed parameters of the base estimator, so changing them does not reuse
+    stale scores and models
+    input:
+            estimator: unfitted base estimator
+            train_df: X training data
+            y_train: y training data
+            cv: number of stratified folds
+    output:
+            key: hex string
+    """
+    estimator_key = f'{type(estimator).__name__}{hash_params(estimator.get_params())}'
+    return hashlib.sha256(
+        f'{hash_data(train_df, y_train, np.array([cv]))}{estimator_key}'.encode()
+    ).hexdigest()[:16]
+
+
+def resumable_grid_search(
+        estimator: BaseEstimator,
+        param_grid: Dict[str, List],
+        train_df: pd.DataFrame,
+        y_train: pd.Series,
+        cv: int = 5,
+        n_jobs: int = -1,
+        store: Optional[ResultStore] = None
+) -> Tuple[BaseEstimator, pd.DataFrame]:
+    """
+    grid search equivalent to GridSearchCV(estimator, param_grid, cv=cv) that runs
+    fold x candidate fits in parallel and only computes the fold scores missing
+    from the store
+    input:
+            estimator: unfitted estimator
+            param_grid: dict of parameter name -> list of values
+            train_df: X training data
+            y_train: y training data
+            cv: number of stratified folds
+            n_jobs: number of parallel workers, -1 uses all cores
+            store: result store, defaults to ResultStore()
+    output:
+            best_estimator: estimator refitted on all training data with the best params
+            cv_results: dataframe with params, mean_test_score and rank_test_score
+    """
+    store = store if store is not None else ResultStore()
+    features = train_df.to_numpy()
+    target = np.asarray(y_train)
+    data_hash = search_key(estimator, train_df, y_train, cv)
+    candidates = list(ParameterGrid(param_grid))
+    keys = [hash_params(params) for params in candidates]
+    folds = list(StratifiedKFold(n_splits=cv).split(features, target))
+
+    scores = store.get_scores(data_hash)
+    pending = [
+        (key, params, fold)
+        for key, params in zip(keys, candidates)
+        for fold in range(cv)
+        if (key, fold) not in scores
+    ]
+    logging.info(
+        'Grid search: %d candidates x %d folds, %d cached, %d to fit',
+        len(candidates), cv, len(candidates) * cv - len(pending), len(pending)
+    )
+
+    if pending:
+        results = Parallel(n_jobs=n_jobs, return_as='generator')(
+            delayed(_fit_and_score)(
+                clone(estimator), params, features, target, *folds[fold]
+            )
+            for _, params, fold in pending
+        )
+        for (key, _, fold), score in zip(pending, results):
+            store.put_score(data_hash, key, fold, score)
+            scores[(key, fold)] = score
+
+    mean_scores = np.array([
+        np.mean([scores[(key, fold)] for fold in range(cv)]) for key in keys
+    ])
+    if np.all(np.isnan(mean_scores)):
+        raise ValueError('All candidate fits failed')
+    cv_results = pd.DataFrame({
+        'params': candidates,
+        'mean_test_score': mean_scores,
+        'rank_test_score': pd.Series(mean_scores).rank(
+            method='min', ascending=False, na_option='bottom'
+        ).astype(int)
+    })
+
+    best_index = int(np.nanargmax(mean_scores))
+    best_key = keys[best_index]
+    best_estimator = store.load_model(data_hash, best_key)
+    if best_estimator is None:
+        logging.info('Refitting best candidate %s', best_key)
+        best_estimator = clone(estimator).set_params(**candidates[best_index])
+        best_estimator.fit(train_df, y_train)
+        store.save_model(data_hash, best_key, best_estimator)
+    return best_estimator, cv_results
+
+
+def _rung_params(params: Dict, fraction: float, min_estimators: int) -> Dict:
+    """
+    scales n_estimators of a candidate to the share of the budget of its rung
+    """
+    if 'n_estimators' not in params:
+        return params
+    return {**params, 'n_estimators': max(min_estimators, round(params['n_estimators'] * fraction))}
+
+
+def budgeted_halving_search(
+        estimator: BaseEstimator,
+        param_grid: Dict[str, List],
+        train_df: pd.DataFrame,
+        y_train: pd.Series,
+        cv: int = 3,
+        factor: int = 3,
+        min_samples: int = 500,
+        min_estimators: int = 10,
+        time_budget: Optional[float] = None,
+        prune_margin: float = 0.05,
+        n_jobs: int = -1,
+        random_state: int = 42
+) -> Tuple[BaseEstimator, pd.DataFrame]:
+    """
+    successive halving: every rung scores the surviving candidates on a larger stratified
+    subsample with more trees, and keeps the best 1 / factor of them for the next rung.
+    The last rung uses all rows and the full n_estimators of each candidate.
+    Within a rung, candidates whose first fold scores more than prune_margin below the
+    best first fold, or fail, are dropped before the remaining folds. No new fits start
+    once the time left is below the estimated refit time of the current leader, the leader
+    of the last scored fold is then refitted on all rows
+    input:
+            estimator: unfitted estimator
+            param_grid: dict of parameter name -> list of values
+            train_df: X training data
+            y_train: y training data
+            cv: number of stratified folds per rung
+            factor: share of candidates dropped per rung, and growth of the resources
+            min_samples: rows of the smallest rung, fewer rungs are used on small data
+            min_estimators: smallest n_estimators of a scaled candidate
+            time_budget: seconds for the search and the refit, None for no deadline
+            prune_margin: largest gap to the best first fold score of a rung
+            n_jobs: number of parallel workers, -1 uses all cores
+            random_state: seed of the subsamples and folds
+    output:
+            best_estimator: estimator refitted on all training data with the best params
+            cv_results: dataframe with params, rung, n_samples, mean_test_score and
+                        rank_test_score (rank within the last rung a candidate reached)
+    """
+    deadline = math.inf if time_budget is None else time.perf_counter() + time_budget
+    features, target = train_df.to_numpy(), np.asarray(y_train)
+    candidates = list(ParameterGrid(param_grid))
+    n_rungs = 1 + max(0, math.ceil(math.log(len(candidates), factor)))
+    while n_rungs > 1 and len(features) * factor ** (1 - n_rungs) < min_samples:
+        n_rungs -= 1
+
+    alive = list(range(len(candidates)))
+    rows, leader, refit_seconds = [], None, 0.0
+    task_seconds, task_fraction = 0.0, 1.0
+    for rung in range(n_rungs):
+        fraction = factor ** (rung + 1 - n_rungs)
+        sample = np.arange(len(features))
+        if rung < n_rungs - 1:
+            sample, _ = train_test_split(
+                sample, train_size=fraction, stratify=target, random_state=random_state
+            )
+        folds = list(
+            StratifiedKFold(n_splits=cv, shuffle=True, random_state=random_state)
+            .split(features[sample], target[sample])
+        )
+        params = {i: _rung_params(candidates[i], fraction, min_estimators) for i in alive}
+        scores = {i: [] for i in alive}
+        logging.info(
+            'Halving search: rung %d/%d, %d candidates on %d rows',
+            rung + 1, n_rungs, len(alive), len(sample)
+        )
+        out_of_time = False
+        # the first fold runs alone so hopeless candidates are pruned before the others
+        for batch in ([folds[0]], folds[1:]):
+            tasks = [(i, fold) for fold in batch for i in alive]
+            # fit time grows about linearly with rows and with trees
+            estimate = task_seconds * len(tasks) * (fraction / task_fraction) ** 2
+            if leader is not None and time.perf_counter() + estimate + refit_seconds > deadline:
+                out_of_time = True
+                break
+            start = time.perf_counter()
+            results = Parallel(n_jobs=n_jobs)(
+                delayed(_timed_fit_and_score)(
+                    clone(estimator), params[i], features[sample], target[sample], *fold
+                )
+                for i, fold in tasks
+            )
+            task_seconds, task_fraction = (time.perf_counter() - start) / len(tasks), fraction
+            fit_seconds = {}
+            for (i, _), (score, seconds) in zip(tasks, results):
+                scores[i].append(score)
+                fit_seconds[i] = seconds
+            means = {i: np.mean(scores[i]) for i in alive}
+            if np.all(np.isnan(list(means.values()))):
+                raise ValueError('All candidate fits failed')
+            best = np.nanmax(list(means.values()))
+            alive = [i for i in alive if means[i] >= best - prune_margin]
+            leader = max(alive, key=means.get)
+            refit_seconds = fit_seconds[leader] * len(features) / len(folds[0][0]) * (
+                candidates[leader].get('n_estimators', 1) / params[leader].get('n_estimators', 1)
+            )
+
+        rows.extend(
+            {'params': candidates[i], 'rung': rung, 'n_samples': len(sample),
+             'mean_test_score': float(np.mean(scores[i]))}
+            for i in scores if scores[i]
+        )
+        if out_of_time:
+            logging.info('Halving search: time budget reached in rung %d', rung + 1)
+            break
+        alive = sorted(alive, key=lambda i: np.mean(scores[i]), reverse=True)
+        alive = alive[:max(1, math.ceil(len(alive) / factor))]
+
+    cv_results = pd.DataFrame(rows)
+    cv_results['rank_test_score'] = cv_results.groupby('rung')['mean_test_score'].rank(
+        method='min', ascending=False, na_option='bottom'
+    ).astype(int)
+    logging.info('Halving search: refitting %s on %d rows', candidates[leader], len(features))
+    best_estimator = clone(estimator).set_params(**candidates[leader])
+    best_estimator.fit(train_df, y_train)
+    return best_estimator, cv_results
@@ -0,0 +1,180 @@
+"""
+This module contains the out-of-core training path for churn extracts larger than memory:
+* streams the csv or parquet input in fixed-size chunks, one chunk in memory at a time
+* deterministic train/test assignment per customer from a hash of CLIENTNUM
+* TargetEncoder and StandardScaler fitted from statistics aggregated over chunks
+* logistic regression trained with an averaged SGDClassifier.partial_fit over a few epochs,
+  averaging keeps the weights stable when single chunks are small or unbalanced
+* metrics from confusion matrices summed over chunks
+
+The saved model is a scaler + SGD pipeline over churn_io.KEEP_COLS and the encoder a
+TargetEncoder, so churn_scoring can score with them like with the in-memory models.
+
+usage: python churn_streaming.py --input ./data/bank_data.csv --chunk_size 100000
+
+author: jazielinho
+created: 2024 July
+"""
+
+from typing import Any, Dict, Iterator, Optional, Tuple
+import argparse
+import logging
+import numpy as np
+import pandas as pd
+
+from churn_config import load_config
+from churn_encoder import TargetEncoder
+from churn_instrumentation import instrument
+from churn_io import CATEGORICAL_COLUMNS, KEEP_COLS, RESPONSE, add_response, iter_chunks
+from churn_metrics import confusion_matrix, metrics_from_confusion_matrix, save_metrics
+
+
+MODEL_PTH = './models/sgd_model.pkl'
+ENCODER_PTH = './models/sgd_target_encoder.pkl'
+ID_COLUMN = 'CLIENTNUM'
+LABELS = np.array([0, 1])
+
+_BUCKETS = 10_000
+
+
+def is_test_row(client_ids: Any, test_size: float = 0.3) -> np.ndarray:
+    """
+    assigns customers to the test split from a hash of their id, the same customer lands
+    in the same split in every chunk, run and file
+    input:
+            client_ids: customer ids
+            test_size: share of customers in the test split
+    output:
+            mask: boolean array, True for test rows
+    """
+    buckets = pd.util.hash_array(np.asarray(client_ids, dtype=np.int64)) % _BUCKETS
+    return buckets < int(round(test_size * _BUCKETS))
+
+
+def _iter_split(
+        pth: str,
+        chunk_size: int,
+        test_size: float
+) -> Iterator[Tuple[pd.DataFrame, np.ndarray]]:
+    """
+    yields every chunk with its response column and its test mask
+    """
+    for chunk in iter_chunks(pth, chunk_size):
+        yield add_response(chunk), is_test_row(chunk[ID_COLUMN], test_size)
+
+
+@instrument('train_streaming')
+def train_streaming(
+        pth: str,
+        chunk_size: int = 100_000,
+        test_size: float = 0.3,
+        epochs: int = 3,
+        alpha: float = 1e-4,
+        model_pth: Optional[str] = MODEL_PTH,
+        encoder_pth: Optional[str] = ENCODER_PTH,
+        metrics_dir: Optional[str] = None,
+        random_state: int = 42
+) -> Dict[str, Any]:
+    """
+    trains the churn logistic regression without loading pth in memory. The input is
+    read 3 + epochs times: encoder statistics, scaler statistics, one read per epoch and
+    the evaluation
+    input:
+            pth: path to a csv or parquet file with the bank columns
+            chunk_size: number of rows per chunk, bounds the peak memory
+            test_size: share of customers held out
+            epochs: number of passes of partial_fit over the training rows
+            alpha: regularization of the SGD logistic regression
+            model_pth: path of the saved model, None to skip saving
+            encoder_pth: path of the saved encoder, None to skip saving
+            metrics_dir: folder of the json metrics, None uses the metrics section of
+                         config.yaml
+            random_state: seed of the shuffles within chunks and of SGD
+    output:
+            report: dict with model, encoder, train_rows, test_rows and metrics
+    """
+    # pylint: disable=import-outside-toplevel
+    from sklearn.linear_model import SGDClassifier
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import StandardScaler
+    from churn_artifacts import save_model_artifact
+    try:
+        logging.info('Streaming training on %s in chunks of %d rows', pth, chunk_size)
+        encoder = TargetEncoder(CATEGORICAL_COLUMNS)
+        for chunk, test_rows in _iter_split(pth, chunk_size, test_size):
+            train_chunk = chunk[~test_rows]
+            encoder.partial_fit(train_chunk, train_chunk[RESPONSE])
+
+        scaler = StandardScaler()
+        for chunk, test_rows in _iter_split(pth, chunk_size, test_size):
+            scaler.partial_fit(encoder.transform(chunk[~test_rows], inplace=True)[KEEP_COLS])
+
+        model = SGDClassifier(
+            loss='log_loss', alpha=alpha, average=True, random_state=random_state
+        )
+        rng = np.random.default_rng(random_state)
+        for epoch in range(epochs):
+            logging.info('Streaming training: epoch %d/%d', epoch + 1, epochs)
+            for chunk, test_rows in _iter_split(pth, chunk_size, test_size):
+                train_chunk = encoder.transform(chunk[~test_rows], inplace=True)
+                order = rng.permutation(len(train_chunk))
+                model.partial_fit(
+                    scaler.transform(train_chunk[KEEP_COLS])[order],
+                    train_chunk[RESPONSE].to_numpy()[order],
+                    classes=LABELS
+                )
+        pipeline = Pipeline([('scaler', scaler), ('model', model)])
+
+        matrices = {'train': 0, 'test': 0}
+        for chunk, test_rows in _iter_split(pth, chunk_size, test_size):
+            predictions = pipeline.predict(encoder.transform(chunk, inplace=True)[KEEP_COLS])
+            for split, rows in (('train', ~test_rows), ('test', test_rows)):
+                matrix, _ = confusion_matrix(chunk[RESPONSE][rows], predictions[rows], LABELS)
+                matrices[split] = matrices[split] + matrix
+        metrics = {
+            split: metrics_from_confusion_matrix(matrix, LABELS)
+            for split, matrix in matrices.items()
+        }
+        metrics_dir = load_config('metrics')['output_dir'] if metrics_dir is None else metrics_dir
+        save_metrics('sgd', metrics, metrics_dir, f'{metrics_dir}/metrics_history.parquet')
+
+        if model_pth is not None:
+            save_model_artifact(pipeline, model_pth)
+        if encoder_pth is not None:
+            encoder.save(encoder_pth)
+        report = {
+            'model': pipeline,
+            'encoder': encoder,
+            'train_rows': int(np.sum(matrices['train'])),
+            'test_rows': int(np.sum(matrices['test'])),
+            'metrics': metrics,
+        }
+        logging.info(
+            'Streaming training: %d train rows, %d test rows, test accuracy %.4f',
+            report['train_rows'], report['test_rows'], metrics['test']['report']['accuracy']
+        )
+        return report
+    except Exception as err:
+        logging.error('An error occurred during streaming training on %s, %s', pth, err)
+        raise err
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(name)s - %(levelname)s - %(message)s')
+    streaming = load_config('streaming')
+    parser = argparse.ArgumentParser(description='Train the churn model out of core')
+    parser.add_argument('--input', type=str, required=True, help='csv or parquet file')
+    parser.add_argument('--chunk_size', type=int, default=streaming['chunk_size'])
+    parser.add_argument('--test_size', type=float, default=streaming['test_size'])
+    parser.add_argument('--epochs', type=int, default=streaming['epochs'])
+    parser.add_argument('--alpha', type=float, default=streaming['alpha'])
+    parser.add_argument('--model', type=str, default=MODEL_PTH, help='model artifact')
+    parser.add_argument('--encoder', type=str, default=ENCODER_PTH, help='fitted target encoder')
+    args = parser.parse_args()
+
+    result = train_streaming(
+        args.input, args.chunk_size, args.test_size, args.epochs, args.alpha,
+        args.model, args.encoder
+    )
+    print(f"Trained on {result['train_rows']} rows, "
+          f"test accuracy {result['metrics']['test']['report']['accuracy']:.4f}")